@@ -0,0 +1,121 @@
+# ai/counters.py - Write-behind counters for hot-path usage statistics
+#
+# Views call incr(Model, pk, 'field') instead of doing a read-modify-save. Increments
+# are buffered per (model, pk, field) in memory and written by a background flusher
+# (or as soon as the buffer reaches a size threshold) as a handful of
+# UPDATE ... SET field = field + n statements, one per (model, field, n) group.
+#
+# Semantics: a flush runs in a single transaction, so it is applied all-or-nothing;
+# if it fails the whole batch is merged back into the buffer and retried later,
+# so counts are never lost or applied twice because of a DB error. Pending counts
+# are flushed at interpreter shutdown; only a hard kill (SIGKILL, OOM) can lose
+# the increments of at most one flush interval.
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindCounters:
+    """Buffers integer increments and applies them to the database in batches"""
+
+    def __init__(self, flush_interval=10, flush_threshold=500):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def incr(self, model, pk, field, amount=1):
+        """Buffer `amount` to be added to model(pk).field"""
+        if pk is None or not amount:
+            return
+        with self._lock:
+            self._pending[(model, pk, field)] += amount
+            size = len(self._pending)
+        self._ensure_flusher()
+        if size >= self.flush_threshold:
+            self._wakeup.set()
+
+    def pending(self):
+        """Snapshot of buffered increments (for tests and admin views)"""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """Apply every buffered increment; returns the number of rows touched"""
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = Counter()
+            if not batch:
+                return 0
+
+            groups = defaultdict(list)
+            for (model, pk, field), amount in batch.items():
+                groups[(model, field, amount)].append(pk)
+
+            try:
+                with transaction.atomic():
+                    for (model, field, amount), pks in groups.items():
+                        model._default_manager.filter(pk__in=pks).update(**{field: F(field) + amount})
+            except Exception as e:
+                logger.error(f"Counter flush failed, keeping {len(batch)} increments for retry: {e}")
+                with self._lock:
+                    self._pending.update(batch)
+                return 0
+
+            return len(batch)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+counters = WriteBehindCounters(
+    flush_interval=getattr(settings, 'COUNTER_FLUSH_INTERVAL', 10),
+    flush_threshold=getattr(settings, 'COUNTER_FLUSH_THRESHOLD', 500)
+)
+
+
+def incr(model, pk, field, amount=1):
+    """Buffer an increment on the shared write-behind counter service"""
+    counters.incr(model, pk, field, amount)
+
+
+def incr_many(model, pks, field, amount=1):
+    """Buffer the same increment for several rows"""
+    for pk in pks:
+        counters.incr(model, pk, field, amount)
+
+
+def flush():
+    """Flush pending increments now (shutdown hooks, management commands)"""
+    return counters.flush()
+
+
+# Flush-on-shutdown: runs on normal interpreter exit, including graceful worker
+# shutdown under gunicorn/uwsgi; call flush() from custom server hooks as well
+atexit.register(flush)
@@ -0,0 +1,147 @@
+# ai/events.py - Write-behind buffer for append-only analytics rows
+#
+# Rows such as UserAnswer, TransformationHistory and TextComparison are only ever
+# inserted and read back later by reports, so the request does not need to wait
+# for the INSERT. record(instance) appends the unsaved instance to an in-memory
+# buffer; a background flusher bulk_creates everything per model once the buffer
+# reaches EVENT_BUFFER_MAX_SIZE rows or EVENT_BUFFER_FLUSH_INTERVAL seconds pass.
+# Buffered rows get their id (and auto_now_add timestamps) at flush time.
+#
+# Set EVENT_BUFFER_SYNC = True (e.g. in test settings) to save every row
+# immediately instead, so the caller gets a primary key back.
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """Batches model instances and inserts them with one bulk_create per model"""
+
+    def __init__(self, flush_interval=2.0, max_size=200, max_backlog=10000):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_backlog = max_backlog
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def synchronous(self):
+        return getattr(settings, 'EVENT_BUFFER_SYNC', False)
+
+    def record(self, instance):
+        """Queue an unsaved instance for insertion; returns it (saved when in sync mode)"""
+        if self.synchronous:
+            instance.save()
+            return instance
+
+        with self._lock:
+            self._rows.append(instance)
+            size = len(self._rows)
+        self._ensure_flusher()
+        if size >= self.max_size:
+            self._wakeup.set()
+        return instance
+
+    def __len__(self):
+        return len(self._rows)
+
+    def flush(self):
+        """Insert everything buffered so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            by_model = defaultdict(list)
+            for row in rows:
+                by_model[type(row)].append(row)
+
+            written = 0
+            failed = []
+            for model, instances in by_model.items():
+                try:
+                    model.objects.bulk_create(instances, batch_size=self.max_size)
+                    written += len(instances)
+                except Exception as e:
+                    logger.warning(f"Event flush of {len(instances)} {model.__name__} rows failed, retrying row by row: {e}")
+                    saved, retry = self._insert_one_by_one(model, instances)
+                    written += saved
+                    failed.extend(retry)
+
+            if failed:
+                # Keep rows that failed for a transient reason for the next attempt,
+                # but never grow without bound
+                with self._lock:
+                    self._rows = (failed + self._rows)[-self.max_backlog:]
+            return written
+
+    @staticmethod
+    def _insert_one_by_one(model, instances):
+        """Insert rows singly after a failed batch; returns (saved, rows to retry).
+
+        A row that fails with an integrity or data error on its own (e.g. a foreign
+        key to a deleted question) can never succeed and is logged and dropped, so it
+        cannot block the rows behind it. Any other error (the database being down or
+        locked) ends the pass and keeps the remaining rows for the next flush.
+        """
+        saved = 0
+        for i, instance in enumerate(instances):
+            # The failed batch may have assigned ids that were then rolled back
+            instance.pk = None
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([instance])
+                saved += 1
+            except (IntegrityError, DataError) as e:
+                logger.error(f"Dropping {model.__name__} event that cannot be inserted: {e}")
+            except Exception as e:
+                logger.error(f"Event flush of {model.__name__} rows failed, keeping {len(instances) - i} for retry: {e}")
+                return saved, instances[i:]
+        return saved, []
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='event-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+buffer = EventBuffer(
+    flush_interval=getattr(settings, 'EVENT_BUFFER_FLUSH_INTERVAL', 2.0),
+    max_size=getattr(settings, 'EVENT_BUFFER_MAX_SIZE', 200)
+)
+
+
+def record(instance):
+    """Append a row to the shared event buffer"""
+    return buffer.record(instance)
+
+
+def flush():
+    """Write out buffered rows now"""
+    return buffer.flush()
+
+
+atexit.register(flush)
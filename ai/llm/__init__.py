@@ -0,0 +1 @@
+# ai/llm - Shared infrastructure for calls to the local LLM (Ollama) from every app
@@ -0,0 +1,100 @@
+# ai/llm/admission.py - Load shedding for views that wait on the LLM
+#
+# Once LLM_MAX_QUEUE_DEPTH interactive calls are already waiting for a scheduler
+# slot in this process (queued background work never delays them, so it does not
+# count), a new LLM-bound request would only tie up another web
+# worker. It is turned away instead: the view's fallback (e.g. a question from the
+# bank) serves a degraded response, or the client gets 503 with Retry-After.
+# Admitted requests run under a time budget so they release the worker even when
+# Ollama stalls: LLM_REQUEST_BUDGETS[name] for endpoints that need longer (a full
+# rewrite), LLM_REQUEST_BUDGET otherwise.
+import math
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from .budget import request_budget
+from .pool import pool
+from .scheduler import scheduler
+
+
+def max_queue_depth():
+    return getattr(settings, 'LLM_MAX_QUEUE_DEPTH', 4)
+
+
+def is_saturated():
+    """True when the LLM queue is too deep to admit more interactive work"""
+    return scheduler.queue_depth('interactive') >= max_queue_depth()
+
+
+def service_unavailable(retry_after=None):
+    retry_after = retry_after or getattr(settings, 'LLM_OVERLOAD_RETRY_AFTER', 5)
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {'error': 'The AI service is busy. Please try again shortly.', 'retry_after': retry_after},
+        status=503
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def request_budget_seconds(name=None):
+    """Time budget of an admitted request to endpoint `name`"""
+    budgets = getattr(settings, 'LLM_REQUEST_BUDGETS', {})
+    return budgets.get(name) or getattr(settings, 'LLM_REQUEST_BUDGET', 20)
+
+
+def llm_admission(fallback=None, budget=None, name=None):
+    """Shed load when the LLM queue is saturated and bound the time an admitted request may take.
+    
+    `fallback(request, *args, **kwargs)` may return a degraded response to serve
+    instead of 503 (returning None falls through to 503). The budget is `budget`
+    seconds, else the endpoint's entry in LLM_REQUEST_BUDGETS (`name`, as in
+    LLM_RATE_LIMIT_COSTS). Works on sync and async views; an async view's fallback
+    is still a plain function and runs in a thread.
+    """
+    def decorator(view_func):
+        def budget_seconds():
+            return budget or request_budget_seconds(name)
+        
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if is_saturated():
+                    scheduler.record_rejection('interactive')
+                    response = await sync_to_async(fallback)(request, *args, **kwargs) if fallback else None
+                    return response if response is not None else service_unavailable()
+                
+                with request_budget(budget_seconds()):
+                    return await view_func(request, *args, **kwargs)
+            return async_wrapper
+        
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if is_saturated():
+                scheduler.record_rejection('interactive')
+                response = fallback(request, *args, **kwargs) if fallback else None
+                return response if response is not None else service_unavailable()
+            
+            with request_budget(budget_seconds()):
+                return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def readiness():
+    """Current LLM load for health checks and load balancers"""
+    stats = scheduler.stats()
+    depth = stats['classes']['interactive']['queued']
+    healthy = sum(1 for backend in pool.stats() if backend['healthy'])
+    return {
+        'ready': depth < max_queue_depth() and healthy > 0,
+        'healthy_backends': healthy,
+        'queue_depth': depth,
+        'queue_depth_total': stats['queued'],
+        'max_queue_depth': max_queue_depth(),
+        'running': stats['running'],
+        'max_concurrency': stats['max_concurrency'],
+    }
@@ -0,0 +1,43 @@
+# ai/llm/budget.py - Per-request time budget for LLM work
+#
+# An LLM-bound view runs inside `with request_budget(seconds):`. Everything that
+# waits on the model (the scheduler queue, the HTTP call to Ollama, retry loops)
+# asks remaining() how long it may still take, so a web worker is released once
+# the budget is spent no matter how slow Ollama is.
+import contextvars
+import time
+from contextlib import contextmanager
+
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+@contextmanager
+def request_budget(seconds):
+    """Limit LLM work inside the block to `seconds` of wall time (nested budgets only shrink)"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(default=None):
+    """Seconds left in the current budget (never negative); `default` when there is none"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+def cap(timeout):
+    """`timeout` shortened to the remaining budget (None means no limit)"""
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
+def exhausted():
+    return remaining() == 0.0
@@ -0,0 +1,165 @@
+# ai/llm/client.py - HTTP helpers for Ollama: the async client used by the ASGI views
+# and streaming generation with early stop for both stacks
+#
+# httpx is imported lazily so the synchronous WSGI deployment does not need it.
+# One AsyncClient (with its connection pool) is kept per event loop; under an ASGI
+# server that is one client for the whole process.
+#
+# stream_generate()/astream_generate() read /api/generate as a token stream and hand
+# every chunk to `until`; when it returns True the connection is closed, which makes
+# Ollama cancel the rest of the generation.
+import asyncio
+import json
+import time
+import weakref
+
+import requests
+from django.conf import settings
+
+from . import budget
+
+_clients = weakref.WeakKeyDictionary()
+
+
+class OllamaUnavailable(Exception):
+    """The async client could not get a response from Ollama
+
+    `status` is the HTTP status Ollama answered with, None when no response came
+    back at all (connection error or timeout).
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class OllamaTimeout(OllamaUnavailable):
+    """Ollama did not answer within the timeout"""
+
+
+class OllamaRejected(OllamaUnavailable):
+    """Ollama answered 4xx (e.g. 404 model not found): the request or model is at fault, not the server"""
+
+
+def _status_error(e):
+    status = e.response.status_code
+    error = OllamaRejected if 400 <= status < 500 else OllamaUnavailable
+    return error(f"Ollama request failed: {e}", status=status)
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for the running event loop"""
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=getattr(settings, 'LLM_MAX_CONCURRENCY', 2) * 2,
+                max_keepalive_connections=getattr(settings, 'LLM_MAX_CONCURRENCY', 2)
+            )
+        )
+        _clients[loop] = client
+    return client
+
+
+async def apost_json(url, payload, timeout):
+    """POST a JSON payload and return the decoded JSON body (raises OllamaUnavailable/OllamaTimeout/OllamaRejected)"""
+    import httpx
+
+    try:
+        response = await get_async_client().post(url, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except httpx.TimeoutException as e:
+        raise OllamaTimeout(f"Ollama timed out after {timeout}s") from e
+    except httpx.HTTPStatusError as e:
+        raise _status_error(e) from e
+    except httpx.HTTPError as e:
+        raise OllamaUnavailable(f"Ollama request failed: {e}") from e
+
+
+def _stopped_early(parts):
+    # Ollama only sends its counters with the final chunk; one chunk is about one token
+    return {'done_reason': 'stopped_early', 'eval_count': len(parts)}
+
+
+def _finish_stream(result, parts, started, first_token_at):
+    result['response'] = ''.join(parts)
+    if first_token_at is not None:
+        # Time to first token (ns, like Ollama's durations): mostly prompt evaluation,
+        # and the only prompt figure available when the stream was stopped early
+        result['first_token_duration'] = int((first_token_at - started) * 1e9)
+    return result
+
+
+def stream_generate(url, payload, timeout, until):
+    """Stream /api/generate, stopping once until(chunk) is true; returns the final result dict.
+
+    `response` holds the text generated so far. Raises requests exceptions like a
+    plain requests.post (Timeout also when the request budget runs out).
+    """
+    parts = []
+    result = None
+    started, first_token_at = time.monotonic(), None
+    with requests.post(url, json={**payload, 'stream': True}, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise requests.exceptions.RequestException(f"Ollama error: {chunk['error']}")
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            parts.append(chunk.get('response', ''))
+            stop = until(parts[-1])
+            if chunk.get('done'):
+                result = chunk
+                break
+            if stop:
+                result = _stopped_early(parts)
+                break
+            if budget.exhausted():
+                raise requests.exceptions.Timeout("request time budget spent while streaming")
+
+    return _finish_stream(result or _stopped_early(parts), parts, started, first_token_at)
+
+
+async def astream_generate(url, payload, timeout, until):
+    """Async stream_generate() (raises OllamaUnavailable/OllamaTimeout/OllamaRejected)"""
+    import httpx
+
+    parts = []
+    result = None
+    started, first_token_at = time.monotonic(), None
+    try:
+        async with get_async_client().stream('POST', url, json={**payload, 'stream': True}, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise OllamaUnavailable(f"Ollama error: {chunk['error']}", status=response.status_code)
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                parts.append(chunk.get('response', ''))
+                stop = until(parts[-1])
+                if chunk.get('done'):
+                    result = chunk
+                    break
+                if stop:
+                    result = _stopped_early(parts)
+                    break
+                if budget.exhausted():
+                    raise OllamaTimeout("request time budget spent while streaming")
+    except httpx.TimeoutException as e:
+        raise OllamaTimeout(f"Ollama timed out after {timeout}s") from e
+    except httpx.HTTPStatusError as e:
+        raise _status_error(e) from e
+    except httpx.HTTPError as e:
+        raise OllamaUnavailable(f"Ollama request failed: {e}") from e
+
+    return _finish_stream(result or _stopped_early(parts), parts, started, first_token_at)
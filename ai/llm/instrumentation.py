@@ -0,0 +1,231 @@
+# ai/llm/instrumentation.py - Per-call LLM figures, outcomes and a sampled call log
+#
+# routing.observe() hands every finished call here with its task, model, attempt
+# number, the time it queued for a scheduler slot and Ollama's counters (prompt_eval_count, eval_count, load_duration,
+# prompt_eval_duration, eval_duration, total_duration). They go into histograms in
+# the shared ai.metrics registry, labelled by task and model, and, for a
+# LLM_CALL_LOG_SAMPLE_RATE fraction of calls, into an LLMCallLog row written
+# through the ai.events buffer.
+#
+# Every call ends with one outcome:
+#   ok        answered (tasks whose output nobody validates)
+#   parsed    a question that parsed and passed validate_question_quality()
+#   rejected  a question that parsed but the validator turned down
+#   unparsed  an answer that was no usable MCQ
+#   malformed a stream abandoned by the question parser
+#   timeout   Ollama (or the request budget) timed out
+#   error     any other failure
+# Calls observed with validated=True keep their outcome open until the caller
+# reports it with resolve(); the open call is tracked in a context variable, so the
+# report reaches the call made by the same request (thread or task).
+#
+# summary() turns the totals into tokens/sec per task and model and the cost of a
+# served question: model time and tokens spent on all question calls (rejected,
+# unparsed and failed ones included) per question that was accepted. Model time is
+# Ollama's total_duration, or the wall time when Ollama sent none; with
+# LLM_GPU_HOUR_COST set it is also priced.
+import contextvars
+import logging
+import random
+
+import requests
+from django.apps import apps
+from django.conf import settings
+
+from ai import events, metrics
+from .client import OllamaTimeout
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ('ok', 'parsed', 'rejected', 'unparsed', 'malformed', 'timeout', 'error')
+
+metrics.registry.histogram('llm_call_seconds', (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+metrics.registry.histogram('llm_queue_seconds', (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+metrics.registry.histogram('llm_load_seconds', (0.1, 0.5, 1, 2, 5, 10, 30, 60))
+metrics.registry.histogram('llm_prompt_tokens', (16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+metrics.registry.histogram('llm_completion_tokens', (8, 16, 32, 64, 128, 256, 512, 1024, 2048))
+metrics.registry.histogram('llm_tokens_per_second', (1, 2, 5, 10, 20, 40, 80, 160))
+
+_pending = contextvars.ContextVar('llm_pending_call', default=None)
+
+
+def _ms(nanoseconds):
+    return round(nanoseconds / 1e6, 1) if nanoseconds is not None else None
+
+
+def call_outcome(call):
+    """Outcome of a call as far as the transport can tell"""
+    if isinstance(call.error, (requests.exceptions.Timeout, OllamaTimeout)):
+        return 'timeout'
+    if call.failed or call.response is None:
+        return 'error'
+    if call.response.get('done_reason') == 'malformed':
+        return 'malformed'
+    return 'ok'
+
+
+class CallInstrumentation:
+    """Feeds finished calls into the metrics registry and the sampled call log"""
+
+    def __init__(self, registry, sample_rate=0.0, log_model='quiz.LLMCallLog', gpu_hour_cost=None):
+        self.registry = registry
+        self.sample_rate = sample_rate
+        self.log_model = log_model
+        self.gpu_hour_cost = gpu_hour_cost
+
+    def record(self, call, elapsed, validated=False):
+        """Record a finished RouteCall; with `validated` its outcome waits for resolve()"""
+        response = call.response or {}
+        record = {
+            'task': call.task or call.route.name,
+            'route': call.route.name,
+            'model': call.model,
+            'attempt': call.attempt,
+            'label': call.label or '',
+            'outcome': call_outcome(call),
+            'done_reason': response.get('done_reason') or '',
+            'prompt_eval_count': response.get('prompt_eval_count'),
+            'eval_count': response.get('eval_count'),
+            'load_ms': _ms(response.get('load_duration')),
+            'prompt_eval_ms': _ms(response.get('prompt_eval_duration')),
+            'eval_ms': _ms(response.get('eval_duration')),
+            'total_ms': _ms(response.get('total_duration')),
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'queue_ms': call.queue_ms,
+        }
+
+        labels = {'task': record['task'], 'model': record['model']}
+        self.registry.observe('llm_call_seconds', elapsed, labels)
+        if record['queue_ms'] is not None:
+            self.registry.observe('llm_queue_seconds', record['queue_ms'] / 1000, labels)
+        metrics.add_to_request('llm_seconds', elapsed)
+        model_seconds = response['total_duration'] / 1e9 if response.get('total_duration') else elapsed
+        self.registry.inc('llm_model_seconds_total', labels, model_seconds)
+        if record['load_ms'] is not None:
+            self.registry.observe('llm_load_seconds', record['load_ms'] / 1000, labels)
+        if record['prompt_eval_count'] is not None:
+            self.registry.observe('llm_prompt_tokens', record['prompt_eval_count'], labels)
+            self.registry.inc('llm_prompt_tokens_total', labels, record['prompt_eval_count'])
+        if record['eval_count'] is not None:
+            self.registry.observe('llm_completion_tokens', record['eval_count'], labels)
+            self.registry.inc('llm_completion_tokens_total', labels, record['eval_count'])
+        if record['eval_count'] and record['eval_ms']:
+            self.registry.observe('llm_tokens_per_second', record['eval_count'] / (record['eval_ms'] / 1000), labels)
+            self.registry.inc('llm_eval_tokens_total', labels, record['eval_count'])
+            self.registry.inc('llm_eval_seconds_total', labels, record['eval_ms'] / 1000)
+
+        if validated and record['outcome'] == 'ok':
+            previous = _pending.get()
+            if previous is not None:
+                # Never reported (e.g. the caller raised); keep it as a plain answer
+                self._close(previous)
+            _pending.set(record)
+        else:
+            self._close(record)
+        return record
+
+    def resolve(self, outcome):
+        """Set the outcome of this context's open call ('parsed', 'rejected', 'unparsed')"""
+        record = _pending.get()
+        if record is None:
+            return None
+        _pending.set(None)
+        record['outcome'] = outcome
+        self._close(record)
+        return record
+
+    def _close(self, record):
+        self.registry.inc('llm_calls_total', {'task': record['task'], 'model': record['model'], 'outcome': record['outcome']})
+        if self.sample_rate and random.random() < self.sample_rate:
+            try:
+                events.record(apps.get_model(self.log_model)(**record))
+            except Exception as e:
+                logger.error(f"LLM call log write failed: {e}")
+
+    def summary(self):
+        """Tokens/sec per task and model, and the cost of a served question"""
+        tasks = {}
+        models = {}
+
+        def add(group, key, field, value):
+            entry = group.setdefault(key, {'calls': 0, 'outcomes': {}})
+            entry[field] = entry.get(field, 0) + value
+
+        for labels, value in self.registry.counters('llm_calls_total').items():
+            labels = dict(labels)
+            for group, key in ((tasks, labels['task']), (models, labels['model'])):
+                add(group, key, 'calls', value)
+                outcomes = group[key]['outcomes']
+                outcomes[labels['outcome']] = outcomes.get(labels['outcome'], 0) + value
+
+        for name in ('llm_model_seconds_total', 'llm_prompt_tokens_total', 'llm_completion_tokens_total',
+                     'llm_eval_tokens_total', 'llm_eval_seconds_total'):
+            field = name[len('llm_'):-len('_total')]
+            for labels, value in self.registry.counters(name).items():
+                labels = dict(labels)
+                add(tasks, labels['task'], field, value)
+                add(models, labels['model'], field, value)
+
+        for labels, histogram in self.registry.histograms('llm_call_seconds').items():
+            labels = dict(labels)
+            entry = tasks.setdefault(labels['task'], {'calls': 0, 'outcomes': {}})
+            entry.setdefault('latency', {})[labels['model']] = {
+                'p50_seconds': round(histogram.quantile(0.5), 3),
+                'p95_seconds': round(histogram.quantile(0.95), 3),
+            }
+
+        per_served_question = self._per_served_question(tasks)
+        return {
+            'tasks': {task: self._figures(entry) for task, entry in sorted(tasks.items())},
+            'models': {model: self._figures(entry) for model, entry in sorted(models.items())},
+            'per_served_question': per_served_question,
+            'sample_rate': self.sample_rate,
+        }
+
+    @staticmethod
+    def _figures(entry):
+        calls = entry['calls']
+        eval_seconds = entry.pop('eval_seconds', 0)
+        eval_tokens = entry.pop('eval_tokens', 0)
+        entry['model_seconds'] = round(entry.get('model_seconds', 0), 2)
+        entry['tokens_per_second'] = round(eval_tokens / eval_seconds, 1) if eval_seconds else 0
+        entry['avg_prompt_tokens'] = round(entry.get('prompt_tokens', 0) / calls, 1) if calls else 0
+        entry['avg_completion_tokens'] = round(entry.get('completion_tokens', 0) / calls, 1) if calls else 0
+        return entry
+
+    def _per_served_question(self, tasks):
+        questions = [entry for task, entry in tasks.items() if task.split(':', 1)[0] == 'question']
+        served = sum(entry['outcomes'].get('parsed', 0) for entry in questions)
+        model_seconds = sum(entry.get('model_seconds', 0) for entry in questions)
+        figures = {
+            'served': served,
+            'calls': round(sum(entry['calls'] for entry in questions) / served, 2) if served else None,
+            'model_seconds': round(model_seconds / served, 2) if served else None,
+            'prompt_tokens': round(sum(entry.get('prompt_tokens', 0) for entry in questions) / served, 1) if served else None,
+            'completion_tokens': round(sum(entry.get('completion_tokens', 0) for entry in questions) / served, 1) if served else None,
+            'cost': None,
+        }
+        if served and self.gpu_hour_cost is not None:
+            figures['cost'] = round(model_seconds / served / 3600 * self.gpu_hour_cost, 6)
+        return figures
+
+
+instrumentation = CallInstrumentation(
+    metrics.registry,
+    sample_rate=getattr(settings, 'LLM_CALL_LOG_SAMPLE_RATE', 0.0),
+    log_model=getattr(settings, 'LLM_CALL_LOG_MODEL', 'quiz.LLMCallLog'),
+    gpu_hour_cost=getattr(settings, 'LLM_GPU_HOUR_COST', None)
+)
+
+
+def record(call, elapsed, validated=False):
+    return instrumentation.record(call, elapsed, validated)
+
+
+def resolve(outcome):
+    """Report the outcome of the open call made in this context"""
+    return instrumentation.resolve(outcome)
+
+
+def summary():
+    return instrumentation.summary()
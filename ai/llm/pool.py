@@ -0,0 +1,218 @@
+# ai/llm/pool.py - Pool of Ollama backends with health checks and load balancing
+#
+# OLLAMA_BACKENDS lists the base URLs of every inference box. Each call leases one:
+#
+#     with pool.lease() as backend:
+#         requests.post(backend.url('/api/generate'), ...)
+#
+# Selection is least-outstanding-requests among healthy backends, ties broken by
+# recent failures and then by latency EWMA. A backend is ejected after
+# OLLAMA_EJECT_AFTER consecutive failures (connection errors, transport timeouts,
+# 5xx responses, or mark_failed()) and reinstated once an active health check
+# (GET /api/tags every OLLAMA_HEALTH_INTERVAL seconds) succeeds again. If every
+# backend is ejected, all of them are tried rather than failing outright.
+#
+# Anything else that ends a lease early says nothing about the backend and is not
+# counted either way: a cancelled request or stopped stream, a spent request
+# budget, a 4xx such as "model not found" (the route moves on to its next model).
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from . import budget
+from .client import OllamaTimeout, OllamaUnavailable
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = '/api/tags'
+
+
+class Backend:
+    """One Ollama server and its live load/latency/health figures"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.outstanding = 0
+        self.ewma_ms = None
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejected_at = None
+        self.last_check = None
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def snapshot(self):
+        return {
+            'url': self.base_url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'ewma_ms': round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'ejected_at': self.ejected_at.isoformat() if self.ejected_at else None,
+            'last_check': self.last_check.isoformat() if self.last_check else None,
+        }
+
+
+def is_backend_failure(exc):
+    """True when an exception raised under a lease means the backend itself is in trouble"""
+    if isinstance(exc, (requests.exceptions.Timeout, OllamaTimeout)):
+        # A timeout cut short by the request budget is the caller running out of time
+        return not budget.exhausted()
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return exc.response is None or exc.response.status_code >= 500
+    if isinstance(exc, OllamaUnavailable):
+        return exc.status is None or exc.status >= 500
+    return False
+
+
+class Lease:
+    """A backend held for one request; records its outcome when released"""
+
+    def __init__(self, pool, backend):
+        self.pool = pool
+        self.backend = backend
+        self.failed = False
+        self.abandoned = False
+        self.started = time.monotonic()
+
+    def url(self, path):
+        return self.backend.url(path)
+
+    def mark_failed(self):
+        """Count the request as failed although no exception was raised (e.g. HTTP 500)"""
+        self.failed = True
+
+
+class BackendPool:
+    """Least-outstanding load balancer over Ollama servers with passive and active health checks"""
+
+    def __init__(self, urls, eject_after=3, health_interval=10, health_timeout=2, ewma_alpha=0.3):
+        self.backends = [Backend(url) for url in urls]
+        self.eject_after = eject_after
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def _choose(self):
+        candidates = [b for b in self.backends if b.healthy] or self.backends
+        return min(candidates, key=lambda b: (
+            b.outstanding,
+            b.consecutive_failures,
+            b.ewma_ms if b.ewma_ms is not None else 0
+        ))
+
+    @contextmanager
+    def lease(self):
+        """Hold the best backend for the duration of one request"""
+        self._ensure_checker()
+        with self._lock:
+            backend = self._choose()
+            backend.outstanding += 1
+            backend.requests += 1
+        lease = Lease(self, backend)
+        try:
+            yield lease
+        except BaseException as e:
+            if is_backend_failure(e):
+                lease.failed = True
+            else:
+                lease.abandoned = True
+            raise
+        finally:
+            self._release(lease)
+
+    def _release(self, lease):
+        backend = lease.backend
+        elapsed_ms = (time.monotonic() - lease.started) * 1000
+        with self._lock:
+            backend.outstanding -= 1
+            if lease.failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.healthy and backend.consecutive_failures >= self.eject_after:
+                    self._eject(backend, f"{backend.consecutive_failures} consecutive failures")
+            elif not lease.abandoned:
+                backend.consecutive_failures = 0
+                if backend.ewma_ms is None:
+                    backend.ewma_ms = elapsed_ms
+                else:
+                    backend.ewma_ms += self.ewma_alpha * (elapsed_ms - backend.ewma_ms)
+
+    def _eject(self, backend, reason):
+        backend.healthy = False
+        backend.ejected_at = timezone.now()
+        logger.warning(f"Ollama backend {backend.base_url} ejected: {reason}")
+
+    def check(self, backend):
+        """Probe one backend and eject or reinstate it accordingly"""
+        try:
+            response = requests.get(backend.url(HEALTH_PATH), timeout=self.health_timeout)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+
+        with self._lock:
+            backend.last_check = timezone.now()
+            if ok and not backend.healthy:
+                backend.healthy = True
+                backend.consecutive_failures = 0
+                backend.ejected_at = None
+                logger.info(f"Ollama backend {backend.base_url} reinstated")
+            elif not ok and backend.healthy:
+                self._eject(backend, "health check failed")
+        return ok
+
+    def check_all(self):
+        return {backend.base_url: self.check(backend) for backend in self.backends}
+
+    def _ensure_checker(self):
+        if self._checker is not None and self._checker.is_alive():
+            return
+        with self._lock:
+            if self._checker is not None and self._checker.is_alive():
+                return
+            self._checker = threading.Thread(target=self._run_checks, name='ollama-health', daemon=True)
+            self._checker.start()
+
+    def _run_checks(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Ollama health check loop error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return [backend.snapshot() for backend in self.backends]
+
+
+pool = BackendPool(
+    getattr(settings, 'OLLAMA_BACKENDS', ['http://127.0.0.1:11434']),
+    eject_after=getattr(settings, 'OLLAMA_EJECT_AFTER', 3),
+    health_interval=getattr(settings, 'OLLAMA_HEALTH_INTERVAL', 10),
+    health_timeout=getattr(settings, 'OLLAMA_HEALTH_TIMEOUT', 2),
+)
+
+
+def lease():
+    """Lease a backend from the shared pool (see BackendPool.lease)"""
+    return pool.lease()
+
+
+def stats():
+    return pool.stats()
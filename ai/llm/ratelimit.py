@@ -0,0 +1,158 @@
+# ai/llm/ratelimit.py - Cost-weighted token buckets for endpoints that call the LLM
+#
+# Each client (user id when logged in, otherwise IP) has a bucket of LLM "tokens"
+# in the shared cache, so the limit holds across all web workers. A request spends
+# the expected LLM cost of its endpoint (LLM_RATE_LIMIT_COSTS); tokens refill
+# continuously. A request that cannot pay gets 429 with Retry-After set to when
+# enough tokens will have refilled.
+#
+# The decorator also tags the request's LLM calls with the client as scheduler
+# owner, so the scheduler can round-robin between clients when Ollama is busy.
+#
+# Buckets live in their own cache alias (LLM_RATE_LIMIT_CACHE), so they are never
+# culled to make room for unrelated entries; a culled bucket would come back full.
+# Bucket updates hold a short lock taken with cache.add(), which is atomic on the
+# database cache, Redis and Memcached; if the lock cannot be taken in time the
+# update goes ahead unlocked rather than blocking the request.
+#
+# Anonymous clients are keyed by REMOTE_ADDR. X-Forwarded-For is only read when
+# LLM_RATE_LIMIT_TRUSTED_PROXIES says how many proxies append to it, and then
+# only the entry written by the outermost trusted proxy is used: everything to
+# its left comes from the client and can be anything.
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from .scheduler import use_owner
+
+DEFAULT_BUCKETS = {
+    # capacity: burst size in tokens; refill: tokens regained per second
+    'user': {'capacity': 30, 'refill': 0.25},
+    'anon': {'capacity': 10, 'refill': 0.05},
+}
+LOCK_TIMEOUT = 2
+LOCK_WAIT = 0.05
+
+
+def _cache():
+    return caches[getattr(settings, 'LLM_RATE_LIMIT_CACHE', 'ratelimit')]
+
+
+def client_ip(request):
+    """Client address that the client itself cannot choose (see LLM_RATE_LIMIT_TRUSTED_PROXIES)"""
+    proxies = getattr(settings, 'LLM_RATE_LIMIT_TRUSTED_PROXIES', 0)
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def client_identity(request):
+    """('user', 'user:<id>') for authenticated requests, ('anon', 'ip:<addr>') otherwise"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user', f'user:{user.id}'
+    return 'anon', f'ip:{client_ip(request)}'
+
+
+def get_cost(name, default=1):
+    return getattr(settings, 'LLM_RATE_LIMIT_COSTS', {}).get(name, default)
+
+
+class TokenBucket:
+    """A refilling token bucket stored as {'tokens', 'ts'} under one cache key"""
+
+    def __init__(self, key, capacity, refill):
+        self.key = f'llm-bucket:{key}'
+        self.capacity = capacity
+        self.refill = refill
+
+    def _lock(self, cache):
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(f'{self.key}:lock', 1, LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def consume(self, cost):
+        """Take `cost` tokens; returns (allowed, retry_after_seconds, tokens_left)"""
+        cache = _cache()
+        locked = self._lock(cache)
+        try:
+            now = time.time()
+            state = cache.get(self.key) or {'tokens': self.capacity, 'ts': now}
+            tokens = min(self.capacity, state['tokens'] + (now - state['ts']) * self.refill)
+            
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = True, 0
+            else:
+                allowed = False
+                # A cost above capacity can never be paid in one go; wait for a full bucket
+                retry_after = (min(cost, self.capacity) - tokens) / self.refill
+            
+            # Idle buckets expire once they would have refilled anyway
+            cache.set(self.key, {'tokens': tokens, 'ts': now}, int(self.capacity / self.refill) + 60)
+            return allowed, retry_after, tokens
+        finally:
+            if locked:
+                cache.delete(f'{self.key}:lock')
+
+
+def get_bucket(kind, identity):
+    options = getattr(settings, 'LLM_RATE_LIMIT_BUCKETS', DEFAULT_BUCKETS)[kind]
+    return TokenBucket(identity, options['capacity'], options['refill'])
+
+
+def too_many_requests(retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {'error': 'Too many AI requests. Please wait and try again.', 'retry_after': retry_after},
+        status=429
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def charge(request, name):
+    """Charge the request's LLM cost; returns (429 response or None, client identity)"""
+    kind, identity = client_identity(request)
+    if not getattr(settings, 'LLM_RATE_LIMIT_ENABLED', True):
+        return None, identity
+    allowed, retry_after, _ = get_bucket(kind, identity).consume(get_cost(name))
+    return (None if allowed else too_many_requests(retry_after)), identity
+
+
+def llm_rate_limit(name):
+    """Charge the endpoint's LLM cost (LLM_RATE_LIMIT_COSTS[name]) to the client's bucket.
+    
+    Works on function views (sync or async) and, via method_decorator, on
+    class-based/DRF views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                # request.user and the cache are synchronous APIs
+                rejected, identity = await sync_to_async(charge)(request, name)
+                if rejected is not None:
+                    return rejected
+                with use_owner(identity):
+                    return await view_func(request, *args, **kwargs)
+            return async_wrapper
+        
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            rejected, identity = charge(request, name)
+            if rejected is not None:
+                return rejected
+            with use_owner(identity):
+                return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,362 @@
+# ai/llm/routing.py - Task-aware model routing with per-route latency and token metrics
+#
+# Every LLM call names the task it performs ('question:कठिन', 'explanation',
+# 'grammar', ...). LLM_ROUTES maps a task to the model that serves it, option
+# overrides merged over the caller's defaults, and fallback models:
+#
+#     route = routing.resolve('explanation')
+#     payload = route.payload(prompt, {'temperature': 0.4}, model=route.model_for(attempt))
+#     with scheduler.slot() as queued, routing.observe(route, payload, queued=queued) as call:
+#         ... post payload ...
+#         call.record(response_json)
+#
+# A task is looked up exactly, then by the part before ':' ('question:कठिन' ->
+# 'question'), then under 'default'. Callers move to the next model in
+# route.models when a call fails (model not pulled on the backend, errors,
+# timeouts), so a small model can be tried first with the big one behind it.
+#
+# Metrics are kept per (route, model) in this process: calls, failures, calls
+# answered by a fallback, latency (avg/p50/p95/max), Ollama's token counts
+# (prompt_eval_count, eval_count, eval_duration -> tokens/s) and how many answers
+# were cut off by num_predict, stopped early by a stream parser (complete) or
+# abandoned as malformed. They are what to look at before moving a cheap
+# task to a smaller model or changing its budget in LLM_ROUTES.
+#
+# Unless the caller or the route pins num_ctx, payload() sizes it from the prompt:
+# estimated prompt tokens + num_predict, rounded up to the next of LLM_CTX_SIZES.
+# Prompt tokens are estimated from the tokens/char ratio Ollama reported for the
+# route's recent prompts (a script-based guess until the first answer arrives).
+# Ollama reloads a model (and drops its KV cache) whenever num_ctx changes, so a
+# model's num_ctx only ever grows: once any route has sent it 4096, smaller prompts
+# for the same model reuse 4096 instead of switching back to 2048.
+#
+# Prompt prefix reuse: Ollama skips evaluating the leading tokens a prompt shares
+# with the previous one in the same slot. Callers put everything fixed in `system`
+# (it is templated first) and the varying part in `prompt`; LLM_KEEP_ALIVE keeps
+# the model, and with it that cache, loaded between calls. prompt_eval_count and
+# prompt_eval_duration then cover only the uncached suffix, and are broken down
+# per `label` (e.g. quiz domain) to show the saving. Streams stopped early never
+# get Ollama's counters, so their time to first token is recorded instead.
+#
+# Cold vs warm: a call is cold when Ollama had to load the model first, i.e. its
+# load_duration (or, for streams stopped early, the time to first token) is at
+# least LLM_COLD_START_SECONDS. Latency is reported separately for both kinds.
+#
+# Each finished call is also passed to ai.llm.instrumentation with its task and
+# attempt number, for per-call histograms, outcomes and the sampled call log, and
+# is an 'ollama.generate' span when the request is traced (ai/tracing.py).
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from ai import tracing
+
+from . import instrumentation
+
+DEFAULT_MODEL = 'llama3'
+DEFAULT_CTX_SIZES = (2048, 4096, 8192)
+
+
+class Route:
+    """Model, option overrides and fallback models for one task"""
+
+    def __init__(self, name, model=DEFAULT_MODEL, options=None, fallbacks=(), ctx_sizes=DEFAULT_CTX_SIZES,
+                 model_ctx=None, keep_alive=None):
+        self.name = name
+        self.model = model
+        self.options = dict(options or {})
+        self.models = [model] + [m for m in fallbacks if m != model]
+        self.ctx_sizes = sorted(ctx_sizes)
+        self.model_ctx = model_ctx if model_ctx is not None else {}  # model -> largest num_ctx sent, shared by routes
+        self.keep_alive = keep_alive
+        self.token_ratio = None  # prompt tokens per character, slowly decaying maximum
+
+    def model_for(self, attempt):
+        """Model to use on the given attempt; stays on the last fallback once exhausted"""
+        return self.models[min(attempt, len(self.models) - 1)]
+
+    def estimate_tokens(self, text):
+        """Approximate token count of `text` for this route's model"""
+        if self.token_ratio:
+            return int(len(text) * self.token_ratio) + 1
+        # Before any measurement: Devanagari costs about a token per character, English far less
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return int(ascii_chars * 0.3 + (len(text) - ascii_chars)) + 1
+
+    def observe_prompt(self, chars, tokens):
+        # Keep the highest recent ratio; prompts served from Ollama's cache report fewer tokens
+        if chars and tokens:
+            ratio = tokens / chars
+            self.token_ratio = max(ratio, (self.token_ratio or 0) * 0.999)
+
+    def context_size(self, prompt, num_predict=0):
+        """Smallest configured num_ctx that holds the prompt and the answer"""
+        needed = self.estimate_tokens(prompt) + max(num_predict or 0, 0)
+        for size in self.ctx_sizes:
+            if size >= needed:
+                return size
+        return self.ctx_sizes[-1]
+
+    def payload(self, prompt, options=None, model=None, system=None, **extra):
+        """Request body for Ollama's /api/generate with the route's options applied"""
+        model = model or self.model
+        options = {**(options or {}), **self.options}
+        if not options.get('num_ctx'):
+            needed = self.context_size((system or '') + prompt, options.get('num_predict'))
+            options['num_ctx'] = self.model_ctx[model] = max(needed, self.model_ctx.get(model, 0))
+        payload = {
+            'model': model,
+            'prompt': prompt,
+            'stream': False,
+            'options': options,
+            **extra,
+        }
+        if system:
+            payload['system'] = system
+        if self.keep_alive is not None:
+            payload.setdefault('keep_alive', self.keep_alive)
+        return payload
+
+
+class RouteMetrics:
+    """Running figures for one (route, model) pair"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.fallback_calls = 0
+        self.truncated = 0
+        self.stopped_early = 0
+        self.malformed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.recent_latencies = deque(maxlen=500)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.eval_seconds = 0.0
+        self.prompt_eval_seconds = 0.0
+        self.first_token_seconds = 0.0
+        self.streamed = 0
+        self.cold_starts = 0
+        self.cold_latency_total = 0.0
+        self.warm_calls = 0
+        self.warm_latency_total = 0.0
+        self.labels = {}  # label -> Counter of calls, prompt eval tokens/seconds, time to first token
+
+    def snapshot(self):
+        ok = self.calls - self.failures
+        latencies = sorted(self.recent_latencies)
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'fallback_calls': self.fallback_calls,
+            'truncated': self.truncated,
+            'stopped_early': self.stopped_early,
+            'malformed': self.malformed,
+            'avg_latency_ms': round(self.latency_total / ok * 1000, 1) if ok else 0,
+            'max_latency_ms': round(self.latency_max * 1000, 1),
+            'p50_latency_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0,
+            'p95_latency_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'avg_prompt_tokens': round(self.prompt_tokens / ok, 1) if ok else 0,
+            'avg_completion_tokens': round(self.completion_tokens / ok, 1) if ok else 0,
+            'tokens_per_second': round(self.completion_tokens / self.eval_seconds, 1) if self.eval_seconds else 0,
+            'avg_prompt_eval_ms': round(self.prompt_eval_seconds / ok * 1000, 1) if ok else 0,
+            'avg_first_token_ms': round(self.first_token_seconds / self.streamed * 1000, 1) if self.streamed else 0,
+            'cold_starts': self.cold_starts,
+            'avg_cold_latency_ms': round(self.cold_latency_total / self.cold_starts * 1000, 1) if self.cold_starts else 0,
+            'avg_warm_latency_ms': round(self.warm_latency_total / self.warm_calls * 1000, 1) if self.warm_calls else 0,
+            'labels': {label: self._label_snapshot(counts) for label, counts in self.labels.items()},
+        }
+
+    @staticmethod
+    def _label_snapshot(counts):
+        evaluated = counts['prompt_evals']
+        streamed = counts['streamed']
+        return {
+            'calls': counts['calls'],
+            'avg_prompt_eval_tokens': round(counts['prompt_tokens'] / evaluated, 1) if evaluated else None,
+            'avg_prompt_eval_ms': round(counts['prompt_eval_seconds'] / evaluated * 1000, 1) if evaluated else None,
+            'avg_first_token_ms': round(counts['first_token_seconds'] / streamed * 1000, 1) if streamed else None,
+        }
+
+
+class RouteCall:
+    """One observed call; record() the Ollama response JSON or fail() it"""
+
+    def __init__(self, route, payload, label=None, task=None, attempt=0, queued=None):
+        self.route = route
+        self.label = label
+        self.task = task
+        self.attempt = attempt
+        self.queue_ms = round(queued * 1000, 1) if queued is not None else None
+        self.model = payload['model']
+        self.prompt_chars = len(payload['prompt']) + len(payload.get('system', ''))
+        self.response = None
+        self.failed = False
+        self.error = None
+        self.started = time.monotonic()
+
+    def record(self, response_json):
+        self.response = response_json or {}
+
+    def fail(self):
+        self.failed = True
+
+
+class ModelRouter:
+    """Resolves tasks to routes and collects per-route metrics"""
+
+    def __init__(self, routes, ctx_sizes=DEFAULT_CTX_SIZES, keep_alive=None, cold_start_seconds=2.0):
+        self.keep_alive = keep_alive
+        self.cold_start_seconds = cold_start_seconds
+        self.model_ctx = {}
+        self.last_call = {}  # model -> time.monotonic() of its last successful call
+        shared = {'ctx_sizes': ctx_sizes, 'model_ctx': self.model_ctx, 'keep_alive': keep_alive}
+        self.routes = {name: Route(name, **shared, **config) for name, config in routes.items()}
+        self.routes.setdefault('default', Route('default', **shared))
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, task):
+        """Route for a task: exact match, then its family ('question:...' -> 'question'), then 'default'"""
+        if task in self.routes:
+            return self.routes[task]
+        family = task.split(':', 1)[0]
+        return self.routes.get(family, self.routes['default'])
+
+    @contextmanager
+    def observe(self, route, payload, label=None, task=None, attempt=0, validated=False, queued=None):
+        """Time the call sending `payload` on behalf of `route` and record its outcome.
+
+        `task`, `attempt` (0 for the first try) and `queued` (seconds the call waited
+        for its scheduler slot) are passed on to the per-call instrumentation; with
+        `validated` the caller reports the final outcome later through
+        instrumentation.resolve().
+        """
+        call = RouteCall(route, payload, label, task, attempt, queued)
+        with tracing.span('ollama.generate', task=task or route.name, model=call.model, attempt=attempt) as span:
+            try:
+                yield call
+            except BaseException as e:
+                call.failed = True
+                call.error = e
+                raise
+            finally:
+                elapsed = self._finish(call)
+                record = instrumentation.record(call, elapsed, validated)
+                span.set('outcome', record['outcome'])
+                span.set('prompt_eval_count', record['prompt_eval_count'] or 0)
+                span.set('eval_count', record['eval_count'] or 0)
+
+    def models(self):
+        """Primary model of every route, once each"""
+        return list(dict.fromkeys(route.model for route in self.routes.values()))
+
+    def load_ctx(self, model):
+        """num_ctx to load `model` with: the size calls have grown it to, else the smallest its routes send"""
+        if model in self.model_ctx:
+            return self.model_ctx[model]
+        sizes = [route.options.get('num_ctx') or route.ctx_sizes[0] for route in self.routes.values() if model in route.models]
+        return min(sizes) if sizes else self.routes['default'].ctx_sizes[0]
+
+    def is_cold(self, response):
+        """Whether Ollama loaded the model for this call; None when it cannot tell"""
+        if 'load_duration' in response:
+            return response['load_duration'] / 1e9 >= self.cold_start_seconds
+        if 'first_token_duration' in response:
+            return response['first_token_duration'] / 1e9 >= self.cold_start_seconds
+        return None
+
+    def _finish(self, call):
+        elapsed = time.monotonic() - call.started
+        failed = call.failed or call.response is None
+        response = call.response or {}
+        with self._lock:
+            metrics = self._metrics.setdefault((call.route.name, call.model), RouteMetrics())
+            metrics.calls += 1
+            if failed:
+                metrics.failures += 1
+                return elapsed
+            if call.model != call.route.model:
+                metrics.fallback_calls += 1
+            metrics.latency_total += elapsed
+            metrics.latency_max = max(metrics.latency_max, elapsed)
+            metrics.recent_latencies.append(elapsed)
+            self.last_call[call.model] = time.monotonic()
+            cold = self.is_cold(response)
+            if cold:
+                metrics.cold_starts += 1
+                metrics.cold_latency_total += elapsed
+            elif cold is not None:
+                metrics.warm_calls += 1
+                metrics.warm_latency_total += elapsed
+            metrics.prompt_tokens += response.get('prompt_eval_count') or 0
+            metrics.completion_tokens += response.get('eval_count') or 0
+            metrics.eval_seconds += (response.get('eval_duration') or 0) / 1e9
+            prompt_eval_seconds = (response.get('prompt_eval_duration') or 0) / 1e9
+            first_token_seconds = (response.get('first_token_duration') or 0) / 1e9
+            metrics.prompt_eval_seconds += prompt_eval_seconds
+            if 'first_token_duration' in response:
+                metrics.streamed += 1
+                metrics.first_token_seconds += first_token_seconds
+            if call.label is not None:
+                counts = metrics.labels.setdefault(call.label, Counter())
+                counts['calls'] += 1
+                if 'prompt_eval_duration' in response:
+                    counts['prompt_evals'] += 1
+                    counts['prompt_tokens'] += response.get('prompt_eval_count') or 0
+                    counts['prompt_eval_seconds'] += prompt_eval_seconds
+                if 'first_token_duration' in response:
+                    counts['streamed'] += 1
+                    counts['first_token_seconds'] += first_token_seconds
+            done_reason = response.get('done_reason')
+            if done_reason == 'length':
+                metrics.truncated += 1
+            elif done_reason == 'stopped_early':
+                metrics.stopped_early += 1
+            elif done_reason == 'malformed':
+                metrics.malformed += 1
+            call.route.observe_prompt(call.prompt_chars, response.get('prompt_eval_count'))
+        return elapsed
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                name: {
+                    'model': route.model,
+                    'fallbacks': route.models[1:],
+                    'options': route.options,
+                    'tokens_per_char': round(route.token_ratio, 3) if route.token_ratio else None,
+                    'models': {},
+                }
+                for name, route in self.routes.items()
+            }
+            for (name, model), metrics in self._metrics.items():
+                stats[name]['models'][model] = metrics.snapshot()
+            return stats
+
+
+router = ModelRouter(
+    getattr(settings, 'LLM_ROUTES', {}),
+    ctx_sizes=getattr(settings, 'LLM_CTX_SIZES', DEFAULT_CTX_SIZES),
+    keep_alive=getattr(settings, 'LLM_KEEP_ALIVE', None),
+    cold_start_seconds=getattr(settings, 'LLM_COLD_START_SECONDS', 2.0)
+)
+
+
+def resolve(task):
+    """Route for a task from the shared router (see ModelRouter.resolve)"""
+    return router.resolve(task)
+
+
+def observe(route, payload, label=None, task=None, attempt=0, validated=False, queued=None):
+    return router.observe(route, payload, label, task, attempt, validated, queued)
+
+
+def stats():
+    return router.stats()
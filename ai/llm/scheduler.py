@@ -0,0 +1,302 @@
+# ai/llm/scheduler.py - Priority scheduler in front of every Ollama call
+#
+# All LLM calls go through one scheduler per process:
+#
+#     with scheduler.slot('interactive') as queued:
+#         requests.post(backend.url('/api/generate'), ...)
+#
+# (or `async with scheduler.aslot(...)` from async views; threads and coroutines
+# share the same queue). `queued` is the seconds the call waited for its slot.
+#
+# A call runs only when a global slot is free (LLM_MAX_CONCURRENCY, matching what
+# Ollama can serve in parallel) and its class is under its own limit. Waiting calls
+# are ordered by class rank, so a queued interactive request always goes before
+# queued background work; giving background a lower limit than the global one
+# keeps a slot free for users while a batch job runs. A call that is already
+# running is never interrupted.
+#
+# Within a class, waiting calls are served round-robin by owner (user or client
+# IP): each owner's n-th queued call is placed in round n, so one client with ten
+# queued calls cannot delay another client's first call by more than one turn.
+#
+# The class and owner for code that does not pass them explicitly come from
+# `with use_priority('background'):` / `with use_owner('user:1'):` (contextvars);
+# the defaults are 'interactive' and a single shared owner.
+import asyncio
+import bisect
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from . import budget
+
+DEFAULT_PRIORITY_CLASSES = {
+    # rank: lower runs first; limit: concurrent calls; max_wait: seconds queued before giving up
+    'interactive': {'rank': 0, 'limit': 2, 'max_wait': 30},
+    'background': {'rank': 10, 'limit': 1, 'max_wait': None},
+}
+
+_current_priority = contextvars.ContextVar('llm_priority', default='interactive')
+_current_owner = contextvars.ContextVar('llm_owner', default='')
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call waited longer than its class allows for an LLM slot"""
+
+
+class PriorityClass:
+    def __init__(self, name, rank, limit, max_wait=None):
+        self.name = name
+        self.rank = rank
+        self.limit = limit
+        self.max_wait = max_wait
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque(maxlen=500)
+
+
+class LLMScheduler:
+    """Grants a bounded number of concurrent LLM slots in priority order"""
+
+    def __init__(self, max_concurrency=2, classes=None):
+        self.max_concurrency = max_concurrency
+        self.classes = {
+            name: PriorityClass(name, **options)
+            for name, options in (classes or DEFAULT_PRIORITY_CLASSES).items()
+        }
+        self._running = 0
+        self._waiting = []  # sorted (rank, round, seq, class name)
+        self._seq = itertools.count()
+        self._round = 0
+        self._owner_rounds = {}  # owner -> next free round
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # (event loop, asyncio.Event) of queued coroutines
+
+    def _get_class(self, name):
+        try:
+            return self.classes[name]
+        except KeyError:
+            raise ValueError(f"Unknown LLM priority class: {name}")
+
+    def _can_run(self, entry, cls):
+        if self._running >= self.max_concurrency or cls.running >= cls.limit:
+            return False
+        # Anyone queued ahead of us who could run right now goes first
+        for ahead in self._waiting:
+            if ahead == entry:
+                return True
+            if self.classes[ahead[3]].running < self.classes[ahead[3]].limit:
+                return False
+        return True
+
+    def _next_round(self, owner):
+        """Round-robin position for the owner's next call"""
+        position = max(self._round, self._owner_rounds.get(owner, 0))
+        self._owner_rounds[owner] = position + 1
+        if len(self._owner_rounds) > 1000:
+            # Owners whose turns are all in the past no longer affect ordering
+            self._owner_rounds = {o: r for o, r in self._owner_rounds.items() if r > self._round}
+        return position
+
+    def _enqueue(self, cls, owner):
+        entry = (cls.rank, self._next_round(owner), next(self._seq), cls.name)
+        bisect.insort(self._waiting, entry)
+        cls.queued += 1
+        return entry
+
+    def _dequeue(self, entry, cls):
+        self._waiting.remove(entry)
+        cls.queued -= 1
+        # Our place in the queue may have been holding others back
+        self._notify()
+
+    def _grant(self, entry, cls, start):
+        self._round = max(self._round, entry[1])
+        self._running += 1
+        cls.running += 1
+        waited = time.monotonic() - start
+        cls.wait_total += waited
+        cls.wait_max = max(cls.wait_max, waited)
+        cls.recent_waits.append(waited)
+        return waited
+
+    def _notify(self):
+        """Wake blocked threads and waiting coroutines (caller holds the lock)"""
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _timeout(self, cls, timeout):
+        cls.timeouts += 1
+        return SchedulerTimeout(f"No LLM slot for '{cls.name}' within {timeout}s")
+
+    def acquire(self, name=None, timeout=None, owner=None):
+        """Block until a slot for the class is granted; returns seconds spent queued"""
+        cls = self._get_class(name or _current_priority.get())
+        owner = _current_owner.get() if owner is None else owner
+        timeout = budget.cap(cls.max_wait if timeout is None else timeout)
+        start = time.monotonic()
+
+        with self._cond:
+            entry = self._enqueue(cls, owner)
+            try:
+                while not self._can_run(entry, cls):
+                    remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                    if remaining is not None and remaining <= 0:
+                        raise self._timeout(cls, timeout)
+                    self._cond.wait(remaining)
+            finally:
+                self._dequeue(entry, cls)
+            return self._grant(entry, cls, start)
+
+    async def aacquire(self, name=None, timeout=None, owner=None):
+        """Coroutine version of acquire(): waiting costs no thread"""
+        cls = self._get_class(name or _current_priority.get())
+        owner = _current_owner.get() if owner is None else owner
+        timeout = budget.cap(cls.max_wait if timeout is None else timeout)
+        start = time.monotonic()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        with self._cond:
+            entry = self._enqueue(cls, owner)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._cond:
+                    if self._can_run(entry, cls):
+                        self._async_waiters.discard(waiter)
+                        self._dequeue(entry, cls)
+                        return self._grant(entry, cls, start)
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    with self._cond:
+                        raise self._timeout(cls, timeout)
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Timed out or cancelled (e.g. the client disconnected) while still queued
+            with self._cond:
+                if waiter in self._async_waiters:
+                    self._async_waiters.discard(waiter)
+                    self._dequeue(entry, cls)
+
+    def release(self, name=None):
+        cls = self._get_class(name or _current_priority.get())
+        with self._cond:
+            self._running -= 1
+            cls.running -= 1
+            cls.completed += 1
+            self._notify()
+
+    @contextmanager
+    def slot(self, name=None, timeout=None, owner=None):
+        """Hold one LLM slot for the duration of the block; yields the seconds spent queued"""
+        name = name or _current_priority.get()
+        waited = self.acquire(name, timeout, owner)
+        try:
+            yield waited
+        finally:
+            self.release(name)
+
+    @asynccontextmanager
+    async def aslot(self, name=None, timeout=None, owner=None):
+        """Hold one LLM slot for the duration of an `async with` block; yields the seconds spent queued"""
+        name = name or _current_priority.get()
+        waited = await self.aacquire(name, timeout, owner)
+        try:
+            yield waited
+        finally:
+            self.release(name)
+
+    def queue_depth(self, name=None):
+        """Calls waiting for a slot, in one class or in total"""
+        with self._cond:
+            if name is None:
+                return len(self._waiting)
+            return self._get_class(name).queued
+
+    def record_rejection(self, name=None):
+        """Count a call turned away before queueing (admission control)"""
+        cls = self._get_class(name or _current_priority.get())
+        with self._cond:
+            cls.rejected += 1
+
+    def stats(self):
+        """Per-class queue depth, concurrency and queue-time figures"""
+        with self._cond:
+            result = {
+                'max_concurrency': self.max_concurrency,
+                'running': self._running,
+                'queued': len(self._waiting),
+                'classes': {},
+            }
+            for name, cls in self.classes.items():
+                waits = sorted(cls.recent_waits)
+                granted = cls.completed + cls.running
+                result['classes'][name] = {
+                    'limit': cls.limit,
+                    'running': cls.running,
+                    'queued': cls.queued,
+                    'completed': cls.completed,
+                    'timeouts': cls.timeouts,
+                    'rejected': cls.rejected,
+                    'avg_wait_ms': round(cls.wait_total / granted * 1000, 1) if granted else 0,
+                    'max_wait_ms': round(cls.wait_max * 1000, 1),
+                    'p50_wait_ms': round(waits[len(waits) // 2] * 1000, 1) if waits else 0,
+                    'p95_wait_ms': round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0,
+                }
+            return result
+
+
+scheduler = LLMScheduler(
+    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 2),
+    classes=getattr(settings, 'LLM_PRIORITY_CLASSES', None)
+)
+
+
+@contextmanager
+def use_priority(name):
+    """Run LLM calls made inside the block under the given priority class"""
+    scheduler._get_class(name)
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def use_owner(owner):
+    """Attribute LLM calls made inside the block to an owner for round-robin fairness"""
+    token = _current_owner.set(owner)
+    try:
+        yield
+    finally:
+        _current_owner.reset(token)
+
+
+def slot(priority=None, timeout=None, owner=None):
+    """Hold a slot on the shared scheduler (see LLMScheduler.slot)"""
+    return scheduler.slot(priority, timeout, owner)
+
+
+def aslot(priority=None, timeout=None, owner=None):
+    """Async counterpart of slot()"""
+    return scheduler.aslot(priority, timeout, owner)
+
+
+def stats():
+    return scheduler.stats()
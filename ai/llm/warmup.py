@@ -0,0 +1,178 @@
+# ai/llm/warmup.py - Preload models on every Ollama backend and keep them resident
+#
+# Ollama loads a model on first use and unloads it keep_alive after the last call,
+# so the first question after a quiet spell waits for the load (seconds to tens of
+# seconds). warm_all() sends every model named in LLM_ROUTES an empty prompt on each
+# healthy backend: Ollama loads the model and answers without generating anything.
+# The request carries the same keep_alive as real calls (LLM_KEEP_ALIVE) and the
+# num_ctx the routes size for the model (router.load_ctx): the size real calls have
+# grown it to, or before any call the smallest of LLM_CTX_SIZES (or a route's
+# pinned num_ctx). Warm-ups never raise a model's num_ctx themselves, so small
+# prompts keep their small context; a first call needing a larger one reloads the
+# model once, as it would without warm-up.
+#
+# The heartbeat thread repeats the empty prompt for any model that has seen no call
+# for LLM_HEARTBEAT_INTERVAL seconds (keep it below keep_alive), so models stay
+# resident through quiet periods. It is started from QuizConfig.ready() in server
+# processes when LLM_WARMUP_ON_STARTUP is set, or run as a sidecar with
+# `python manage.py warm_models --heartbeat`.
+#
+# Loading a model occupies Ollama like a real call, so every warm-up request holds
+# a 'background' scheduler slot: queued user requests go first.
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from .pool import pool as default_pool
+from .routing import router as default_router
+from .scheduler import SchedulerTimeout, scheduler as default_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupManager:
+    """Loads the routed models on every backend and pings idle ones"""
+
+    def __init__(self, router, pool, scheduler, heartbeat_interval=600, timeout=120):
+        self.router = router
+        self.pool = pool
+        self.scheduler = scheduler
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self.results = {}  # (backend url, model) -> outcome of the last warm-up
+        self.warmups = 0
+        self.heartbeats = 0
+        self._last_warm = {}  # model -> time.monotonic() of its last warm-up round
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def warm(self, backend, model):
+        """Load `model` on one backend; returns the outcome recorded for it"""
+        num_ctx = self.router.load_ctx(model)
+        payload = {'model': model, 'prompt': '', 'stream': False, 'options': {'num_ctx': num_ctx}}
+        if self.router.keep_alive is not None:
+            payload['keep_alive'] = self.router.keep_alive
+
+        started = time.monotonic()
+        try:
+            with self.scheduler.slot('background', timeout=self.timeout):
+                response = requests.post(backend.url('/api/generate'), json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            load_ms = round(response.json().get('load_duration', 0) / 1e6, 1)
+            outcome = {'ok': True, 'load_ms': load_ms, 'error': None}
+        except (SchedulerTimeout, requests.exceptions.RequestException, ValueError) as e:
+            outcome = {'ok': False, 'load_ms': None, 'error': str(e)}
+            logger.warning(f"Warm-up of {model} on {backend.base_url} failed: {e}")
+
+        outcome.update({
+            'total_ms': round((time.monotonic() - started) * 1000, 1),
+            'num_ctx': num_ctx,
+            'at': timezone.now().isoformat(),
+        })
+        with self._lock:
+            self.results[(backend.base_url, model)] = outcome
+        return outcome
+
+    def warm_models(self, models):
+        """Warm the given models on every healthy backend"""
+        outcomes = {}
+        for model in models:
+            for backend in [b for b in self.pool.backends if b.healthy]:
+                outcomes[(backend.base_url, model)] = self.warm(backend, model)
+            self._last_warm[model] = time.monotonic()
+        return outcomes
+
+    def warm_all(self):
+        outcomes = self.warm_models(self.router.models())
+        self.warmups += 1
+        return outcomes
+
+    def idle_models(self):
+        """Models with neither a call nor a warm-up within the heartbeat interval"""
+        now = time.monotonic()
+        return [
+            model for model in self.router.models()
+            if now - max(self.router.last_call.get(model, 0), self._last_warm.get(model, 0)) >= self.heartbeat_interval
+        ]
+
+    def heartbeat(self):
+        models = self.idle_models()
+        if models:
+            self.warm_models(models)
+            self.heartbeats += 1
+        return models
+
+    def run(self, stop_event=None, warm_first=True):
+        """Warm everything, then keep idle models resident until stopped"""
+        if warm_first:
+            self.warm_all()
+        while stop_event is None or not stop_event.is_set():
+            if stop_event is not None:
+                stop_event.wait(self.heartbeat_interval / 4)
+            else:
+                time.sleep(self.heartbeat_interval / 4)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Model heartbeat error: {e}")
+
+    def start(self):
+        """Run warm-up and heartbeats in a daemon thread (once per process)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run, name='ollama-warmup', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            results = [{'backend': url, 'model': model, **outcome} for (url, model), outcome in self.results.items()]
+        return {
+            'models': self.router.models(),
+            'warmups': self.warmups,
+            'heartbeats': self.heartbeats,
+            'heartbeat_interval': self.heartbeat_interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'results': results,
+        }
+
+
+manager = WarmupManager(
+    default_router,
+    default_pool,
+    default_scheduler,
+    heartbeat_interval=getattr(settings, 'LLM_HEARTBEAT_INTERVAL', 600),
+    timeout=getattr(settings, 'LLM_WARMUP_TIMEOUT', 120),
+)
+
+
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi', 'waitress-serve')
+
+
+def is_server_process():
+    """True under a WSGI/ASGI server or `runserver`/`run_workers`; not for other commands, shells or tests"""
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program == 'manage.py':
+        return sys.argv[1:2] in (['runserver'], ['run_workers'])
+    return program in SERVER_PROGRAMS
+
+
+def start():
+    """Start warm-up and heartbeats for this process"""
+    manager.start()
+
+
+def warm_all():
+    return manager.warm_all()
+
+
+def stats():
+    return manager.stats()
@@ -0,0 +1,168 @@
+# ai/metrics.py - In-process counters and fixed-bucket histograms
+#
+# A small registry for figures that are cheap to update on every request and are
+# read back by staff endpoints: counters and histograms keyed by metric name and a
+# set of labels.
+#
+#     metrics.inc('llm_calls_total', {'task': 'explanation', 'outcome': 'ok'})
+#     metrics.observe('llm_call_seconds', 1.8, {'task': 'explanation'})
+#
+# Histograms keep a count per bucket (upper bounds declared once with
+# histogram(name, buckets); DEFAULT_BUCKETS otherwise) plus the sum and count, so
+# memory stays constant however many values are observed; quantiles are estimated
+# by interpolating within the bucket. Figures are per process and reset on restart;
+# ai/prometheus.py merges the snapshots of all worker processes.
+#
+# Request totals: RequestMetricsMiddleware opens a per-request accumulator with
+# begin_request(); code running for that request (in any thread or task it spawns)
+# adds to it with add_to_request(), e.g. the LLM time of every call.
+import bisect
+import contextvars
+import threading
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_request_totals = contextvars.ContextVar('metrics_request_totals', default=None)
+
+
+def _key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+class Histogram:
+    """Bucketed distribution of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot: above the highest bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimated q-quantile (0..1); the highest bound when it falls above every bucket"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'avg': round(self.sum / self.count, 4) if self.count else 0,
+            'p50': round(self.quantile(0.5), 4),
+            'p95': round(self.quantile(0.95), 4),
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+        }
+
+
+class MetricsRegistry:
+    """Counters and histograms by (name, labels)"""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, buckets):
+        """Declare the bucket bounds used for histogram `name`"""
+        self._buckets[name] = tuple(buckets)
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, _key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def counters(self, name):
+        """{labels tuple: value} for one counter"""
+        with self._lock:
+            return {labels: value for (n, labels), value in self._counters.items() if n == name}
+
+    def histograms(self, name):
+        """{labels tuple: Histogram} for one histogram (live objects; read only)"""
+        with self._lock:
+            return {labels: h for (n, labels), h in self._histograms.items() if n == name}
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {'name': name, 'labels': dict(labels), **histogram.snapshot()}
+                for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        return {'counters': counters, 'histograms': histograms}
+
+    def dump(self):
+        """Raw series as JSON-friendly lists, for merging with other processes"""
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), list(h.buckets), list(h.counts), h.sum, h.count]
+                    for (name, labels), h in self._histograms.items()
+                ],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+def inc(name, labels=None, amount=1):
+    """Add to a counter in the shared registry"""
+    registry.inc(name, labels, amount)
+
+
+def observe(name, value, labels=None):
+    """Record a value in a histogram of the shared registry"""
+    registry.observe(name, value, labels)
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+def begin_request():
+    """Start accumulating totals for the current request; returns (token, totals)"""
+    totals = {}
+    return _request_totals.set(totals), totals
+
+
+def end_request(token):
+    _request_totals.reset(token)
+
+
+def add_to_request(name, amount):
+    """Add to a total of the request being served (no-op outside a request)"""
+    totals = _request_totals.get()
+    if totals is not None:
+        totals[name] = totals.get(name, 0) + amount
@@ -0,0 +1,96 @@
+# ai/middleware.py - Per-view request metrics for the Prometheus endpoint
+#
+# RequestMetricsMiddleware records, per resolved URL name ('quiz:api_new'; requests
+# that match no URL are counted under 'unresolved'):
+#   http_request_duration_seconds  histogram, by view and method
+#   http_requests_total            counter, by view, method and status
+#   http_request_db_queries        histogram of queries per request, by view
+#   http_request_db_seconds_total  counter of time spent in queries, by view
+#   http_request_llm_seconds_total counter of time spent in LLM calls, by view
+# into the ai.metrics registry, which ai/prometheus.py shares between workers.
+#
+# Queries are timed by an execute wrapper installed on each database connection as
+# it is opened, so they are counted whichever thread runs them (async views run
+# the ORM in a worker thread). LLM time comes from ai.llm.instrumentation. All of
+# it is kept in memory: a request costs a few dictionary updates under one lock,
+# well under 50µs, and the files are written by a background thread.
+#
+# Sync and async capable, so under ASGI async views are not moved to a thread.
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics, prometheus
+
+metrics.registry.histogram('http_request_duration_seconds', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+metrics.registry.histogram('http_request_db_queries', (0, 1, 2, 5, 10, 20, 50, 100))
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_to_request('db_seconds', time.perf_counter() - started)
+        metrics.add_to_request('db_queries', 1)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver: time every query run on `connection`"""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class RequestMetricsMiddleware:
+    """Records latency, query and LLM figures per view"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_timer, dispatch_uid='ai.middleware.install_query_timer')
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(None, connection)
+        prometheus.start()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token, totals = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - started, totals)
+            return response
+        finally:
+            metrics.end_request(token)
+
+    async def __acall__(self, request):
+        token, totals = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.record(request, response, time.perf_counter() - started, totals)
+            return response
+        finally:
+            metrics.end_request(token)
+
+    @staticmethod
+    def record(request, response, elapsed, totals):
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        registry = metrics.registry
+        registry.observe('http_request_duration_seconds', elapsed, {'view': view, 'method': request.method})
+        registry.inc('http_requests_total', {'view': view, 'method': request.method, 'status': str(response.status_code)})
+        labels = {'view': view}
+        registry.observe('http_request_db_queries', totals.get('db_queries', 0), labels)
+        if totals.get('db_seconds'):
+            registry.inc('http_request_db_seconds_total', labels, totals['db_seconds'])
+        if totals.get('llm_seconds'):
+            registry.inc('http_request_llm_seconds_total', labels, totals['llm_seconds'])
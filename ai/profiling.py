@@ -0,0 +1,190 @@
+# ai/profiling.py - On-demand profiling of single requests for staff
+#
+# A staff user adds ?_profile=1 to a URL (or sends the X-Profile header) and that one
+# request runs under cProfile with every SQL query captured. The result is stored as
+# a quiz.RequestProfile row, listed in the admin with the hottest functions, and can
+# be downloaded as a .prof file (pstats format: `python -m pstats`, snakeviz) and as
+# the query log. The response carries X-Profile-Id with the row's id. The newest
+# PROFILE_KEEP profiles are kept.
+#
+# Untriggered requests pay one substring test on the query string and one header
+# lookup; the flag from non-staff users is ignored. Queries are captured by an
+# execute wrapper added to each connection as it opens, which only records while a
+# profiled request is running in its context.
+#
+# cProfile sees the thread it runs in. Under WSGI that is the whole request; with
+# async views (ASYNC_LLM_VIEWS) it covers the event loop, not ORM calls or sync
+# views that Django runs in worker threads, though their queries are still captured.
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_captured_queries = ContextVar('profiling_captured_queries', default=None)
+
+
+def _capture_query(execute, sql, params, many, context):
+    queries = _captured_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if len(queries) < getattr(settings, 'PROFILE_MAX_QUERIES', 1000):
+            queries.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'many': many,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def install_query_capture(sender, connection, **kwargs):
+    """connection_created receiver: let profiled requests capture queries on `connection`"""
+    if _capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_capture_query)
+
+
+class RequestProfile:
+    """Profiler and query log for one request"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.queries = []
+        self._token = None
+        self._started = None
+        self.duration = None
+
+    def start(self):
+        """Begin profiling; False when another profiler is already running in this process"""
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            logger.warning(f"Request not profiled: {e}")
+            return False
+        self._token = _captured_queries.set(self.queries)
+        self._started = time.perf_counter()
+        return True
+
+    def stop(self):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self._started
+        _captured_queries.reset(self._token)
+
+    @staticmethod
+    def summary(stats, limit=40):
+        """Text table of the functions with the highest cumulative time"""
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def save(self, request, response):
+        """Store the profile; returns the saved row"""
+        # The profiler's figures can only be collected once
+        stats = pstats.Stats(self.profiler)
+        match = request.resolver_match
+        model = apps.get_model(getattr(settings, 'PROFILE_MODEL', 'quiz.RequestProfile'))
+        row = model.objects.create(
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view_name=match.view_name if match is not None else '',
+            user=request.user if request.user.is_authenticated else None,
+            status_code=response.status_code,
+            duration_ms=round(self.duration * 1000, 1),
+            query_count=len(self.queries),
+            query_ms=round(sum(q['ms'] for q in self.queries), 1),
+            stats=marshal.dumps(stats.stats),
+            summary=self.summary(stats),
+            queries=self.queries,
+        )
+        keep = getattr(settings, 'PROFILE_KEEP', 200)
+        stale = model.objects.order_by('-created_at').values_list('pk', flat=True)[keep:]
+        model.objects.filter(pk__in=list(stale)).delete()
+        return row
+
+
+def flagged(request):
+    """Whether the request asks to be profiled (query flag or header), whoever sent it"""
+    if not getattr(settings, 'PROFILING_ENABLED', True):
+        return False
+    if getattr(settings, 'PROFILE_HEADER', 'HTTP_X_PROFILE') in request.META:
+        return True
+    param = getattr(settings, 'PROFILE_QUERY_PARAM', '_profile')
+    # Substring test first so ordinary requests never parse their query string here
+    return param in request.META.get('QUERY_STRING', '') and param in request.GET
+
+
+def profiling_requested(request):
+    """True when a staff user asked for this request to be profiled"""
+    if not flagged(request):
+        return False
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+class RequestProfilerMiddleware:
+    """Profiles requests flagged by staff (must come after AuthenticationMiddleware)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_capture, dispatch_uid='ai.profiling.install_query_capture')
+        for connection in connections.all(initialized_only=True):
+            install_query_capture(None, connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not profiling_requested(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        if not profile.start():
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        return self.finish(profile, request, response)
+
+    async def __acall__(self, request):
+        # request.user is loaded from the database, so only for flagged requests
+        if not (flagged(request) and await sync_to_async(profiling_requested)(request)):
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        if not profile.start():
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        return await sync_to_async(self.finish)(profile, request, response)
+
+    @staticmethod
+    def finish(profile, request, response):
+        try:
+            row = profile.save(request, response)
+            response['X-Profile-Id'] = str(row.pk)
+            logger.info(f"Profiled {request.method} {request.path}: {row.duration_ms} ms, {row.query_count} queries (profile {row.pk})")
+        except Exception as e:
+            logger.error(f"Saving request profile failed: {e}")
+        return response
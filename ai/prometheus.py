@@ -0,0 +1,185 @@
+# ai/prometheus.py - Cross-process metrics files and the Prometheus /metrics endpoint
+#
+# Each worker process keeps its figures in the ai.metrics registry. A daemon thread
+# writes the registry every METRICS_FLUSH_INTERVAL seconds (and at exit) to its own
+# file in METRICS_DIR, <pid>-<start time>.json, replaced atomically. /metrics writes
+# the serving process's file first, then merges every file in the directory:
+# counters and histogram buckets of the same series are summed. Files of exited
+# workers keep counting until they are METRICS_FILE_MAX_AGE old, then are removed,
+# which Prometheus sees as an ordinary counter reset.
+#
+# The request path never touches the files, so recording stays in memory. Figures
+# from the last flush interval of other workers are not yet visible to a scrape.
+#
+# Access: staff sessions, or `Authorization: Bearer <METRICS_TOKEN>` for the
+# Prometheus scraper when METRICS_TOKEN is set.
+import atexit
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_http_methods
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class ProcessFileExporter:
+    """Writes this process's registry to a file and merges the files of all processes"""
+
+    def __init__(self, registry, directory, flush_interval=15, max_age=86400):
+        self.registry = registry
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self._started_at = int(time.time())
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def path(self):
+        # Computed on use so a forked worker never writes to its parent's file
+        return self.directory / f"{os.getpid()}-{self._started_at}.json"
+
+    def write(self):
+        """Write the registry to this process's file (atomically)"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.registry.dump(), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"Metrics snapshot write failed: {e}")
+
+    def collect(self):
+        """Counters and histograms merged over every live process file"""
+        counters = {}
+        histograms = {}
+        now = time.time()
+        for path in self.directory.glob('*.json'):
+            try:
+                if now - path.stat().st_mtime > self.max_age:
+                    path.unlink(missing_ok=True)
+                    continue
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed or replaced while being read
+            for name, labels, value in data.get('counters', []):
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, counts, total, count in data.get('histograms', []):
+                key = (name, tuple(map(tuple, labels)), tuple(buckets))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+    def render(self):
+        """All processes' figures in the Prometheus text exposition format"""
+        self.write()
+        counters, histograms = self.collect()
+        lines = []
+        typed = set()
+
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        for (name, labels, buckets), (counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip([*map(_number, buckets), '+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Write the registry periodically in a daemon thread (once per process)"""
+        if self.running:
+            return
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.write()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+exporter = ProcessFileExporter(
+    metrics.registry,
+    getattr(settings, 'METRICS_DIR', Path(settings.BASE_DIR) / 'cache' / 'metrics'),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 15),
+    max_age=getattr(settings, 'METRICS_FILE_MAX_AGE', 86400)
+)
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+        if scheme == 'Bearer' and hmac.compare_digest(supplied.encode(), token.encode()):
+            return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Prometheus scrape endpoint (staff or METRICS_TOKEN only)"""
+    if not _authorized(request):
+        return HttpResponseForbidden("Forbidden")
+    return HttpResponse(exporter.render(), content_type=CONTENT_TYPE)
+
+
+def start():
+    exporter.start()
+
+
+def _write_on_exit():
+    # Only processes that record (servers) leave a file behind, not shells or commands
+    if exporter.running:
+        exporter.write()
+
+
+atexit.register(_write_on_exit)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ai.middleware.RequestMetricsMiddleware',  # First, so latency covers the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'user.middleware.LoginAttemptMiddleware',  # Add custom login attempt middleware
+    'ai.profiling.RequestProfilerMiddleware',  # Staff-triggered profiling (?_profile=1); needs request.user
 ]
 
 ROOT_URLCONF = 'ai.urls'
@@ -75,9 +77,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock up front, so concurrent writers wait for
+        # each other instead of failing with "database is locked" mid-transaction
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        # On disk rather than in memory, so threaded tests get separate connections
+        # that wait for each other's locks like real workers do
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Flushes buffered counters and events into the test database before it is dropped
+TEST_RUNNER = 'ai.test_runner.TestRunner'
+
 # -------------------------------
 # Password validation
 # -------------------------------
@@ -96,6 +107,28 @@ TIME_ZONE = 'UTC'
 USE_I18N = True
 USE_TZ = True
 
+# -------------------------------
+# Cache
+# -------------------------------
+# 'default' is Django's per-process LocMemCache. State that every worker must see
+# gets its own alias:
+#   ratelimit  LLM rate-limit buckets and their locks (ai/llm/ratelimit.py). The
+#              database cache is shared by all workers and its add() is atomic
+#              (primary-key insert). Its table is created by migration quiz.0010
+#              (or `manage.py createcachetable`). Expired buckets are removed first
+#              when culling, so MAX_ENTRIES only has to exceed the clients active
+#              within a bucket's refill time.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'llm_rate_limit_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_FREQUENCY': 10},
+    },
+}
+
 # -------------------------------
 # Static & Media files
 # -------------------------------
@@ -134,6 +167,154 @@ X_FRAME_OPTIONS = 'DENY'
 # Login attempts
 MAX_LOGIN_ATTEMPTS = 5  # Maximum number of failed login attempts before blocking
 
+# -------------------------------
+# Write-behind counters (ai/counters.py)
+# -------------------------------
+COUNTER_FLUSH_INTERVAL = 10    # Seconds between background flushes
+COUNTER_FLUSH_THRESHOLD = 500  # Distinct buffered counters that trigger an early flush
+
+# -------------------------------
+# Analytics event buffer (ai/events.py)
+# -------------------------------
+EVENT_BUFFER_SYNC = False           # True saves each row immediately (use in tests)
+EVENT_BUFFER_FLUSH_INTERVAL = 2.0   # Seconds between background bulk inserts
+EVENT_BUFFER_MAX_SIZE = 200         # Buffered rows that trigger an early flush
+
+# -------------------------------
+# Background jobs (quiz/jobs.py)
+# -------------------------------
+TASKS_IN_PROCESS_WORKERS = 2     # Worker threads started in the web process; 0 = only `run_workers`
+TASKS_JOB_TIMEOUT = 300          # Seconds before a 'running' job is considered abandoned and requeued
+TASKS_RETENTION = 60 * 60 * 24   # Seconds finished jobs are kept for inspection
+REPORT_RETRY_AFTER = 300         # Seconds a failed PDF report build blocks automatic rebuilds (doubles per failure)
+REPORT_RETRY_MAX = 60 * 60       # Longest such wait; users can always retry at once with ?retry=1
+
+# -------------------------------
+# Ollama backends (ai/llm/pool.py)
+# -------------------------------
+OLLAMA_BACKENDS = [
+    'http://127.0.0.1:11434',
+]
+OLLAMA_EJECT_AFTER = 3         # Consecutive failed requests before a backend is taken out of rotation
+OLLAMA_HEALTH_INTERVAL = 10    # Seconds between active health checks (GET /api/tags)
+OLLAMA_HEALTH_TIMEOUT = 2      # Seconds a health check may take
+
+# -------------------------------
+# LLM model routing (ai/llm/routing.py)
+# -------------------------------
+# Task -> model, option overrides and fallback models tried in order on failure.
+# Lookup: exact task, then its family ('question:कठिन' -> 'question'), then 'default'.
+# Compare per-route latency/tokens at /quiz/api/llm/routes/ before moving a task,
+# e.g. 'explanation': {'model': 'llama3.2:3b', 'fallbacks': ['llama3']}
+# 'options' override the engines' defaults, including the output budget
+# (num_predict, stop; see quiz.constants.GENERATION_LIMITS) and num_ctx.
+LLM_ROUTES = {
+    'default': {'model': 'llama3'},
+    'question': {'model': 'llama3'},                       # question:सजिलो / question:मध्यम / question:कठिन
+    'explanation': {'model': 'llama3'},
+    'grammar': {'model': 'llama3'},
+    'rewrite': {'model': 'llama3'},
+    'formal': {'model': 'llama3'},
+    'casual': {'model': 'llama3'},
+    'summary': {'model': 'llama3'},
+}
+LLM_CTX_SIZES = [2048, 4096, 8192]  # num_ctx values a prompt is rounded up to; a model's num_ctx only grows (changes reload it)
+LLM_STREAM_QUESTIONS = True         # Stream question generation and stop once a full MCQ has been parsed (quiz/question_stream.py)
+LLM_KEEP_ALIVE = '30m'               # How long Ollama keeps a model (and its cached prompt prefix) loaded after a call
+
+# Model warm-up (ai/llm/warmup.py)
+LLM_WARMUP_ON_STARTUP = True        # Preload every routed model on every backend when a server process starts
+LLM_WARMUP_TIMEOUT = 120            # Seconds a model load may take
+LLM_HEARTBEAT_INTERVAL = 600        # Re-load ping for models idle this long; keep below LLM_KEEP_ALIVE
+LLM_COLD_START_SECONDS = 2.0        # load_duration (or time to first token) above which a call counts as cold
+
+# Per-call instrumentation (ai/llm/instrumentation.py; summary at /quiz/api/llm/calls/)
+LLM_CALL_LOG_SAMPLE_RATE = 0.0      # Fraction of calls also stored as quiz.LLMCallLog rows (0 = histograms only)
+LLM_GPU_HOUR_COST = None            # Price of one hour of model time, to report the cost per served question
+
+# -------------------------------
+# Request metrics (ai/middleware.py, scraped at /metrics via ai/prometheus.py)
+# -------------------------------
+METRICS_DIR = BASE_DIR / 'cache' / 'metrics'  # Per-process snapshot files, merged on scrape; must be shared by all workers
+METRICS_FLUSH_INTERVAL = 15                   # Seconds between snapshot writes of each worker
+METRICS_FILE_MAX_AGE = 86400                  # Files of exited workers are dropped after this many seconds
+METRICS_TOKEN = None                          # Bearer token accepted from the Prometheus scraper (staff sessions always work)
+
+# Span tracing of the question pipeline (ai/tracing.py; report with `manage.py trace_report`)
+TRACE_SAMPLE_RATE = 0.05                         # Share of traced requests (api_new_question) written out; 0 disables tracing
+TRACE_FILE = BASE_DIR / 'logs' / 'traces.jsonl'  # OTLP/JSON lines, readable by the OpenTelemetry Collector's otlpjsonfile receiver
+TRACE_SERVICE_NAME = 'grammar-quiz'              # service.name resource attribute of exported traces
+
+# On-demand request profiling (ai/profiling.py; results under Admin > Request Profiles)
+PROFILING_ENABLED = True            # Staff can profile a request with ?_profile=1 or an X-Profile header
+PROFILE_QUERY_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'   # request.META key of the trigger header
+PROFILE_KEEP = 200                  # Newest profiles kept; older ones are deleted as new ones are saved
+PROFILE_MAX_QUERIES = 1000          # Queries captured per profiled request
+
+# Question prompts (quiz/prompt_budget.py)
+QUESTION_PROMPT_TOKEN_BUDGET = 600  # Hard cap on the per-question part of the prompt (the system prefix is cached)
+QUESTION_AVOID_RECENT = 10          # Recent questions whose keywords go into the avoidance list
+QUESTION_AVOID_KEYWORDS = 3         # Keywords kept per recent question
+
+# -------------------------------
+# LLM scheduler (ai/llm/scheduler.py)
+# -------------------------------
+LLM_MAX_CONCURRENCY = 2  # Calls sent to Ollama at once from this process (sum of OLLAMA_NUM_PARALLEL over OLLAMA_BACKENDS)
+LLM_PRIORITY_CLASSES = {
+    # rank: lower is served first; limit: concurrent calls; max_wait: seconds queued before giving up
+    'interactive': {'rank': 0, 'limit': 2, 'max_wait': 30},
+    'background': {'rank': 10, 'limit': 1, 'max_wait': None},
+}
+
+# Serve the LLM-bound endpoints (/quiz/api/new/, /quiz/api/check/, /assistant/api/improve/)
+# with async views. Enable when running under an ASGI server (uvicorn ai.asgi:application);
+# requires httpx.
+ASYNC_LLM_VIEWS = False
+
+# Load shedding (ai/llm/admission.py)
+LLM_MAX_QUEUE_DEPTH = 4          # Waiting calls per process before LLM views shed load
+LLM_REQUEST_BUDGET = 20          # Seconds an admitted LLM-bound request may spend waiting on the model
+LLM_REQUEST_BUDGETS = {
+    # Per-endpoint budgets (same names as LLM_RATE_LIMIT_COSTS) where the default is too short
+    'assistant_improve': 95,    # one rewrite may take up to 90 s on its own
+}
+LLM_OVERLOAD_RETRY_AFTER = 5     # Retry-After (seconds) sent with 503 responses
+
+# -------------------------------
+# LLM rate limits (ai/llm/ratelimit.py)
+# -------------------------------
+LLM_RATE_LIMIT_ENABLED = True
+LLM_RATE_LIMIT_CACHE = 'ratelimit'  # Must be shared by all workers with an atomic add() (see CACHES)
+LLM_RATE_LIMIT_TRUSTED_PROXIES = 0  # Reverse proxies in front of Django that append to X-Forwarded-For (0: use REMOTE_ADDR)
+LLM_RATE_LIMIT_BUCKETS = {
+    # capacity: burst size in tokens; refill: tokens regained per second
+    'user': {'capacity': 30, 'refill': 0.25},   # ~15 tokens/minute sustained
+    'anon': {'capacity': 10, 'refill': 0.05},   # ~3 tokens/minute sustained
+}
+LLM_RATE_LIMIT_COSTS = {
+    # Expected LLM calls per request to each endpoint
+    'quiz_new_question': 3,   # usually 1-3 generations, up to 8 with retries
+    'quiz_check_answer': 1,   # one explanation
+    'assistant_improve': 2,   # one long rewrite
+}
+
+# -------------------------------
+# Quiz settings
+# -------------------------------
+# Days after today that `build_daily_challenges` prepares in advance
+DAILY_CHALLENGE_DAYS_AHEAD = 3
+# Seconds a request waits for another worker to finish building today's challenge
+DAILY_CHALLENGE_LOCK_WAIT = 3
+
+# Read-through question cache (quiz/question_cache.py)
+QUESTION_CACHE_LRU_SIZE = 1000         # Entries kept in each worker's in-process LRU
+QUESTION_CACHE_TTL = 3600              # Seconds an entry lives in each worker's LRU
+QUESTION_CACHE_DB_TTL = 60 * 60 * 24 * 7  # Unused QuestionCache rows older than this are pruned
+QUESTION_CACHE_MAX_ROWS = 5000         # Size cap of the QuestionCache table (LRU eviction)
+QUESTION_CACHE_FLUSH_SIZE = 200        # Pending hits that trigger a hit_count flush
+QUESTION_CACHE_FLUSH_INTERVAL = 60     # ...or seconds since the last flush
+
 # Password hashing
 # Using PBKDF2 as primary hasher (built-in, no extra dependencies)
 # Still secure and recommended by Django
@@ -0,0 +1,19 @@
+# ai/test_runner.py - Test runner that drains the write-behind buffers before teardown
+#
+# ai.counters, ai.events and the question cache's hit counts are written by
+# background flushers and once more at interpreter exit. Under the test runner that
+# exit flush would run after the test database is destroyed, when the connection
+# points at the real database again, and apply test increments there. The runner
+# writes everything still buffered while the test database exists.
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    def teardown_databases(self, old_config, **kwargs):
+        from ai import counters, events
+        from quiz import question_cache
+
+        counters.flush()
+        events.flush()
+        question_cache.flush_hits()
+        super().teardown_databases(old_config, **kwargs)
@@ -0,0 +1,237 @@
+# ai/tracing.py - Lightweight span tracing with a local OTLP/JSON file exporter
+#
+# A sampled request opens a trace; the stages it runs record spans under it:
+#
+#     @tracing.traced('api_new_question', root=True)   # the request: sampled here
+#     def api_new_question(request): ...
+#
+#     @tracing.traced()                                 # a stage: a span when traced
+#     def parse_question_response(raw_text, domain, topic): ...
+#
+#     with tracing.span('attempt', attempt=attempt) as span:
+#         ...
+#         span.set('outcome', 'rejected')
+#
+# TRACE_SAMPLE_RATE decides per root whether the request is traced at all. Outside
+# a sampled trace span() hands out a shared no-op span, so an untraced request pays
+# about 2µs per instrumented stage. The current span lives in a context variable,
+# so spans nest correctly across sync_to_async threads and in async views.
+#
+# Finished traces are appended to TRACE_FILE, one line per trace, in the
+# OpenTelemetry OTLP/JSON encoding (resourceSpans -> scopeSpans -> spans, hex ids,
+# nanosecond timestamps as strings). The OpenTelemetry Collector's otlpjsonfile
+# receiver can ship the file to any tracing backend; `manage.py trace_report` reads
+# it directly and prints the slowest requests as a flame-style tree.
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = ContextVar('tracing_current_span', default=None)
+
+
+class Span:
+    """One timed operation inside a trace"""
+
+    def __init__(self, trace, name, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else ''
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.message = ''
+        self.start_ns = time.time_ns()
+        self._perf_start = time.perf_counter_ns()
+        self.end_ns = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._perf_start)
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = f"{type(error).__name__}: {error}"
+        self.trace.spans.append(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status, **({'message': self.message} if self.message else {})},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Handed out when the request is not traced"""
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        encoded = {'boolValue': value}
+    elif isinstance(value, int):
+        encoded = {'intValue': str(value)}
+    elif isinstance(value, float):
+        encoded = {'doubleValue': value}
+    else:
+        encoded = {'stringValue': str(value)}
+    return {'key': key, 'value': encoded}
+
+
+class FileSpanExporter:
+    """Appends finished traces to a file as OTLP/JSON lines"""
+
+    def __init__(self, path, service_name='grammar-quiz'):
+        self.path = Path(path)
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'ai.tracing'},
+                'spans': [span.to_otlp() for span in trace.spans],
+            }],
+        }]}, ensure_ascii=False)
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # One write per trace in append mode, so worker processes do not interleave lines
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+        except OSError as e:
+            logger.error(f"Trace export to {self.path} failed: {e}")
+
+
+class Tracer:
+    """Samples root spans and nests child spans under the current one"""
+
+    def __init__(self, exporter, sample_rate=0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """Root span of a request, recorded for a TRACE_SAMPLE_RATE share of calls"""
+        if _current.get() is not None:
+            # Already inside a trace (e.g. a traced view calling another): just a span
+            with self.span(name, **attributes) as span:
+                yield span
+            return
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            yield NOOP_SPAN
+            return
+
+        trace = Trace()
+        root = Span(trace, name, kind=SPAN_KIND_SERVER, attributes=attributes)
+        token = _current.set(root)
+        error = None
+        try:
+            yield root
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            root.end(error)
+            self.exporter.export(trace)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Child of the current span; a no-op outside a sampled trace"""
+        parent = _current.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+
+        span = Span(parent.trace, name, parent, attributes=attributes)
+        token = _current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            span.end(error)
+
+
+tracer = Tracer(
+    FileSpanExporter(
+        getattr(settings, 'TRACE_FILE', Path(settings.BASE_DIR) / 'logs' / 'traces.jsonl'),
+        service_name=getattr(settings, 'TRACE_SERVICE_NAME', 'grammar-quiz')
+    ),
+    sample_rate=getattr(settings, 'TRACE_SAMPLE_RATE', 0.0)
+)
+
+
+def trace(name, **attributes):
+    return tracer.trace(name, **attributes)
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def current_span():
+    """The active span, or the no-op span outside a trace"""
+    return _current.get() or NOOP_SPAN
+
+
+def traced(name=None, root=False):
+    """Decorator running a function (sync or async) in a span named after it; `root` starts the trace"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with (tracer.trace if root else tracer.span)(span_name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with (tracer.trace if root else tracer.span)(span_name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -17,12 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from ai.prometheus import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("assistant/", include("assistant.urls")),
     path("quiz/", include("quiz.urls")),
     path("", include("user.urls")),
     path("api/", include("api.urls")),
+    path("metrics", metrics_view, name="metrics"),
     
     
 ]
@@ -2,5 +2,5 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    # Add your API paths here
+    path('ready/', views.ready, name='ready'),
 ]
@@ -1,3 +1,11 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
 
-# Create your views here.
+from ai.llm.admission import readiness
+
+
+@require_http_methods(["GET"])
+def ready(request):
+    """Readiness probe: 503 while this worker's LLM queue is saturated"""
+    state = readiness()
+    return JsonResponse(state, status=200 if state['ready'] else 503)
@@ -1,7 +1,10 @@
 # utils/ollama_helper.py  ← FINAL VERSION (copy-paste this)
 import requests
 
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
+from ai.llm import budget, routing
+from ai.llm.client import apost_json, OllamaRejected, OllamaTimeout, OllamaUnavailable
+from ai.llm.pool import pool
+from ai.llm.scheduler import scheduler, SchedulerTimeout
 
 PROMPT_MAP = {
     "grammar": "Correct all grammar, spelling, and punctuation errors. Return only the corrected text, no explanation or extra words:\n\n",
@@ -11,40 +14,96 @@ PROMPT_MAP = {
     "summary": "Summarize the following text in 3–4 powerful, concise sentences. Return only the summary:\n\n",
 }
 
-def improve_text(text: str, task: str = "grammar") -> str:
-    task = task.lower().strip()
+# Rewrites come back about as long as the input; a summary is 3-4 sentences.
+# Models like to append a note on what they changed after a blank line.
+SUMMARY_MAX_TOKENS = 256
+MAX_OUTPUT_TOKENS = 2048
+TEXT_STOP = ["\n\nNote:", "\n\nExplanation:", "\n\nChanges made"]
+
+class WriterBusy(Exception):
+    """No LLM slot or answer in time; the view answers 503 with Retry-After"""
 
+def empty_text_response(task: str) -> str:
     # If user sends empty text → we give a smart, dynamic, funny & useful response
-    if not text or not text.strip():
-        smart_empty_responses = {
-            "grammar": "Your text is already perfect... or you forgot to write anything",
-            "rewrite": "Give me some messy text and watch me turn it into gold",
-            "formal": "Dear esteemed user, kindly provide text for formal enhancement. Thank you.",
-            "casual": "Yo! Drop some text here and I'll make it chill AF",
-            "summary": "Nothing to summarize yet... but I'm ready when you are!"
-        }
-        return smart_empty_responses.get(task, "Hey! I'm Kushal Writer — type something and I'll make it amazing")
-
-    # Normal flow: user gave text → send to Ollama
+    smart_empty_responses = {
+        "grammar": "Your text is already perfect... or you forgot to write anything",
+        "rewrite": "Give me some messy text and watch me turn it into gold",
+        "formal": "Dear esteemed user, kindly provide text for formal enhancement. Thank you.",
+        "casual": "Yo! Drop some text here and I'll make it chill AF",
+        "summary": "Nothing to summarize yet... but I'm ready when you are!"
+    }
+    return smart_empty_responses.get(task, "Hey! I'm Kushal Writer — type something and I'll make it amazing")
+
+def build_payload(text: str, task: str, route=None, model=None) -> dict:
     prompt_template = PROMPT_MAP.get(task, "Improve this text:\n\n")
     full_prompt = prompt_template + text.strip()
 
-    payload = {
-        "model": "llama3",
-        "prompt": full_prompt,
-        "stream": False,
-        "options": {
-            "temperature": 0.1 if task == "grammar" else 0.7,
-            "num_ctx": 8192,
-        }
-    }
+    route = route or routing.resolve(task)
+    if task == "summary":
+        num_predict = SUMMARY_MAX_TOKENS
+    else:
+        num_predict = min(MAX_OUTPUT_TOKENS, int(route.estimate_tokens(text) * 1.5) + 64)
+
+    # num_ctx is sized from the prompt and num_predict by the route
+    payload = route.payload(full_prompt, {
+        "temperature": 0.1 if task == "grammar" else 0.7,
+        "num_predict": num_predict,
+        "stop": TEXT_STOP,
+    }, model=model)
+    return payload
+
+def improve_text(text: str, task: str = "grammar") -> str:
+    task = task.lower().strip()
+
+    if not text or not text.strip():
+        return empty_text_response(task)
+
+    # Normal flow: user gave text → send to Ollama, falling back to the route's other models
+    route = routing.resolve(task)
+    for attempt, model in enumerate(route.models):
+        payload = build_payload(text, task, route, model)
+        try:
+            with scheduler.slot() as queued, pool.lease() as backend, routing.observe(route, payload, task=task, attempt=attempt, queued=queued) as call:
+                response = requests.post(backend.url('/api/generate'), json=payload, timeout=budget.cap(90))
+                if response.status_code >= 500:
+                    backend.mark_failed()
+                if response.ok:
+                    call.record(response.json())
+            # A 4xx (e.g. model not found) falls through to the next model below
+            response.raise_for_status()
+            result = call.response["response"].strip()
+            return result
+        except (SchedulerTimeout, requests.exceptions.Timeout) as e:
+            raise WriterBusy(str(e)) from e
+        except requests.exceptions.ConnectionError:
+            return "Ollama is not running. Run: ollama serve"
+        except Exception as e:
+            if model == route.models[-1]:
+                return f"Error: {e}"
+
+async def aimprove_text(text: str, task: str = "grammar") -> str:
+    """Async improve_text(): the wait for Ollama holds no worker thread"""
+    task = task.lower().strip()
+
+    if not text or not text.strip():
+        return empty_text_response(task)
 
-    try:
-        response = requests.post(OLLAMA_URL, json=payload, timeout=90)
-        response.raise_for_status()
-        result = response.json()["response"].strip()
-        return result
-    except requests.exceptions.ConnectionError:
-        return "Ollama is not running. Run: ollama serve"
-    except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+    route = routing.resolve(task)
+    for attempt, model in enumerate(route.models):
+        payload = build_payload(text, task, route, model)
+        try:
+            async with scheduler.aslot() as queued:
+                with pool.lease() as backend, routing.observe(route, payload, task=task, attempt=attempt, queued=queued) as call:
+                    call.record(await apost_json(backend.url('/api/generate'), payload, timeout=budget.cap(90)))
+            return call.response["response"].strip()
+        except (SchedulerTimeout, OllamaTimeout) as e:
+            raise WriterBusy(str(e)) from e
+        except OllamaRejected as e:
+            if model == route.models[-1]:
+                return f"Error: {e}"
+        except OllamaUnavailable:
+            if model == route.models[-1]:
+                return "Ollama is not running. Run: ollama serve"
+        except Exception as e:
+            if model == route.models[-1]:
+                return f"Error: {e}"
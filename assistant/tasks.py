@@ -0,0 +1,42 @@
+# assistant/tasks.py - Background jobs for the writing assistant (run by quiz.jobs workers)
+from django.db import transaction
+from django.db.models import Count
+
+from ai import events
+from quiz.jobs import task
+
+from .models import TransformationHistory, UserWritingStats
+
+
+@task('assistant.update_writing_stats')
+def update_writing_stats(user_id, characters, words, processing_time_ms):
+    """Add one transformation to the user's stats and recompute the favorite type"""
+    # History rows may still be sitting in this process's event buffer
+    events.flush()
+    
+    with transaction.atomic():
+        stats, created = UserWritingStats.objects.select_for_update().get_or_create(user_id=user_id)
+        stats.total_transformations += 1
+        stats.total_characters_processed += characters
+        stats.total_words_processed += words
+        
+        # Update average processing time
+        if stats.average_processing_time_ms == 0:
+            stats.average_processing_time_ms = processing_time_ms
+        else:
+            stats.average_processing_time_ms = (
+                (stats.average_processing_time_ms * (stats.total_transformations - 1) + processing_time_ms)
+                / stats.total_transformations
+            )
+        
+        # Update favorite transformation
+        transformation_counts = TransformationHistory.objects.filter(
+            user_id=user_id
+        ).values('transformation_type').annotate(
+            count=Count('id')
+        ).order_by('-count').first()
+        
+        if transformation_counts:
+            stats.favorite_transformation = transformation_counts['transformation_type']
+        
+        stats.save()
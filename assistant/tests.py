@@ -1,3 +1,204 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import path
+
+from ai.llm import client, routing
+from ai.llm.pool import BackendPool
+from ai.llm.scheduler import scheduler
+from . import views_async
+from .services import ai_engine
+
+# ASYNC_LLM_VIEWS picks the views when the urlconf is imported, so the async
+# view gets a urlconf of its own here
+urlpatterns = [
+    path('api/improve/', views_async.improve_api),
+]
+
+
+@override_settings(ROOT_URLCONF='assistant.tests', LLM_RATE_LIMIT_ENABLED=False)
+class AsyncImproveAPITest(TestCase):
+    """improve_api on the async stack, with Ollama behind an httpx MockTransport"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('writer')
+
+    def setUp(self):
+        cache.clear()
+        self.requests = []
+
+    def mock_ollama(self, delay=0):
+        async def handler(request):
+            self.requests.append(request)
+            if delay:
+                await asyncio.sleep(delay)
+            return httpx.Response(200, json={'response': ' Improved text. ', 'done': True, 'eval_count': 3})
+        return mock.patch.object(
+            client, 'get_async_client',
+            return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+
+    async def improve(self, text='i has a apple', task='grammar'):
+        return await self.async_client.post(
+            '/api/improve/', {'text': text, 'task': task}, content_type='application/json'
+        )
+
+    async def test_improve(self):
+        await self.async_client.aforce_login(self.user)
+        with self.mock_ollama():
+            response = await self.improve()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'result': 'Improved text.'})
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0].url.path, '/api/generate')
+
+    async def test_ollama_timeout_is_503(self):
+        def handler(request):
+            raise httpx.ReadTimeout('timed out', request=request)
+
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(client, 'get_async_client', return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = await self.improve()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    async def test_requires_login(self):
+        with self.mock_ollama():
+            response = await self.improve()
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.requests, [])
+
+    async def test_missing_text(self):
+        await self.async_client.aforce_login(self.user)
+        with self.mock_ollama():
+            response = await self.improve(text='')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.requests, [])
+
+    @override_settings(LLM_MAX_QUEUE_DEPTH=100)
+    async def test_concurrent_requests_hold_no_threads(self):
+        """Requests waiting on Ollama queue as coroutines instead of one thread each"""
+        concurrent = 30
+        await self.async_client.aforce_login(self.user)
+        threads_before = threading.active_count()
+        peak = {'depth': 0, 'threads': threads_before}
+        done = asyncio.Event()
+
+        async def watch():
+            while not done.is_set():
+                peak['depth'] = max(peak['depth'], scheduler.queue_depth('interactive'))
+                peak['threads'] = max(peak['threads'], threading.active_count())
+                await asyncio.sleep(0.005)
+
+        async def run():
+            try:
+                return await asyncio.gather(*(self.improve() for _ in range(concurrent)))
+            finally:
+                done.set()
+
+        with self.mock_ollama(delay=0.02):
+            responses, _ = await asyncio.gather(run(), watch())
+
+        self.assertEqual([r.status_code for r in responses], [200] * concurrent)
+        self.assertEqual(len(self.requests), concurrent)
+        # Most of the requests were in flight at once, waiting for a scheduler slot...
+        self.assertGreaterEqual(peak['depth'], concurrent // 2)
+        # ...while the process only gained the few threads sync_to_async uses for the session
+        self.assertLessEqual(peak['threads'] - threads_before, 4)
+
+
+@override_settings(LLM_RATE_LIMIT_ENABLED=False, LLM_REQUEST_BUDGET=20, LLM_REQUEST_BUDGETS={'assistant_improve': 95})
+class ImproveAPIViewTest(TestCase):
+    """The WSGI improve API: a rewrite keeps its own time budget and a busy model is a 503"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('writer'))
+
+    def improve(self):
+        return self.client.post('/assistant/api/improve/', {'text': 'i has a apple'}, content_type='application/json')
+
+    def test_rewrite_gets_its_own_budget(self):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"response": "I have an apple."}'
+        with mock.patch.object(ai_engine.requests, 'post', return_value=response) as post:
+            result = self.improve()
+
+        self.assertEqual(result.json(), {'result': 'I have an apple.'})
+        # Not cut down to the 20 s default budget
+        self.assertEqual(post.call_args.kwargs['timeout'], 90)
+
+    @override_settings(LLM_OVERLOAD_RETRY_AFTER=3)
+    def test_timeout_is_503(self):
+        with mock.patch.object(ai_engine.requests, 'post', side_effect=requests.exceptions.ReadTimeout()):
+            response = self.improve()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_shed_when_saturated(self):
+        with mock.patch.object(scheduler, 'queue_depth', return_value=100), \
+                mock.patch.object(ai_engine.requests, 'post') as post:
+            response = self.improve()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        post.assert_not_called()
+
+
+@mock.patch.object(BackendPool, '_ensure_checker')
+class ModelNotFoundTest(TestCase):
+    """A 404 from Ollama moves on to the route's next model and does not fail the backend"""
+
+    def setUp(self):
+        self.route = routing.Route('assistant-test', model='missing-model', fallbacks=['fallback-model'])
+        self.pool = BackendPool(['http://ollama:11434'])
+        self.models = []
+        for patcher in (mock.patch.object(ai_engine, 'pool', self.pool),
+                        mock.patch.object(routing, 'resolve', return_value=self.route)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def status_for(self, model):
+        self.models.append(model)
+        return 404 if model == 'missing-model' else 200
+
+    def post(self, url, **kwargs):
+        status = self.status_for(kwargs['json']['model'])
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps({'response': 'Fixed.'} if status == 200 else {'error': 'model not found'}).encode()
+        return response
+
+    def test_sync(self, _):
+        with mock.patch.object(ai_engine.requests, 'post', side_effect=self.post):
+            result = ai_engine.improve_text('i has a apple')
+
+        self.assertEqual(result, 'Fixed.')
+        self.assertEqual(self.models, ['missing-model', 'fallback-model'])
+        self.assertEqual(self.pool.backends[0].failures, 0)
+
+    async def test_async(self, _):
+        def handler(request):
+            status = self.status_for(json.loads(request.content)['model'])
+            return httpx.Response(status, json={'response': 'Fixed.'} if status == 200 else {'error': 'model not found'})
+
+        mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with mock.patch.object(client, 'get_async_client', return_value=mock_client):
+            result = await ai_engine.aimprove_text('i has a apple')
+
+        self.assertEqual(result, 'Fixed.')
+        self.assertEqual(self.models, ['missing-model', 'fallback-model'])
+        self.assertEqual(self.pool.backends[0].failures, 0)
@@ -1,11 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from .views import ImproveAPIView
+from . import views_async
 from . import views_enhanced
 
 urlpatterns = [
     path("improve", views.improve_page, name="kushal_writer"),
-    path("api/improve/", ImproveAPIView.as_view(), name="improve_api"),
+    path(
+        "api/improve/",
+        views_async.improve_api if settings.ASYNC_LLM_VIEWS else ImproveAPIView.as_view(),
+        name="improve_api"
+    ),
     
     # Draft Management
     path("api/drafts/save/", views_enhanced.api_save_draft, name="save_draft"),
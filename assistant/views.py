@@ -1,11 +1,16 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .services.ai_engine import improve_text
+from django.utils.decorators import method_decorator
+from ai.llm.admission import llm_admission, service_unavailable
+from ai.llm.ratelimit import llm_rate_limit
+from .services.ai_engine import improve_text, WriterBusy
 
 
 from django.shortcuts import render, redirect
 
 class ImproveAPIView(APIView):
+    @method_decorator(llm_admission(name='assistant_improve'))
+    @method_decorator(llm_rate_limit('assistant_improve'))
     def post(self, request):
         text = request.data.get("text")
         task = request.data.get("task", "grammar")
@@ -13,7 +18,10 @@ class ImproveAPIView(APIView):
         if not text:
             return Response({"error": "Text is required"}, status=400)
 
-        result = improve_text(text, task)
+        try:
+            result = improve_text(text, task)
+        except WriterBusy:
+            return service_unavailable()
         return Response({"result": result})
 
 
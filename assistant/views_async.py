@@ -0,0 +1,42 @@
+# assistant/views_async.py - Async version of the improve API (for ASGI deployments)
+#
+# Mirrors ImproveAPIView: session-authenticated POST of {"text", "task"} returning
+# {"result"}. The wait for Ollama is a coroutine, so an in-flight rewrite (up to
+# 90 s) holds no worker thread. Routed instead of ImproveAPIView when
+# ASYNC_LLM_VIEWS is enabled; HTTP Basic auth and DRF's daily throttle do not
+# apply here (the LLM rate limit does).
+import json
+
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from ai.llm.admission import llm_admission, service_unavailable
+from ai.llm.ratelimit import llm_rate_limit
+from .services.ai_engine import aimprove_text, WriterBusy
+
+
+@require_http_methods(["POST"])
+@llm_admission(name='assistant_improve')
+@llm_rate_limit('assistant_improve')
+async def improve_api(request):
+    """Improve text with the selected task"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+    
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+    except json.JSONDecodeError:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    
+    text = data.get("text")
+    task = data.get("task", "grammar")
+    
+    if not text:
+        return JsonResponse({"error": "Text is required"}, status=400)
+    
+    try:
+        result = await aimprove_text(text, task)
+    except WriterBusy:
+        return service_unavailable()
+    return JsonResponse({"result": result})
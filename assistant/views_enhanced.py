@@ -10,6 +10,9 @@ import json
 import logging
 import difflib
 
+from ai import counters, events
+from quiz import jobs
+
 from .models import (
     SavedDraft, WritingTemplate, TransformationHistory,
     UserWritingStats, TextComparison
@@ -189,13 +192,11 @@ def api_use_template(request):
         template_id = data.get('template_id')
         
         template = WritingTemplate.objects.get(id=template_id)
-        template.usage_count += 1
-        template.save()
         
-        # Update user stats
+        # Usage counters are write-behind: buffered and applied in batches
         stats, created = UserWritingStats.objects.get_or_create(user=request.user)
-        stats.total_templates_used += 1
-        stats.save()
+        counters.incr(WritingTemplate, template.id, 'usage_count')
+        counters.incr(UserWritingStats, stats.id, 'total_templates_used')
         
         return JsonResponse({
             'success': True,
@@ -247,14 +248,14 @@ def api_compare_text(request):
             elif line.startswith('-') and not line.startswith('---'):
                 differences['removed_lines'].append(line[1:])
         
-        # Save comparison
-        comparison = TextComparison.objects.create(
+        # Save comparison (buffered; inserted in a batch off the request path)
+        comparison = events.record(TextComparison(
             user=request.user,
             original_text=original_text,
             transformed_text=transformed_text,
             transformation_type=transformation_type,
             differences_highlighted=differences
-        )
+        ))
         
         # Calculate statistics
         original_words = len(original_text.split())
@@ -295,7 +296,8 @@ def api_save_transformation(request):
         transformation_type = data.get('transformation_type', '')
         processing_time_ms = data.get('processing_time_ms', 0)
         
-        history = TransformationHistory.objects.create(
+        # History rows are buffered and inserted in a batch off the request path
+        history = events.record(TransformationHistory(
             user=request.user,
             original_text=original_text,
             transformed_text=transformed_text,
@@ -305,34 +307,15 @@ def api_save_transformation(request):
             word_count_before=len(original_text.split()),
             word_count_after=len(transformed_text.split()),
             processing_time_ms=processing_time_ms
-        )
-        
-        # Update user stats
-        stats, created = UserWritingStats.objects.get_or_create(user=request.user)
-        stats.total_transformations += 1
-        stats.total_characters_processed += len(original_text)
-        stats.total_words_processed += len(original_text.split())
-        
-        # Update average processing time
-        if stats.average_processing_time_ms == 0:
-            stats.average_processing_time_ms = processing_time_ms
-        else:
-            stats.average_processing_time_ms = (
-                (stats.average_processing_time_ms * (stats.total_transformations - 1) + processing_time_ms)
-                / stats.total_transformations
-            )
-        
-        # Update favorite transformation
-        transformation_counts = TransformationHistory.objects.filter(
-            user=request.user
-        ).values('transformation_type').annotate(
-            count=Count('id')
-        ).order_by('-count').first()
-        
-        if transformation_counts:
-            stats.favorite_transformation = transformation_counts['transformation_type']
+        ))
         
-        stats.save()
+        # Stats and the favorite-type recount run after the response
+        jobs.enqueue('assistant.update_writing_stats', {
+            'user_id': request.user.id,
+            'characters': len(original_text),
+            'words': len(original_text.split()),
+            'processing_time_ms': processing_time_ms,
+        })
         
         return JsonResponse({
             'success': True,
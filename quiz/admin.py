@@ -1,9 +1,15 @@
+import json
+
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
 from django.utils.html import format_html
 from .models import (
     UserProfile, Question, QuizAttempt, UserAnswer,
     BookmarkedQuestion, DailyChallenge, DailyChallengeCompletion,
-    Achievement, UserAchievement
+    Achievement, UserAchievement, BackgroundJob, LLMCallLog, RequestProfile
 )
 
 
@@ -152,3 +158,83 @@ class UserAchievementAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'achievement__name']
     readonly_fields = ['unlocked_at']
     date_hierarchy = 'unlocked_at'
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'queue', 'status', 'attempts', 'created_at', 'started_at', 'finished_at']
+    list_filter = ['status', 'queue', 'task']
+    search_fields = ['task', 'key']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'last_error']
+    actions = ['retry_jobs']
+    
+    def retry_jobs(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='pending', attempts=0, run_after=timezone.now())
+        self.message_user(request, f'{updated} failed jobs queued for retry.')
+    retry_jobs.short_description = 'Retry selected failed jobs'
+
+
+@admin.register(LLMCallLog)
+class LLMCallLogAdmin(admin.ModelAdmin):
+    list_display = ['task', 'model', 'attempt', 'outcome', 'prompt_eval_count', 'eval_count', 'total_ms', 'elapsed_ms', 'queue_ms', 'created_at']
+    list_filter = ['outcome', 'task', 'model']
+    search_fields = ['task', 'model', 'label']
+    date_hierarchy = 'created_at'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['path', 'view_name', 'status_code', 'duration_ms', 'query_count', 'query_ms', 'user', 'created_at', 'downloads']
+    list_filter = ['view_name', 'method']
+    search_fields = ['path', 'view_name']
+    date_hierarchy = 'created_at'
+    exclude = ['stats', 'queries', 'summary']
+    readonly_fields = ['method', 'path', 'view_name', 'user', 'status_code', 'duration_ms', 'query_count', 'query_ms',
+                       'created_at', 'downloads', 'summary_display', 'slowest_queries']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path('<int:pk>/profile/', self.admin_site.admin_view(self.download_profile), name='quiz_requestprofile_profile'),
+            path('<int:pk>/queries/', self.admin_site.admin_view(self.download_queries), name='quiz_requestprofile_queries'),
+        ] + super().get_urls()
+    
+    def download_profile(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="request-{pk}.prof"'
+        return response
+    
+    def download_queries(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(json.dumps(profile.queries, ensure_ascii=False, indent=2), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="request-{pk}-queries.json"'
+        return response
+    
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">.prof</a> | <a href="{}">SQL</a>',
+            reverse('admin:quiz_requestprofile_profile', args=[obj.pk]),
+            reverse('admin:quiz_requestprofile_queries', args=[obj.pk]),
+        )
+    downloads.short_description = 'Download'
+    
+    def summary_display(self, obj):
+        return format_html('<pre style="font-size: 11px">{}</pre>', obj.summary)
+    summary_display.short_description = 'Hottest functions (cumulative)'
+    
+    def slowest_queries(self, obj):
+        queries = sorted(obj.queries, key=lambda q: q['ms'], reverse=True)[:10]
+        return format_html('<pre style="font-size: 11px">{}</pre>', '\n\n'.join(f"{q['ms']} ms  {q['sql']}" for q in queries))
+    slowest_queries.short_description = 'Slowest queries'
@@ -3,95 +3,178 @@ import requests
 import re
 import random
 import logging
+import asyncio
+from django.conf import settings
+from ai import tracing
+from ai.llm import budget, instrumentation, routing
+from ai.llm.client import apost_json, astream_generate, stream_generate, OllamaRejected, OllamaUnavailable
+from ai.llm.pool import pool
+from ai.llm.scheduler import scheduler, SchedulerTimeout
+from . import prompt_budget
+from .question_stream import StreamingQuestionParser
 from .constants import (
     QUESTION_DOMAINS, QUESTION_PATTERNS, DIFFICULTY_LEVELS, 
-    SYSTEM_PROMPT, OLLAMA_URL, MODEL
+    QUESTION_SYSTEM_PROMPT, GENERATION_LIMITS
 )
 
 logger = logging.getLogger(__name__)
 
-def ollama_generate(prompt, difficulty="मध्यम"):
-    """Generate response from Ollama with retry logic"""
+def build_generate_payload(prompt, difficulty="मध्यम", task=None, model=None):
+    """Request body for Ollama's /api/generate (model, budget and overrides come from the task's route)"""
     difficulty_settings = DIFFICULTY_LEVELS.get(difficulty, DIFFICULTY_LEVELS["मध्यम"])
+    task = task or f"question:{difficulty}"
+    family = task.split(":", 1)[0]
+    limits = GENERATION_LIMITS.get(family, GENERATION_LIMITS["question"])
+    # num_ctx is sized from the prompt by the route
+    return routing.resolve(task).payload(prompt, {
+        "temperature": difficulty_settings["temperature"],
+        "top_p": 0.9,
+        "repeat_penalty": 1.1,
+        "num_predict": limits["num_predict"],
+        "stop": limits["stop"],
+    }, model=model, system=QUESTION_SYSTEM_PROMPT if family == "question" else None)
+
+def streamed_text(parser, result):
+    """Text of a streamed generation, or None when the parser found it unusable"""
+    if parser.malformed:
+        logger.info(f"Generation stopped early, output unusable: {parser.malformed}")
+        return None
+    return result.get("response", "").strip()
+
+def ollama_generate(prompt, difficulty="मध्यम", priority=None, task=None, stream_parser=None, label=None):
+    """Generate response from Ollama with retry logic (each attempt waits for a scheduler slot).
+
+    `task` selects the LLM_ROUTES entry (default 'question:<difficulty>'); a failed
+    attempt is retried on the route's next fallback model. With `stream_parser` (a
+    parser factory such as StreamingQuestionParser) the completion is streamed and
+    generation stops as soon as the parser is done with it. `label` (e.g. the domain)
+    breaks the route's prompt evaluation figures down further. Question calls stay
+    open in the call instrumentation until parsing and validation report their outcome.
+    """
+    task = task or f"question:{difficulty}"
+    route = routing.resolve(task)
+    validated = task.startswith("question")
     
     for attempt in range(3):
+        if budget.exhausted():
+            logger.warning("Ollama request skipped: request time budget spent")
+            return None
+        model = route.model_for(attempt)
+        payload = build_generate_payload(prompt, difficulty, task, model)
         try:
-            response = requests.post(
-                OLLAMA_URL,
-                json={
-                    "model": MODEL,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": difficulty_settings["temperature"],
-                        "top_p": 0.9,
-                        "num_ctx": 4096,
-                        "repeat_penalty": 1.1
-                    }
-                },
-                timeout=30
-            )
+            if stream_parser is not None:
+                parser = stream_parser()
+                with scheduler.slot(priority) as queued, pool.lease() as backend, routing.observe(route, payload, label, task, attempt, validated, queued) as call:
+                    result = stream_generate(backend.url('/api/generate'), payload, budget.cap(30), parser.feed)
+                    call.record({**result, 'done_reason': 'malformed'} if parser.malformed else result)
+                return streamed_text(parser, result)
+
+            with scheduler.slot(priority) as queued, pool.lease() as backend, routing.observe(route, payload, label, task, attempt, validated, queued) as call:
+                response = requests.post(backend.url('/api/generate'), json=payload, timeout=budget.cap(30))
+                if response.status_code == 200:
+                    call.record(response.json())
+                elif response.status_code >= 500:
+                    backend.mark_failed()
             
             if response.status_code == 200:
-                return response.json().get("response", "").strip()
+                return call.response.get("response", "").strip()
             else:
-                logger.warning(f"Ollama API returned status {response.status_code}")
+                logger.warning(f"Ollama API returned status {response.status_code} for model {model} ({route.name})")
+                if response.status_code < 500 and model == route.models[-1]:
+                    # A 4xx (e.g. model not found) comes back on every retry of the same model
+                    return None
                 
+        except SchedulerTimeout as e:
+            # The model is saturated; retrying would only queue again
+            logger.warning(f"Ollama request not scheduled: {e}")
+            return None
+        except requests.exceptions.HTTPError as e:
+            logger.warning(f"Ollama API returned status {e.response.status_code} for model {model} ({route.name})")
+            if e.response.status_code < 500 and model == route.models[-1]:
+                return None
         except requests.exceptions.Timeout:
-            logger.warning(f"Ollama timeout on attempt {attempt + 1}")
+            logger.warning(f"Ollama timeout on attempt {attempt + 1} ({model})")
         except requests.exceptions.RequestException as e:
             logger.error(f"Ollama request failed: {e}")
         except Exception as e:
             logger.error(f"Unexpected error in ollama_generate: {e}")
         
-        # Wait before retry
-        if attempt < 2:
+        # Wait before retrying the same model; a fallback model is tried at once
+        if attempt < 2 and route.model_for(attempt + 1) == model:
             import time
-            time.sleep(1)
+            time.sleep(min(1, budget.remaining(1)))
     
     return None
 
+async def aollama_generate(prompt, difficulty="मध्यम", priority=None, task=None, stream_parser=None, label=None):
+    """Async ollama_generate(): waiting for a slot or for Ollama holds no thread"""
+    task = task or f"question:{difficulty}"
+    route = routing.resolve(task)
+    validated = task.startswith("question")
+    
+    for attempt in range(3):
+        if budget.exhausted():
+            logger.warning("Ollama request skipped: request time budget spent")
+            return None
+        model = route.model_for(attempt)
+        payload = build_generate_payload(prompt, difficulty, task, model)
+        try:
+            async with scheduler.aslot(priority) as queued:
+                with pool.lease() as backend, routing.observe(route, payload, label, task, attempt, validated, queued) as call:
+                    if stream_parser is not None:
+                        parser = stream_parser()
+                        result = await astream_generate(backend.url('/api/generate'), payload, budget.cap(30), parser.feed)
+                        call.record({**result, 'done_reason': 'malformed'} if parser.malformed else result)
+                    else:
+                        call.record(await apost_json(backend.url('/api/generate'), payload, timeout=budget.cap(30)))
+            if stream_parser is not None:
+                return streamed_text(parser, call.response)
+            return call.response.get("response", "").strip()
+        except SchedulerTimeout as e:
+            logger.warning(f"Ollama request not scheduled: {e}")
+            return None
+        except OllamaRejected as e:
+            logger.warning(f"{e} (attempt {attempt + 1}, {model})")
+            if model == route.models[-1]:
+                return None
+        except OllamaUnavailable as e:
+            logger.warning(f"{e} (attempt {attempt + 1}, {model})")
+        except Exception as e:
+            logger.error(f"Unexpected error in aollama_generate: {e}")
+        
+        if attempt < 2 and route.model_for(attempt + 1) == model:
+            await asyncio.sleep(min(1, budget.remaining(1)))
+    
+    return None
+
+@tracing.traced()
 def build_enhanced_prompt(domain, topic, instruction, difficulty, session):
     """Build comprehensive prompt for high-quality question generation"""
     used_questions = session.get('used_questions', [])
     
-    # Include context about what to avoid
-    avoidance_context = ""
-    if used_questions:
-        recent_texts = [q[:100] for q in used_questions[-10:]]
-        avoidance_context = "\nयी प्रश्नहरू वा तिनीहरूका समान विषयहरू नदोहोर्याउनुहोस्:\n- " + "\n- ".join(recent_texts)
-    
     domain_guidance = get_domain_guidance(domain)
     difficulty_info = DIFFICULTY_LEVELS[difficulty]
     
-    prompt = f"""{SYSTEM_PROMPT}
-
-विषय क्षेत्र: {domain}
+    # The fixed rules and output format travel as the system prompt (see
+    # QUESTION_SYSTEM_PROMPT); only the part below changes between questions
+    template = f"""विषय क्षेत्र: {domain}
 उप-विषय: {topic}
 स्तर: {difficulty} ({difficulty_info['description']})
 
 कार्य: {instruction}
 
-निर्देशनहरू:
-१. प्रश्न पूर्ण रूपमा नेपाली सन्दर्भमा र आधिकारिक तथ्यमा आधारित हुनुपर्छ।
-२. चारवटा विकल्पहरू (क, ख, ग, घ) दिनुहोस्। विकल्पहरू एकअर्कासँग मिल्दाजुल्दा र तार्किक हुनुपर्छ ताकि परीक्षार्थी झुक्कियोस्।
-३. केवल एउटा विकल्प मात्र सही हुनुपर्छ।
-४. भाषा शुद्ध, व्याकरणिक रूपमा सही र मानक हुनुपर्छ।
-५. कुनै पनि अतिरिक्त कुरा, व्याख्या वा भूमिका नलेख्नुहोस्। केवल तोकिएको ढाँचामा प्रश्न दिनुहोस्।
-
 {domain_guidance}
-{avoidance_context}
-
-आउटपुट ढाँचा:
-प्रश्न: [यहाँ प्रश्न लेख्नुहोस्]
-क) [पहिलो विकल्प]
-ख) [दोस्रो विकल्प]
-ग) [तेस्रो विकल्प]
-घ) [चौथो विकल्प]
-सही जवाफ: [क/ख/ग/घ]
+{{avoidance_context}}
 
+माथि दिइएको आउटपुट ढाँचामा मात्र लेख्नुहोस्।
 तपाईंको प्रश्न:"""
-    return prompt
+    
+    # What to avoid: keywords of recent questions, as many as the token budget allows
+    estimate_tokens = routing.resolve(f"question:{difficulty}").estimate_tokens
+    allowance = getattr(settings, 'QUESTION_PROMPT_TOKEN_BUDGET', 600) - estimate_tokens(template)
+    avoidance_context = prompt_budget.avoidance_context(used_questions, allowance, estimate_tokens)
+    
+    return template.replace("{avoidance_context}", avoidance_context)
 
 def get_domain_guidance(domain):
     """Get domain-specific guidance for better questions"""
@@ -106,6 +189,7 @@ def get_domain_guidance(domain):
     }
     return guidance.get(domain, "सामान्य ज्ञानको आधिकारिक र परीक्षोपयोगी प्रश्न हुनुपर्छ।")
 
+@tracing.traced()
 def parse_question_response(raw_text, domain, topic):
     """Robust parsing of question response"""
     try:
@@ -198,8 +282,16 @@ def parse_question_response(raw_text, domain, topic):
     
     return None
 
+@tracing.traced()
 def validate_question_quality(question_data, session):
-    """Comprehensive quality validation"""
+    """Comprehensive quality validation (reported as the outcome of the call that generated it)"""
+    accepted = check_question_quality(question_data, session)
+    instrumentation.resolve("parsed" if accepted else "rejected")
+    tracing.current_span().set("accepted", accepted)
+    return accepted
+
+def check_question_quality(question_data, session):
+    """The checks behind validate_question_quality()"""
     question = question_data['question']
     options = question_data['options']
     used_questions = session.get('used_questions', [])
@@ -210,6 +302,7 @@ def validate_question_quality(question_data, session):
     
     # Check for exact duplicate
     if question in used_questions:
+        prompt_budget.record_validation('duplicate')
         return False
     
     # Check option quality
@@ -226,15 +319,16 @@ def validate_question_quality(question_data, session):
     
     # Check for semantic similarity with recent questions
     recent_questions = used_questions[-8:] if len(used_questions) >= 8 else used_questions
-    for used_q in recent_questions:
-        similarity = calculate_text_similarity(question, used_q)
-        if similarity > 0.75:  # Too similar
-            return False
+    max_similarity = max((calculate_text_similarity(question, used_q) for used_q in recent_questions), default=None)
+    if max_similarity is not None and max_similarity > 0.75:  # Too similar
+        prompt_budget.record_validation('similar', max_similarity)
+        return False
     
     # Check option uniqueness
     if len(set(option_texts)) < 3:  # At least 3 unique options
         return False
     
+    prompt_budget.record_validation('accepted', max_similarity)
     return True
 
 def calculate_text_similarity(text1, text2):
@@ -250,8 +344,8 @@ def calculate_text_similarity(text1, text2):
     
     return intersection / union if union > 0 else 0.0
 
-def generate_single_question(domain, topic, difficulty, session, attempt):
-    """Generate one question attempt with optimized prompt strategy"""
+def build_question_prompt(domain, topic, difficulty, session, attempt):
+    """Prompt for one generation attempt"""
     # Use topic-based instruction if first attempt, otherwise use patterns
     if attempt == 0:
         question_instruction = f"नेपालको {topic} सम्बन्धी एउटा तथ्यगत र आधिकारिक प्रश्न निर्माण गर्नुहोस्।"
@@ -259,25 +353,52 @@ def generate_single_question(domain, topic, difficulty, session, attempt):
         pattern_index = (attempt % len(QUESTION_PATTERNS))
         question_instruction = QUESTION_PATTERNS[pattern_index].format(topic=topic)
     
-    prompt = build_enhanced_prompt(domain, topic, question_instruction, difficulty, session)
-    raw_response = ollama_generate(prompt, difficulty)
-    
+    return build_enhanced_prompt(domain, topic, question_instruction, difficulty, session)
+
+def parse_generated_question(raw_response, domain, topic):
+    """Turn a raw model response into question data, or None"""
     if not raw_response or "Error" in raw_response:
+        instrumentation.resolve("unparsed")
         return None
     
     # Try to clean common preamble/postamble before parsing
     clean_response = re.sub(r'^(यहाँ|यस्तो छ|तपाईंको प्रश्न|निश्चित रूपमा).*\n', '', raw_response, flags=re.MULTILINE)
     
-    return parse_question_response(clean_response if clean_response.strip() else raw_response, domain, topic)
+    question_data = parse_question_response(clean_response if clean_response.strip() else raw_response, domain, topic)
+    if question_data is None:
+        instrumentation.resolve("unparsed")
+    return question_data
 
-def generate_question_explanation(question_data):
-    """Generate explanation for correct answer"""
-    prompt = f"""
+def question_stream_parser():
+    """Parser factory for streamed question generation, or None when streaming is off"""
+    return StreamingQuestionParser if getattr(settings, 'LLM_STREAM_QUESTIONS', True) else None
+
+def generate_single_question(domain, topic, difficulty, session, attempt):
+    """Generate one question attempt with optimized prompt strategy"""
+    prompt = build_question_prompt(domain, topic, difficulty, session, attempt)
+    raw_response = ollama_generate(prompt, difficulty, stream_parser=question_stream_parser(), label=domain)
+    return parse_generated_question(raw_response, domain, topic)
+
+async def agenerate_single_question(domain, topic, difficulty, session, attempt):
+    """Async generate_single_question() (the session must already be loaded)"""
+    prompt = build_question_prompt(domain, topic, difficulty, session, attempt)
+    raw_response = await aollama_generate(prompt, difficulty, stream_parser=question_stream_parser(), label=domain)
+    return parse_generated_question(raw_response, domain, topic)
+
+def build_explanation_prompt(question_data):
+    return f"""
 प्रश्न: {question_data['question']}
 सही उत्तर: {question_data['correct_letter']}) {question_data['options'][question_data['correct_letter']]}
 
 यो उत्तर किन सही छ? २-३ वाक्यमा संक्षिप्त व्याख्या गर्नुहोस्:
 """
-    
-    explanation = ollama_generate(prompt, "सजिलो")
+
+def generate_question_explanation(question_data):
+    """Generate explanation for correct answer"""
+    explanation = ollama_generate(build_explanation_prompt(question_data), "सजिलो", task="explanation")
+    return explanation if explanation and "Error" not in explanation else "यो सही उत्तर हो।"
+
+async def agenerate_question_explanation(question_data):
+    """Async generate_question_explanation()"""
+    explanation = await aollama_generate(build_explanation_prompt(question_data), "सजिलो", task="explanation")
     return explanation if explanation and "Error" not in explanation else "यो सही उत्तर हो।"
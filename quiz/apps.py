@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class QuizConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quiz'
+
+    def ready(self):
+        from django.conf import settings
+
+        # Registers the question cache invalidation receivers
+        from . import question_cache  # noqa: F401
+
+        # Load the LLM models before the first question needs them
+        from ai.llm import warmup
+        if getattr(settings, 'LLM_WARMUP_ON_STARTUP', False) and warmup.is_server_process():
+            warmup.start()
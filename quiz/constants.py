@@ -85,5 +85,40 @@ SYSTEM_PROMPT = """तपाईं लोक सेवा आयोग (PSC) क
 तपाईंको काम नेपालको निजामती सेवा परीक्षा (नासु, शाखा अधिकृत) को पाठ्यक्रममा आधारित रहेर 
 अत्यन्तै सान्दर्भिक, तथ्यगत रूपमा सही, र गुणस्तरीय बहुवैकल्पिक प्रश्नहरू (MCQs) तयार पार्नु हो।"""
 
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
-MODEL = "llama3"
+# Everything in a question prompt that never changes: sent as Ollama's `system` so the
+# prompt always starts with the same tokens and their evaluation is reused from the
+# KV cache. The per-question part is built by build_enhanced_prompt().
+QUESTION_SYSTEM_PROMPT = f"""{SYSTEM_PROMPT}
+
+निर्देशनहरू:
+१. प्रश्न पूर्ण रूपमा नेपाली सन्दर्भमा र आधिकारिक तथ्यमा आधारित हुनुपर्छ।
+२. चारवटा विकल्पहरू (क, ख, ग, घ) दिनुहोस्। विकल्पहरू एकअर्कासँग मिल्दाजुल्दा र तार्किक हुनुपर्छ ताकि परीक्षार्थी झुक्कियोस्।
+३. केवल एउटा विकल्प मात्र सही हुनुपर्छ।
+४. भाषा शुद्ध, व्याकरणिक रूपमा सही र मानक हुनुपर्छ।
+५. कुनै पनि अतिरिक्त कुरा, व्याख्या वा भूमिका नलेख्नुहोस्। केवल तोकिएको ढाँचामा प्रश्न दिनुहोस्।
+
+आउटपुट ढाँचा:
+प्रश्न: [यहाँ प्रश्न लेख्नुहोस्]
+क) [पहिलो विकल्प]
+ख) [दोस्रो विकल्प]
+ग) [तेस्रो विकल्प]
+घ) [चौथो विकल्प]
+सही जवाफ: [क/ख/ग/घ]"""
+
+# Output budgets per task family (LLM_ROUTES options override them). A question is
+# ~150-250 tokens of Nepali; the stop sequences catch what models append after the
+# "सही जवाफ:" line (an explanation, a note, a second question). None of them can
+# match the start of a well-formed answer, which would return an empty response.
+GENERATION_LIMITS = {
+    "question": {
+        "num_predict": 384,
+        "stop": ["\nव्याख्या", "\nस्पष्टीकरण", "\nकारण:", "\nनोट", "\nExplanation", "\nNote", "प्रश्न २", "प्रश्न 2"],
+    },
+    "explanation": {
+        "num_predict": 192,  # २-३ वाक्य
+        "stop": ["\nप्रश्न:", "\nसही उत्तर:"],
+    },
+}
+
+# Ollama servers (OLLAMA_BACKENDS) and the model used for each task (LLM_ROUTES)
+# are configured in settings
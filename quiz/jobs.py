@@ -0,0 +1,232 @@
+# quiz/jobs.py - Lightweight DB-backed background job queue (no external broker)
+#
+# Views call enqueue('quiz.check_achievements', {'user_id': 1}) and return; the job
+# row is only written once the surrounding transaction commits. Jobs are executed
+# by worker threads, either started inside the web process (TASKS_IN_PROCESS_WORKERS)
+# or by a separate `python manage.py run_workers` process, and are claimed with a
+# conditional UPDATE so several workers/processes never run the same job twice.
+#
+# Task functions live in each app's tasks.py and register themselves with @task.
+# Jobs run after the response, so any LLM call they make is scheduled as
+# 'background' (ai.llm.scheduler) and queued user requests go first.
+import logging
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction, close_old_connections
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from ai.llm.scheduler import use_priority
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+class TaskSpec:
+    def __init__(self, name, func, queue, max_attempts, retry_delay):
+        self.name = name
+        self.func = func
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+
+def task(name, queue='default', max_attempts=3, retry_delay=5):
+    """Register a function as a background task under a dotted name"""
+    def decorator(func):
+        _registry[name] = TaskSpec(name, func, queue, max_attempts, retry_delay)
+        func.task_name = name
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, queue=None, key='', delay=0):
+    """Queue a registered task to run after the current transaction commits.
+
+    `key` de-duplicates: if an unfinished job with the same key exists, no new job
+    is created (e.g. one pending achievement check per user is enough). A unique
+    constraint on unfinished keys settles concurrent enqueues of the same key.
+    """
+    payload = payload or {}
+
+    def create():
+        spec = _get_spec(name)
+        if key and BackgroundJob.objects.filter(key=key, status__in=('pending', 'running')).exists():
+            return
+        try:
+            with transaction.atomic():
+                BackgroundJob.objects.create(
+                    task=name,
+                    queue=queue or spec.queue,
+                    payload=payload,
+                    key=key,
+                    max_attempts=spec.max_attempts,
+                    run_after=timezone.now() + timedelta(seconds=delay)
+                )
+        except IntegrityError:
+            return  # another request queued the same key first
+        ensure_workers()
+        _wakeup.set()
+
+    transaction.on_commit(create)
+
+
+def _get_spec(name):
+    if name not in _registry:
+        autodiscover_modules('tasks')
+    return _registry[name]
+
+
+def claim_next(queues=None):
+    """Atomically claim the next due job on the given queues; None when idle"""
+    now = timezone.now()
+    candidates = BackgroundJob.objects.filter(status='pending', run_after__lte=now)
+    if queues:
+        candidates = candidates.filter(queue__in=queues)
+
+    for job_id in candidates.order_by('run_after', 'id').values_list('id', flat=True)[:5]:
+        claimed = BackgroundJob.objects.filter(id=job_id, status='pending').update(
+            status='running',
+            started_at=now,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return BackgroundJob.objects.get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """Execute a claimed job and record success, a scheduled retry, or failure"""
+    try:
+        spec = _get_spec(job.task)
+        with use_priority('background'):
+            spec.func(**job.payload)
+    except Exception as e:
+        retry_delay = _registry[job.task].retry_delay if job.task in _registry else 5
+        if job.attempts < job.max_attempts:
+            job.status = 'pending'
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        job.last_error = traceback.format_exc()[-4000:]
+        job.save(update_fields=['status', 'run_after', 'finished_at', 'last_error'])
+        logger.warning(f"Job {job.id} ({job.task}) attempt {job.attempts} failed: {e}")
+        return False
+
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return True
+
+
+def requeue_stale(timeout=None):
+    """Return jobs stuck in 'running' (crashed worker) to the queue, failing those out of attempts"""
+    timeout = timeout or getattr(settings, 'TASKS_JOB_TIMEOUT', 300)
+    now = timezone.now()
+    stale = BackgroundJob.objects.filter(status='running', started_at__lt=now - timedelta(seconds=timeout))
+    
+    # A job that keeps taking its worker down must not be retried forever
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed',
+        finished_at=now,
+        last_error=f'Worker stopped or exceeded TASKS_JOB_TIMEOUT ({timeout}s) on the last attempt'
+    )
+    if failed:
+        logger.warning(f"Failed {failed} stale job(s) that used up their attempts")
+    return stale.update(status='pending')
+
+
+def prune_finished(retention=None):
+    """Delete finished jobs older than the retention period"""
+    retention = retention or getattr(settings, 'TASKS_RETENTION', 60 * 60 * 24)
+    return BackgroundJob.objects.filter(
+        status__in=('done', 'failed'),
+        finished_at__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()[0]
+
+
+def work(queues=None, stop_event=None, poll_interval=1.0, drain=False):
+    """Worker loop: claim and run jobs until stopped (or the queue is empty when drain=True)"""
+    autodiscover_modules('tasks')
+    last_maintenance = 0
+    while stop_event is None or not stop_event.is_set():
+        job = None
+        try:
+            if time.monotonic() - last_maintenance > 60:
+                requeue_stale()
+                prune_finished()
+                last_maintenance = time.monotonic()
+            job = claim_next(queues)
+            if job is not None:
+                run_job(job)
+        except Exception as e:
+            logger.error(f"Worker loop error: {e}", exc_info=True)
+        finally:
+            close_old_connections()
+
+        if job is None:
+            if drain:
+                return
+            _wakeup.wait(poll_interval)
+            _wakeup.clear()
+
+
+def ensure_workers():
+    """Start the in-process worker threads once per process (if configured)"""
+    count = getattr(settings, 'TASKS_IN_PROCESS_WORKERS', 0)
+    if not count or _workers:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(count):
+            thread = threading.Thread(target=work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def queue_stats():
+    """Per-queue depth and latency figures for monitoring"""
+    now = timezone.now()
+    recent = now - timedelta(hours=1)
+    stats = {}
+
+    rows = BackgroundJob.objects.values('queue').annotate(
+        pending=Count('id', filter=Q(status='pending')),
+        running=Count('id', filter=Q(status='running')),
+        failed=Count('id', filter=Q(status='failed')),
+        oldest_pending=Min('created_at', filter=Q(status='pending')),
+    )
+    for row in rows:
+        oldest = row['oldest_pending']
+        stats[row['queue']] = {
+            'pending': row['pending'],
+            'running': row['running'],
+            'failed': row['failed'],
+            'oldest_pending_seconds': round((now - oldest).total_seconds(), 1) if oldest else 0,
+        }
+
+    latency = BackgroundJob.objects.filter(status='done', finished_at__gte=recent).values('queue').annotate(
+        completed=Count('id'),
+        wait=Avg(ExpressionWrapper(F('started_at') - F('created_at'), output_field=DurationField())),
+        run=Avg(ExpressionWrapper(F('finished_at') - F('started_at'), output_field=DurationField())),
+    )
+    for row in latency:
+        entry = stats.setdefault(row['queue'], {'pending': 0, 'running': 0, 'failed': 0, 'oldest_pending_seconds': 0})
+        entry['completed_last_hour'] = row['completed']
+        entry['avg_wait_seconds'] = round(row['wait'].total_seconds(), 3) if row['wait'] else 0
+        entry['avg_run_seconds'] = round(row['run'].total_seconds(), 3) if row['run'] else 0
+
+    return stats
@@ -0,0 +1,36 @@
+# quiz/management/commands/build_daily_challenges.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from quiz.utils import prepare_daily_challenge
+
+
+class Command(BaseCommand):
+    help = 'Prebuild daily challenge payloads for today and the next N days (run from cron before midnight)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'DAILY_CHALLENGE_DAYS_AHEAD', 3),
+            help='How many days after today to prepare as well'
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        
+        for offset in range(options['days'] + 1):
+            date = today + timedelta(days=offset)
+            payload = prepare_daily_challenge(date)
+            
+            if payload['questions']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Prepared daily challenge for {date}: {len(payload["questions"])} questions'
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f'Skipped {date}: no approved questions available yet'
+                ))
@@ -0,0 +1,20 @@
+# quiz/management/commands/check_ollama.py
+from django.core.management.base import BaseCommand
+
+from ai.llm.pool import pool
+
+
+class Command(BaseCommand):
+    help = 'Health-check every Ollama backend in OLLAMA_BACKENDS'
+
+    def handle(self, *args, **options):
+        results = pool.check_all()
+        
+        for url, ok in results.items():
+            if ok:
+                self.stdout.write(self.style.SUCCESS(f'{url}: healthy'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{url}: unreachable'))
+        
+        healthy = sum(results.values())
+        self.stdout.write(f'{healthy}/{len(results)} backends healthy')
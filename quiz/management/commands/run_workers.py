@@ -0,0 +1,61 @@
+# quiz/management/commands/run_workers.py
+import threading
+
+from django.core.management.base import BaseCommand
+
+from quiz import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers (quiz/jobs.py) in the foreground until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queues',
+            default='',
+            help='Comma-separated queues to serve, e.g. "default,llm" (default: all)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=2,
+            help='Number of worker threads'
+        )
+        parser.add_argument(
+            '--drain',
+            action='store_true',
+            help='Exit once no due jobs are left instead of waiting for new ones'
+        )
+
+    def handle(self, *args, **options):
+        queues = [q.strip() for q in options['queues'].split(',') if q.strip()] or None
+        stop_event = threading.Event()
+        
+        threads = [
+            threading.Thread(
+                target=jobs.work,
+                kwargs={'queues': queues, 'stop_event': stop_event, 'drain': options['drain']},
+                name=f'job-worker-{i}',
+                daemon=True
+            )
+            for i in range(max(1, options['concurrency']))
+        ]
+        for thread in threads:
+            thread.start()
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Started {len(threads)} workers on queues: {", ".join(queues) if queues else "all"}'
+        ))
+        
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers after their current job...')
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+        
+        for queue, stats in jobs.queue_stats().items():
+            self.stdout.write(f'{queue}: {stats["pending"]} pending, {stats["failed"]} failed')
@@ -0,0 +1,120 @@
+# quiz/management/commands/trace_report.py
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai.tracing import tracer
+
+
+def load_traces(path):
+    """Spans from an OTLP/JSON lines file, grouped by trace id"""
+    traces = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            for resource in data.get('resourceSpans', []):
+                for scope in resource.get('scopeSpans', []):
+                    for span in scope.get('spans', []):
+                        traces[span['traceId']].append({
+                            'trace': span['traceId'],
+                            'id': span['spanId'],
+                            'parent': span.get('parentSpanId', ''),
+                            'name': span['name'],
+                            'start': int(span['startTimeUnixNano']),
+                            'end': int(span['endTimeUnixNano']),
+                            'attributes': {
+                                a['key']: next(iter(a['value'].values()), '') for a in span.get('attributes', [])
+                            },
+                            'error': span.get('status', {}).get('code') == 2,
+                        })
+    return traces
+
+
+class Command(BaseCommand):
+    help = 'Flame-style breakdown of the slowest traced requests (TRACE_FILE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slowest', type=int, default=10, help='Number of requests to show (default 10)')
+        parser.add_argument('--name', help='Only requests whose root span has this name, e.g. api_new_question')
+        parser.add_argument('--file', help='Trace file to read (default TRACE_FILE)')
+        parser.add_argument('--width', type=int, default=40, help='Width of the timeline bars')
+
+    def handle(self, *args, **options):
+        path = options['file'] or tracer.exporter.path
+        try:
+            traces = load_traces(path)
+        except FileNotFoundError:
+            raise CommandError(f"No trace file at {path} (is TRACE_SAMPLE_RATE above 0?)")
+
+        requests = []
+        for spans in traces.values():
+            root = next((s for s in spans if not s['parent']), None)
+            if root is not None and (not options['name'] or root['name'] == options['name']):
+                requests.append((root, spans))
+        if not requests:
+            self.stdout.write(self.style.WARNING('No traced requests found'))
+            return
+
+        requests.sort(key=lambda item: item[0]['end'] - item[0]['start'], reverse=True)
+        slowest = requests[:options['slowest']]
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(slowest)} slowest of {len(requests)} traced requests from {path}"
+        ))
+        for root, spans in slowest:
+            self.print_trace(root, spans, options['width'])
+        self.print_stages(slowest)
+
+    def print_trace(self, root, spans, width):
+        children = defaultdict(list)
+        for span in spans:
+            children[span['parent']].append(span)
+        total = max(root['end'] - root['start'], 1)
+        started = datetime.fromtimestamp(root['start'] / 1e9).strftime('%Y-%m-%d %H:%M:%S')
+
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{root['name']}  {(root['end'] - root['start']) / 1e6:.1f} ms  {started}  trace {root['trace']}"
+        ))
+
+        def walk(span, depth):
+            duration = span['end'] - span['start']
+            offset = int((span['start'] - root['start']) / total * width)
+            bar = ' ' * offset + '█' * max(1, round(duration / total * width))
+            details = ' '.join(f"{k}={v}" for k, v in span['attributes'].items())
+            label = f"{'  ' * depth}{span['name']}{' ' + details if details else ''}"
+            line = f"{bar[:width + 1]:<{width + 1}} {duration / 1e6:9.1f} ms {duration / total:6.1%}  {label}"
+            self.stdout.write(self.style.ERROR(line) if span['error'] else line)
+            for child in sorted(children[span['id']], key=lambda s: s['start']):
+                walk(child, depth + 1)
+
+        walk(root, 0)
+
+    def print_stages(self, requests):
+        """Time and calls per span name, summed over the listed requests"""
+        stages = defaultdict(lambda: {'calls': 0, 'total': 0, 'errors': 0})
+        request_time = 0
+        for root, spans in requests:
+            request_time += root['end'] - root['start']
+            for span in spans:
+                if span is root:
+                    continue
+                stage = stages[span['name']]
+                stage['calls'] += 1
+                stage['total'] += span['end'] - span['start']
+                stage['errors'] += span['error']
+
+        self.stdout.write('')
+        # Nested stages overlap their parents, so shares do not add up to 100%
+        self.stdout.write(self.style.MIGRATE_HEADING('Stages over these requests (share of request time)'))
+        self.stdout.write(f"{'stage':<28} {'calls/request':>13} {'avg ms':>9} {'total ms':>10} {'share':>7} {'errors':>6}")
+        for name, stage in sorted(stages.items(), key=lambda item: item[1]['total'], reverse=True):
+            self.stdout.write(
+                f"{name:<28} {stage['calls'] / len(requests):>13.1f} {stage['total'] / stage['calls'] / 1e6:>9.1f} "
+                f"{stage['total'] / 1e6:>10.1f} {stage['total'] / max(request_time, 1):>7.1%} {stage['errors']:>6}"
+            )
+
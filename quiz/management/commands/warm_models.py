@@ -0,0 +1,32 @@
+# quiz/management/commands/warm_models.py
+from django.core.management.base import BaseCommand
+
+from ai.llm.warmup import manager
+
+
+class Command(BaseCommand):
+    help = 'Load every model in LLM_ROUTES on every Ollama backend (optionally keep them loaded)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--heartbeat', action='store_true',
+                            help='Keep running and re-ping models that go idle (LLM_HEARTBEAT_INTERVAL)')
+
+    def handle(self, *args, **options):
+        outcomes = manager.warm_all()
+        if not outcomes:
+            self.stdout.write(self.style.WARNING('No healthy backends to warm'))
+        
+        for (url, model), outcome in outcomes.items():
+            if outcome['ok']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{url} {model}: loaded in {outcome['load_ms']} ms ({outcome['total_ms']} ms total, num_ctx {outcome['num_ctx']})"
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f"{url} {model}: {outcome['error']}"))
+        
+        if options['heartbeat']:
+            self.stdout.write(f'Keeping models loaded (heartbeat every {manager.heartbeat_interval}s)...')
+            try:
+                manager.run(warm_first=False)
+            except KeyboardInterrupt:
+                self.stdout.write(self.style.SUCCESS('Stopped'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0002_questioncache_timedquizsession_userpreferences_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timedquizsession',
+            name='question_ids',
+            field=models.JSONField(blank=True, default=list, help_text='Ordered ids of the questions reserved for this session'),
+        ),
+    ]
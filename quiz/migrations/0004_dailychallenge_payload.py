@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0003_timedquizsession_question_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailychallenge',
+            name='payload',
+            field=models.JSONField(blank=True, help_text='Prebuilt question payload served to every user', null=True),
+        ),
+    ]
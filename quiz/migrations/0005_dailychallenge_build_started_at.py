@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0004_dailychallenge_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailychallenge',
+            name='build_started_at',
+            field=models.DateTimeField(blank=True, help_text='Set while one worker holds the build claim', null=True),
+        ),
+    ]
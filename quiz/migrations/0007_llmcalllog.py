@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0006_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=50)),
+                ('route', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=100)),
+                ('attempt', models.IntegerField(default=0)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('outcome', models.CharField(choices=[('ok', 'OK'), ('parsed', 'Parsed'), ('rejected', 'Rejected by validator'), ('unparsed', 'Unparsed'), ('malformed', 'Malformed'), ('timeout', 'Timeout'), ('error', 'Error')], max_length=20)),
+                ('done_reason', models.CharField(blank=True, max_length=30)),
+                ('prompt_eval_count', models.IntegerField(blank=True, null=True)),
+                ('eval_count', models.IntegerField(blank=True, null=True)),
+                ('load_ms', models.FloatField(blank=True, null=True)),
+                ('prompt_eval_ms', models.FloatField(blank=True, null=True)),
+                ('eval_ms', models.FloatField(blank=True, null=True)),
+                ('total_ms', models.FloatField(blank=True, null=True)),
+                ('elapsed_ms', models.FloatField(help_text='Wall time seen by the caller')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'LLM Call Log',
+                'verbose_name_plural': 'LLM Call Logs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['task', 'created_at'], name='quiz_llmcal_task_060be5_idx')],
+            },
+        ),
+    ]
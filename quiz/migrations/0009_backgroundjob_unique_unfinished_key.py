@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:53
+
+from django.db import migrations, models
+
+
+def fail_duplicate_unfinished_jobs(apps, schema_editor):
+    """Keep the oldest unfinished job per key; the racing duplicates are marked failed"""
+    BackgroundJob = apps.get_model('quiz', 'BackgroundJob')
+    unfinished = BackgroundJob.objects.filter(status__in=['pending', 'running']).exclude(key='')
+    seen = set()
+    for job_id, key in unfinished.order_by('id').values_list('id', 'key'):
+        if key in seen:
+            BackgroundJob.objects.filter(id=job_id).update(status='failed', last_error='Duplicate of an unfinished job with the same key')
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0008_requestprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_unfinished_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='backgroundjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running']), models.Q(('key', ''), _negated=True)), fields=('key',), name='unique_unfinished_job_key'),
+        ),
+    ]
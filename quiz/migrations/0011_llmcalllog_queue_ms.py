@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0010_llm_rate_limit_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmcalllog',
+            name='queue_ms',
+            field=models.FloatField(blank=True, help_text='Time spent waiting for a scheduler slot', null=True),
+        ),
+    ]
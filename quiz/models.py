@@ -1,7 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 
 
@@ -127,17 +128,31 @@ class DailyChallenge(models.Model):
     """Daily challenge questions"""
     date = models.DateField(unique=True, db_index=True)
     questions = models.ManyToManyField(Question, related_name='daily_challenges')
+    payload = models.JSONField(null=True, blank=True, help_text="Prebuilt question payload served to every user")
+    build_started_at = models.DateTimeField(null=True, blank=True, help_text="Set while one worker holds the build claim")
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"Daily Challenge - {self.date}"
     
+    @staticmethod
+    def payload_cache_key(date):
+        return f"daily_challenge_payload:{date.isoformat()}"
+    
     class Meta:
         verbose_name = "Daily Challenge"
         verbose_name_plural = "Daily Challenges"
         ordering = ['-date']
 
 
+@receiver(m2m_changed, sender=DailyChallenge.questions.through)
+def invalidate_daily_challenge_payload(sender, instance, action, **kwargs):
+    """Drop the prebuilt payload when a challenge's questions are edited (e.g. in the admin)"""
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, DailyChallenge):
+        DailyChallenge.objects.filter(pk=instance.pk).update(payload=None)
+        cache.delete(DailyChallenge.payload_cache_key(instance.date))
+
+
 class DailyChallengeCompletion(models.Model):
     """Track user completion of daily challenges"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_completions')
@@ -240,6 +255,7 @@ class TimedQuizSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timed_sessions')
     duration_minutes = models.IntegerField(default=30, help_text="Quiz duration in minutes")
     questions_count = models.IntegerField(default=20)
+    question_ids = models.JSONField(default=list, blank=True, help_text="Ordered ids of the questions reserved for this session")
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
@@ -380,3 +396,110 @@ class Leaderboard(models.Model):
 def create_user_preferences(sender, instance, created, **kwargs):
     if created:
         UserPreferences.objects.create(user=instance)
+
+
+class BackgroundJob(models.Model):
+    """Work deferred until after the response, executed by quiz.jobs workers"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    queue = models.CharField(max_length=50, default='default', db_index=True)
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=200, blank=True, db_index=True, help_text="De-duplication key for unfinished jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.task} [{self.queue}] - {self.status}"
+    
+    class Meta:
+        verbose_name = "Background Job"
+        verbose_name_plural = "Background Jobs"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'queue', 'run_after']),
+        ]
+        constraints = [
+            # At most one unfinished job per de-duplication key
+            models.UniqueConstraint(
+                fields=['key'],
+                condition=models.Q(status__in=['pending', 'running']) & ~models.Q(key=''),
+                name='unique_unfinished_job_key'
+            ),
+        ]
+
+
+class LLMCallLog(models.Model):
+    """Sampled record of one LLM call (written by ai.llm.instrumentation)"""
+    OUTCOME_CHOICES = [
+        ('ok', 'OK'),
+        ('parsed', 'Parsed'),
+        ('rejected', 'Rejected by validator'),
+        ('unparsed', 'Unparsed'),
+        ('malformed', 'Malformed'),
+        ('timeout', 'Timeout'),
+        ('error', 'Error'),
+    ]
+    
+    task = models.CharField(max_length=50)
+    route = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    attempt = models.IntegerField(default=0)
+    label = models.CharField(max_length=100, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    done_reason = models.CharField(max_length=30, blank=True)
+    prompt_eval_count = models.IntegerField(null=True, blank=True)
+    eval_count = models.IntegerField(null=True, blank=True)
+    load_ms = models.FloatField(null=True, blank=True)
+    prompt_eval_ms = models.FloatField(null=True, blank=True)
+    eval_ms = models.FloatField(null=True, blank=True)
+    total_ms = models.FloatField(null=True, blank=True)
+    elapsed_ms = models.FloatField(help_text="Wall time seen by the caller")
+    queue_ms = models.FloatField(null=True, blank=True, help_text="Time spent waiting for a scheduler slot")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.task} on {self.model} - {self.outcome}"
+    
+    class Meta:
+        verbose_name = "LLM Call Log"
+        verbose_name_plural = "LLM Call Logs"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['task', 'created_at']),
+        ]
+
+
+class RequestProfile(models.Model):
+    """cProfile output and SQL of one request profiled on demand (ai.profiling)"""
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles')
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.IntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    summary = models.TextField(blank=True, help_text="Functions with the highest cumulative time")
+    stats = models.BinaryField(help_text="pstats data, as written by cProfile's dump_stats()")
+    queries = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.duration_ms} ms"
+    
+    class Meta:
+        verbose_name = "Request Profile"
+        verbose_name_plural = "Request Profiles"
+        ordering = ['-created_at']
@@ -0,0 +1,129 @@
+# quiz/prompt_budget.py - Token-budgeted avoidance context for question prompts
+#
+# The question prompt tells the model which recent questions not to repeat. Pasting
+# the last ten question texts costs ~1000 characters of Devanagari, roughly as many
+# tokens, on every call. Instead each recent question is reduced to a few keywords
+# (question words, particles and postpositions dropped, the longest remaining words
+# kept), keywords shared by several questions are listed once, and they are added
+# newest first only while the prompt stays within QUESTION_PROMPT_TOKEN_BUDGET.
+#
+# stats() compares the tokens spent on the avoidance list with what the raw texts
+# would have cost, next to the diversity figures from validate_question_quality():
+# how many generated questions were duplicates or too similar to a recent one, and
+# the average highest similarity of the accepted ones.
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+AVOIDANCE_HEADER = "\nयी विषय वा शब्दहरूसँग सम्बन्धित प्रश्न नदोहोर्याउनुहोस्: "
+
+# Words that say nothing about what a question covers
+STOP_WORDS = {
+    'कुन', 'कुनै', 'के', 'कति', 'कसले', 'कसको', 'कहिले', 'कहाँ', 'किन', 'कसरी', 'कस्तो',
+    'हो', 'होइन', 'छ', 'छन्', 'थियो', 'थिए', 'हुन्', 'हुने', 'हुन्छ', 'भयो', 'भएको', 'भएका',
+    'गर्ने', 'गरेको', 'गरिएको', 'गरिन्छ', 'रहेको', 'रहेका', 'सक्ने', 'लागि', 'सम्बन्धी', 'अनुसार',
+    'निम्न', 'निम्नमध्ये', 'मध्ये', 'तलका', 'तल', 'दिइएका', 'सही', 'गलत', 'उत्तर', 'प्रश्न',
+    'र', 'वा', 'पनि', 'यो', 'त्यो', 'यी', 'ती', 'एक', 'एउटा', 'भन्दा', 'बीच', 'साथ', 'नै',
+    'नेपाल', 'नेपालको', 'नेपालमा', 'नेपाली', 'व्यवस्था', 'सबैभन्दा', 'पहिलो', 'प्रमुख', 'मुख्य', 'सुरु',
+}
+# Verb forms ("गर्नुपर्छ", "गरेका", "भएको") never name a subject
+VERB_ENDINGS = ('पर्छ', 'न्छ', 'छन्', 'थियो', 'थिए', 'एको', 'एका', 'िएको', 'ेको', 'ेका')
+SUFFIXES = ('हरूको', 'हरूमा', 'हरू', 'देखि', 'सम्म', 'बाट', 'लाई', 'सँग', 'को', 'का', 'की', 'मा', 'ले')
+WORD_RE = re.compile(r"[^\s,।?!:;\"'()\[\]{}\-–—/]+")
+
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _stem(word):
+    # Drop one attached postposition, but never leave a stub
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def question_keywords(text, limit=None):
+    """The few words of a question that identify its subject, longest first"""
+    limit = limit or _setting('QUESTION_AVOID_KEYWORDS', 3)
+    words = []
+    for word in WORD_RE.findall(text):
+        if word in STOP_WORDS or word.endswith(VERB_ENDINGS):
+            continue
+        word = _stem(word)
+        if len(word) < 3 or word in STOP_WORDS or word in words:
+            continue
+        words.append(word)
+    return sorted(words, key=len, reverse=True)[:limit]
+
+
+def raw_avoidance_context(used_questions):
+    """The avoidance list as it used to be built: the last ten texts, 100 chars each"""
+    if not used_questions:
+        return ""
+    recent_texts = [q[:100] for q in used_questions[-10:]]
+    return "\nयी प्रश्नहरू वा तिनीहरूका समान विषयहरू नदोहोर्याउनुहोस्:\n- " + "\n- ".join(recent_texts)
+
+
+def avoidance_context(used_questions, token_allowance, estimate_tokens):
+    """Keyword avoidance list for the recent questions that fits in `token_allowance` tokens"""
+    keywords = []
+    for text in reversed(used_questions[-_setting('QUESTION_AVOID_RECENT', 10):]):
+        for keyword in question_keywords(text):
+            if keyword not in keywords:
+                keywords.append(keyword)
+
+    chosen = []
+    for keyword in keywords:
+        if estimate_tokens(AVOIDANCE_HEADER + ", ".join(chosen + [keyword])) > token_allowance:
+            break
+        chosen.append(keyword)
+    context = AVOIDANCE_HEADER + ", ".join(chosen) if chosen else ""
+
+    if used_questions:
+        with _lock:
+            _stats['prompts'] += 1
+            _stats['avoidance_tokens'] += estimate_tokens(context) if context else 0
+            _stats['raw_avoidance_tokens'] += estimate_tokens(raw_avoidance_context(used_questions))
+            _stats['keywords_used'] += len(chosen)
+            _stats['keywords_dropped'] += len(keywords) - len(chosen)
+    return context
+
+
+def record_validation(outcome, max_similarity=None):
+    """Count a generated question as 'accepted', 'duplicate' or 'similar'"""
+    with _lock:
+        _stats[outcome] += 1
+        if outcome == 'accepted' and max_similarity is not None:
+            _stats['accepted_with_history'] += 1
+            _stats['similarity_total'] += max_similarity
+
+
+def stats():
+    """Prompt tokens saved by the keyword list, next to question diversity"""
+    with _lock:
+        s = dict(_stats)
+    prompts = s.get('prompts', 0)
+    raw = s.get('raw_avoidance_tokens', 0)
+    spent = s.get('avoidance_tokens', 0)
+    judged = sum(s.get(k, 0) for k in ('accepted', 'duplicate', 'similar'))
+    with_history = s.get('accepted_with_history', 0)
+    return {
+        'prompts': prompts,
+        'avg_avoidance_tokens': round(spent / prompts, 1) if prompts else 0,
+        'avg_raw_avoidance_tokens': round(raw / prompts, 1) if prompts else 0,
+        'tokens_saved_per_prompt': round((raw - spent) / prompts, 1) if prompts else 0,
+        'keywords_used': s.get('keywords_used', 0),
+        'keywords_dropped': s.get('keywords_dropped', 0),
+        'accepted': s.get('accepted', 0),
+        'rejected_duplicate': s.get('duplicate', 0),
+        'rejected_similar': s.get('similar', 0),
+        'repeat_rate': round((s.get('duplicate', 0) + s.get('similar', 0)) / judged, 4) if judged else 0,
+        'avg_max_similarity': round(s.get('similarity_total', 0) / with_history, 4) if with_history else 0,
+    }
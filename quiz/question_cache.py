@@ -0,0 +1,247 @@
+# quiz/question_cache.py - Read-through question cache with batched hit counting
+#
+# Lookups go through three tiers: in-process LRU -> QuestionCache table -> Question.
+# Every tier that misses is filled on the way back. Hit counts are accumulated in
+# memory and written to QuestionCache.hit_count in a few grouped UPDATEs.
+#
+# There is no Django cache tier: the default cache is a per-process LocMemCache,
+# which would only duplicate the LRU, and a database cache would duplicate the
+# QuestionCache table. An edit clears every tier in the process that made it;
+# other workers' LRUs catch up within QUESTION_CACHE_TTL.
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Question, QuestionCache
+
+logger = logging.getLogger(__name__)
+
+QUESTION_FIELDS = ('id', 'question_text', 'options', 'correct_answer', 'domain', 'topic', 'difficulty', 'explanation')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_key(question_id):
+    return f"question:{question_id}"
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a size cap and per-entry TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_lru = LRUCache(
+    max_size=_setting('QUESTION_CACHE_LRU_SIZE', 1000),
+    ttl=_setting('QUESTION_CACHE_TTL', 3600)
+)
+_stats = Counter()
+_pending_hits = Counter()
+_last_flush = time.monotonic()
+_state_lock = threading.Lock()
+
+
+def serialize_question(question):
+    """Plain dict of the fields served to clients and graders"""
+    return {field: getattr(question, field) for field in QUESTION_FIELDS}
+
+
+def get_question(question_id):
+    """Return the serialized question for an id, or None if it does not exist"""
+    return get_questions([question_id]).get(question_id)
+
+
+def get_questions(question_ids):
+    """Return {id: serialized question} for the given ids, reading through every tier"""
+    found = {}
+    missing = []
+
+    for qid in question_ids:
+        data = _lru.get(qid)
+        if data is not None:
+            found[qid] = data
+        else:
+            missing.append(qid)
+    _record('lru_hits', len(found))
+
+    if missing:
+        rows = QuestionCache.objects.filter(
+            cache_key__in=[cache_key(qid) for qid in missing]
+        ).values_list('question_id', 'cached_data')
+        hits = 0
+        for qid, data in rows:
+            found[qid] = data
+            _lru.set(qid, data)
+            hits += 1
+        missing = [qid for qid in missing if qid not in found]
+        _record('db_hits', hits)
+
+    if missing:
+        questions = Question.objects.filter(id__in=missing).only(*QUESTION_FIELDS)
+        rows = []
+        for question in questions:
+            data = serialize_question(question)
+            found[question.id] = data
+            _lru.set(question.id, data)
+            rows.append(QuestionCache(question=question, cache_key=cache_key(question.id), cached_data=data))
+        if rows:
+            QuestionCache.objects.bulk_create(rows, ignore_conflicts=True)
+        _record('misses', len(rows))
+        _record('not_found', len(missing) - len(rows))
+
+    _count_hits(qid for qid in question_ids if qid in found)
+    return found
+
+
+def invalidate(question_id):
+    """Drop a question from every tier"""
+    _lru.delete(question_id)
+    QuestionCache.objects.filter(cache_key=cache_key(question_id)).delete()
+
+
+def _record(stat, amount):
+    if amount:
+        with _state_lock:
+            _stats[stat] += amount
+
+
+def _count_hits(question_ids):
+    """Accumulate hits in memory and flush once enough have piled up or enough time passed"""
+    with _state_lock:
+        for qid in question_ids:
+            _pending_hits[qid] += 1
+        due = (
+            sum(_pending_hits.values()) >= _setting('QUESTION_CACHE_FLUSH_SIZE', 200)
+            or time.monotonic() - _last_flush >= _setting('QUESTION_CACHE_FLUSH_INTERVAL', 60)
+        )
+    if due:
+        flush_hits()
+
+
+def flush_hits():
+    """Write pending hit counts with one UPDATE per distinct increment, then prune the table"""
+    global _last_flush
+    with _state_lock:
+        pending = dict(_pending_hits)
+        _pending_hits.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return 0
+
+    by_amount = defaultdict(list)
+    for qid, hits in pending.items():
+        by_amount[hits].append(qid)
+    written = set()
+
+    now = timezone.now()
+    for hits, qids in by_amount.items():
+        try:
+            QuestionCache.objects.filter(cache_key__in=[cache_key(qid) for qid in qids]).update(
+                hit_count=F('hit_count') + hits,
+                last_accessed=now
+            )
+        except Exception as e:
+            # Put back only the counts not written yet: a transient DB error must
+            # neither lose them nor count the groups already written twice
+            logger.error(f"Question cache hit flush failed: {e}")
+            with _state_lock:
+                for qid, pending_hits in pending.items():
+                    if pending_hits not in written:
+                        _pending_hits[qid] += pending_hits
+            return 0
+        written.add(hits)
+    try:
+        prune()
+    except Exception as e:
+        logger.error(f"Question cache prune failed: {e}")
+
+    with _state_lock:
+        _stats['flushes'] += 1
+    return len(pending)
+
+
+def prune():
+    """Evict expired rows and the least recently used rows beyond the size cap"""
+    db_ttl = _setting('QUESTION_CACHE_DB_TTL', 60 * 60 * 24 * 7)
+    max_rows = _setting('QUESTION_CACHE_MAX_ROWS', 5000)
+
+    QuestionCache.objects.filter(last_accessed__lt=timezone.now() - timedelta(seconds=db_ttl)).delete()
+
+    overflow = QuestionCache.objects.order_by('-last_accessed').values_list('id', flat=True)[max_rows:]
+    overflow_ids = list(overflow)
+    if overflow_ids:
+        QuestionCache.objects.filter(id__in=overflow_ids).delete()
+
+
+def get_stats():
+    """Hit/miss counters and ratios for each tier since process start"""
+    with _state_lock:
+        stats = dict(_stats)
+        pending = sum(_pending_hits.values())
+
+    lookups = sum(stats.get(k, 0) for k in ('lru_hits', 'db_hits', 'misses', 'not_found'))
+    hits = sum(stats.get(k, 0) for k in ('lru_hits', 'db_hits'))
+    return {
+        **{k: stats.get(k, 0) for k in ('lru_hits', 'db_hits', 'misses', 'not_found', 'flushes')},
+        'lookups': lookups,
+        'hit_ratio': round(hits / lookups, 4) if lookups else 0,
+        'lru_hit_ratio': round(stats.get('lru_hits', 0) / lookups, 4) if lookups else 0,
+        'lru_size': len(_lru),
+        'pending_hits': pending,
+    }
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_on_change(sender, instance, **kwargs):
+    """Keep cached copies in step with edits (this process; other workers expire by TTL)"""
+    if not kwargs.get('created'):
+        invalidate(instance.id)
+
+
+atexit.register(flush_hits)
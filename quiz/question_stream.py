@@ -0,0 +1,105 @@
+# quiz/question_stream.py - Incremental MCQ parser for streamed question generation
+#
+# ollama_generate(..., parser=StreamingQuestionParser()) streams the completion and
+# feeds every chunk here. The parser follows the output format line by line
+# (प्रश्न, क-घ options, सही जवाफ) and reports `done` as soon as
+#   - a question, four options and the answer letter have arrived (the rest of the
+#     generation is closing remarks nobody reads), or
+#   - the output is clearly unusable: options before any question, a repeated option
+#     list, or a question/option longer than validate_question_quality() accepts.
+# The caller then closes the connection, which makes Ollama stop generating. The
+# collected text still goes through parse_question_response(), so the final
+# parsing rules are unchanged.
+import re
+
+OPTION_RE = re.compile(r"^([कखगघ])\s*[\).:\-]\s*(.+)")
+# The letter must not be the start of a longer word ("उत्तर कोरिया")
+ANSWER_RE = re.compile(r"(?:सही|correct)?\s*(?:जवाफ|उत्तर|answer)\s*[:\s]\s*([कखगघ])(?![ऀ-ॿ])", re.IGNORECASE)
+# On an unfinished line the character after the letter must already be there
+PARTIAL_ANSWER_RE = re.compile(r"(?:सही|correct)?\s*(?:जवाफ|उत्तर|answer)\s*[:\s]\s*([कखगघ])(?=[^ऀ-ॿ])", re.IGNORECASE)
+
+MAX_QUESTION_CHARS = 600    # preamble + question text before the first option
+MAX_QUESTION_LINES = 10     # multi-statement questions span a few lines
+MAX_OPTION_CHARS = 150      # validate_question_quality() rejects longer options
+MAX_LINES_AFTER_OPTIONS = 2 # lines to wait for the answer once all options are in
+
+
+class StreamingQuestionParser:
+    """Follows a streamed MCQ and says when generating more text is pointless"""
+
+    def __init__(self):
+        self.text = ''
+        self.question = None
+        self.options = {}
+        self.answer = None
+        self.malformed = None  # reason, once the output is known to be unusable
+        self._partial = ''
+        self._question_lines = []
+        self._lines_after_options = 0
+
+    @property
+    def complete(self):
+        return bool(self.question) and len(self.options) == 4 and self.answer in self.options
+
+    @property
+    def done(self):
+        return (
+            self.complete
+            or self.malformed is not None
+            or self._lines_after_options >= MAX_LINES_AFTER_OPTIONS
+        )
+
+    def feed(self, chunk):
+        """Consume the next piece of generated text; returns True once generation can stop"""
+        self.text += chunk
+        *lines, self._partial = (self._partial + chunk).split('\n')
+        for line in lines:
+            self._line(line.replace('*', '').strip())
+            if self.done:
+                return True
+
+        if len(self.options) == 4 and self.answer is None:
+            match = PARTIAL_ANSWER_RE.search(self._partial.replace('*', ''))
+            if match:
+                self.answer = match.group(1)
+        elif len(self._partial) > MAX_QUESTION_CHARS:
+            self.malformed = "line too long"
+        return self.done
+
+    def _line(self, line):
+        if not line:
+            return
+
+        if len(self.options) == 4:
+            match = ANSWER_RE.search(line)
+            if match:
+                self.answer = match.group(1)
+            else:
+                self._lines_after_options += 1
+            return
+
+        match = OPTION_RE.match(line)
+        if match:
+            letter, text = match.groups()
+            if self.question is None:
+                if not self._question_lines:
+                    self.malformed = "options before a question"
+                    return
+                self.question = self._question_lines[-1]
+            if letter in self.options:
+                self.malformed = f"option {letter} repeated"
+            elif len(text) > MAX_OPTION_CHARS:
+                self.malformed = f"option {letter} too long"
+            else:
+                self.options[letter] = text.strip()
+            return
+
+        if self.options:
+            # Wrapped option text; the final parser ignores it too
+            return
+
+        if line.startswith('प्रश्न') and ':' in line and line.split(':', 1)[1].strip():
+            self.question = line.split(':', 1)[1].strip()
+        self._question_lines.append(line)
+        if len(self._question_lines) > MAX_QUESTION_LINES or sum(map(len, self._question_lines)) > MAX_QUESTION_CHARS:
+            self.malformed = "no options after the question"
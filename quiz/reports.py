@@ -0,0 +1,176 @@
+# quiz/reports.py - Background PDF report generation with on-disk caching
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import jobs
+from .models import BackgroundJob, UserAnswer, BookmarkedQuestion
+from .utils import get_user_statistics
+
+
+def report_dir(user_id):
+    """Directory holding the cached reports of one user"""
+    return Path(settings.MEDIA_ROOT) / 'reports' / str(user_id)
+
+
+def report_version(user):
+    """Short hash of everything the report shows; changes whenever the data does"""
+    profile = user.profile
+    answers = UserAnswer.objects.filter(user=user).aggregate(total=Count('id'), last=Max('id'))
+    bookmarks = BookmarkedQuestion.objects.filter(user=user).count()
+    
+    raw = '|'.join(str(v) for v in (
+        profile.total_questions_attempted, profile.correct_answers, profile.streak_days,
+        answers['total'], answers['last'], bookmarks
+    ))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def report_path(user_id, version):
+    """Location of the report file for a given data version"""
+    return report_dir(user_id) / f'{version}.pdf'
+
+
+def retry_wait(key):
+    """Seconds before a failed build under `key` may be queued again; 0 unless the newest build failed"""
+    base = getattr(settings, 'REPORT_RETRY_AFTER', 300)
+    failures, failed_at = 0, None
+    for status, finished_at in BackgroundJob.objects.filter(key=key).order_by('-id').values_list('status', 'finished_at')[:8]:
+        if status != 'failed':
+            break
+        failures += 1
+        failed_at = failed_at or finished_at
+    if not failures or failed_at is None:
+        return 0
+    # Each failed build of the same data doubles the wait
+    wait = min(base * 2 ** (failures - 1), getattr(settings, 'REPORT_RETRY_MAX', 60 * 60))
+    return max(0, wait - (timezone.now() - failed_at).total_seconds())
+
+
+def request_report(user, retry=False):
+    """Return (path, version, state): state is 'ready', 'building' (a build is queued) or 'failed'.
+
+    `retry` queues a new build even while a failed one is still backing off.
+    """
+    version = report_version(user)
+    path = report_path(user.id, version)
+    
+    if path.exists():
+        return path, version, 'ready'
+    
+    # A build that used up its attempts keeps the report failed for REPORT_RETRY_AFTER
+    # seconds (doubling with each failed build), so polling clients get an error
+    # instead of queueing rebuilds; after that the next request builds it again
+    key = f'report:{user.id}:{version}'
+    if not retry and retry_wait(key):
+        return path, version, 'failed'
+    
+    # The job key makes repeated polls while the build is running a no-op
+    jobs.enqueue(
+        'quiz.build_pdf_report',
+        {'user_id': user.id, 'version': version},
+        key=key
+    )
+    
+    return path, version, 'building'
+
+
+def build_report(user_id, version):
+    """Render the PDF report for a user and store it under its data version"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.units import inch
+    
+    user = User.objects.select_related('profile').get(id=user_id)
+    target = report_path(user_id, version)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_suffix('.pdf.tmp')
+    
+    doc = SimpleDocTemplate(str(tmp_path), pagesize=A4)
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#6b46c1'),
+        spaceAfter=30,
+        alignment=1  # Center
+    )
+    elements.append(Paragraph(f'Quiz Report - {user.username}', title_style))
+    elements.append(Spacer(1, 0.3*inch))
+    
+    # Get statistics
+    stats = get_user_statistics(user)
+    profile = stats['profile']
+    
+    # Summary table
+    summary_data = [
+        ['Metric', 'Value'],
+        ['Total Questions Attempted', str(profile.total_questions_attempted)],
+        ['Correct Answers', str(profile.correct_answers)],
+        ['Accuracy', f'{profile.accuracy}%'],
+        ['Current Streak', f'{profile.streak_days} days'],
+        ['Total Bookmarks', str(stats['total_bookmarks'])],
+    ]
+    
+    summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6b46c1')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    
+    elements.append(summary_table)
+    elements.append(Spacer(1, 0.5*inch))
+    
+    # Domain-wise performance
+    elements.append(Paragraph('Domain-wise Performance', styles['Heading2']))
+    elements.append(Spacer(1, 0.2*inch))
+    
+    domain_data = [['Domain', 'Total', 'Correct', 'Accuracy']]
+    for domain_stat in stats['domain_stats']:
+        domain = domain_stat['question__domain']
+        total = domain_stat['total']
+        correct = domain_stat['correct']
+        accuracy = round((correct / total * 100), 2) if total > 0 else 0
+        domain_data.append([domain, str(total), str(correct), f'{accuracy}%'])
+    
+    if len(domain_data) > 1:
+        domain_table = Table(domain_data, colWidths=[2*inch, 1.5*inch, 1.5*inch, 1.5*inch])
+        domain_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#a78bfa')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        elements.append(domain_table)
+    
+    # Build into a temp file, then swap it in atomically so readers never see a partial PDF
+    doc.build(elements)
+    os.replace(tmp_path, target)
+    
+    # Older versions are stale as soon as a newer one exists
+    for stale in target.parent.glob('*.pdf'):
+        if stale != target:
+            stale.unlink(missing_ok=True)
+    
+    return target
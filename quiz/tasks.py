@@ -0,0 +1,60 @@
+# quiz/tasks.py - Background jobs for the quiz app (run by quiz.jobs workers)
+import logging
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .jobs import task
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+
+@task('quiz.check_achievements')
+def check_achievements(user_id):
+    """Unlock any achievements the user has earned"""
+    from .utils import check_achievements as run_check
+    user = User.objects.select_related('profile').get(id=user_id)
+    run_check(user)
+
+
+@task('quiz.record_answer_stats')
+def record_answer_stats(user_id, answers):
+    """Fold a batch of answers ([question_id, is_correct, time_taken]) into metrics and achievements"""
+    from .utils import check_achievements as run_check, update_performance_metrics
+    user = User.objects.select_related('profile').get(id=user_id)
+    questions = Question.objects.only('id', 'domain', 'difficulty').in_bulk([qid for qid, _, _ in answers])
+    graded = [
+        (questions[qid], None, is_correct, time_taken)
+        for qid, is_correct, time_taken in answers
+        if qid in questions
+    ]
+    
+    with transaction.atomic():
+        update_performance_metrics(user, graded)
+    run_check(user)
+
+
+@task('quiz.generate_explanation', queue='llm', retry_delay=10)
+def generate_explanation(question_id):
+    """Generate and store the explanation of a question that has none yet"""
+    from .ai_engine import generate_question_explanation
+    question = Question.objects.get(id=question_id)
+    if question.explanation:
+        return
+    
+    question.explanation = generate_question_explanation({
+        'question': question.question_text,
+        'options': question.options,
+        'correct_letter': question.correct_answer,
+    })
+    # save() fires post_save, which drops the question from the read-through cache
+    question.save(update_fields=['explanation'])
+
+
+@task('quiz.build_pdf_report', queue='reports', max_attempts=2)
+def build_pdf_report(user_id, version):
+    """Render a user's PDF report into MEDIA_ROOT/reports"""
+    from .reports import build_report, report_path
+    if not report_path(user_id, version).exists():
+        build_report(user_id, version)
@@ -1,3 +1,1936 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import marshal
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models.query import QuerySet
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ai import counters, metrics, prometheus, tracing
+from ai.events import EventBuffer
+from ai.llm import admission, budget, instrumentation, ratelimit, routing, warmup
+from ai.llm.client import OllamaTimeout, OllamaUnavailable
+from ai.llm.pool import Backend, BackendPool
+from ai.llm.scheduler import LLMScheduler, scheduler
+from assistant.services import ai_engine as writer_engine
+
+from . import ai_engine, jobs, prompt_budget, question_cache, utils
+from .constants import QUESTION_SYSTEM_PROMPT
+from .question_stream import MAX_OPTION_CHARS, MAX_QUESTION_CHARS, StreamingQuestionParser
+from .models import (
+    BackgroundJob, DailyChallenge, DailyChallengeCompletion, PerformanceMetrics, Question, QuestionCache, QuizAttempt,
+    RequestProfile, TimedQuizSession, UserAnswer
+)
+from .reports import report_version
+
+
+class ExportCsvTest(TestCase):
+    """The CSV export streams, so its memory use does not grow with the history"""
+
+    # Scaled down from the 1M-row target so the suite stays quick; set
+    # EXPORT_TEST_ROWS=1000000 to run the full-size export
+    ROWS = int(os.environ.get('EXPORT_TEST_ROWS', 20000))
+    PEAK_BUDGET = 8 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('exporter')
+        question = Question.objects.create(
+            domain='grammar', topic='Tenses', difficulty='medium',
+            question_text='Choose the correct form of the verb in the sentence below. ' * 3,
+            options=['A) go', 'B) goes', 'C) went', 'D) gone'], correct_answer='B'
+        )
+        for offset in range(0, cls.ROWS, 5000):
+            UserAnswer.objects.bulk_create([
+                UserAnswer(user=cls.user, question=question, selected_answer='B', is_correct=True)
+                for _ in range(min(5000, cls.ROWS - offset))
+            ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export_peak(self, url):
+        """Bytes received and peak traced allocation while consuming the streamed export"""
+        tracemalloc.start()
+        try:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            size = 0
+            for chunk in response.streaming_content:
+                size += len(chunk)
+            return size, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_export_streams_within_memory_budget(self):
+        size, peak = self.export_peak('/quiz/export/csv/')
+        self.assertGreater(size, self.ROWS * 100)
+        self.assertLess(peak, self.PEAK_BUDGET, f"peak {peak} bytes for {self.ROWS} rows")
+
+    def test_gzip_export_streams_within_memory_budget(self):
+        size, peak = self.export_peak('/quiz/export/csv/?gzip=1')
+        self.assertGreater(size, 0)
+        self.assertLess(peak, self.PEAK_BUDGET, f"peak {peak} bytes for {self.ROWS} rows")
+
+    def test_date_filter_excludes_rows(self):
+        response = self.client.get('/quiz/export/csv/?start=2000-01-01&end=2000-01-02')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1)  # header only
+
+    def test_invalid_date_is_rejected(self):
+        response = self.client.get('/quiz/export/csv/?start=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_error_while_streaming_is_logged_and_aborts_the_download(self):
+        def failing_rows(self, chunk_size=None):
+            yield (timezone.now(), 'question', 'grammar', 'Tenses', 'medium', 'B', 'B', True)
+            raise DatabaseError('disk I/O error')
+
+        with mock.patch.object(QuerySet, 'iterator', failing_rows):
+            response = self.client.get('/quiz/export/csv/')
+            self.assertEqual(response.status_code, 200)
+            chunks = iter(response.streaming_content)
+            self.assertTrue(next(chunks).startswith(b'Date,'))
+            self.assertIn(b'question', next(chunks))
+            with self.assertLogs('quiz.views_advanced', 'ERROR') as logs, self.assertRaises(DatabaseError):
+                next(chunks)
+
+        self.assertIn('CSV export for exporter failed mid-stream: disk I/O error', logs.output[0])
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0)
+class ExportPdfTest(TestCase):
+    """The PDF export polls while the report builds, stops once the build failed and retries after a backoff"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reporter')
+        self.client.force_login(self.user)
+
+    def test_missing_report_queues_one_build(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/quiz/export/pdf/')
+        self.assertEqual(response.status_code, 202)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get('/quiz/export/pdf/')
+        self.assertEqual(BackgroundJob.objects.filter(task='quiz.build_pdf_report').count(), 1)
+
+    def fail_build(self, seconds_ago=0):
+        key = f'report:{self.user.id}:{report_version(self.user)}'
+        BackgroundJob.objects.create(
+            task='quiz.build_pdf_report', queue='reports', key=key, status='failed',
+            finished_at=timezone.now() - timedelta(seconds=seconds_ago)
+        )
+        return key
+
+    def export(self, url='/quiz/export/pdf/'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get(url)
+
+    def test_failed_build_returns_error_instead_of_polling(self):
+        key = self.fail_build()
+        response = self.export()
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn('Retry-After', response)
+        self.assertContains(response, '?retry=1', status_code=500)
+        self.assertEqual(BackgroundJob.objects.filter(key=key).count(), 1)
+
+    @override_settings(REPORT_RETRY_AFTER=300)
+    def test_failed_build_is_queued_again_after_the_backoff(self):
+        key = self.fail_build(seconds_ago=301)
+        response = self.export()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(list(BackgroundJob.objects.filter(key=key).values_list('status', flat=True)), ['pending', 'failed'])
+
+    @override_settings(REPORT_RETRY_AFTER=300, REPORT_RETRY_MAX=900)
+    def test_backoff_doubles_with_each_failure(self):
+        self.fail_build(seconds_ago=2000)
+        key = self.fail_build(seconds_ago=400)
+        # Second failure in a row: 600 s
+        self.assertEqual(self.export().status_code, 500)
+
+        self.fail_build(seconds_ago=950)
+        # Third: 1200 s, capped at REPORT_RETRY_MAX
+        self.assertEqual(self.export().status_code, 202)
+        self.assertEqual(BackgroundJob.objects.filter(key=key, status='pending').count(), 1)
+
+    def test_manual_retry_queues_a_build_at_once(self):
+        key = self.fail_build()
+        response = self.export('/quiz/export/pdf/?retry=1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(BackgroundJob.objects.filter(key=key, status='pending').count(), 1)
+        # Polling the retry URL while the build is queued does not queue more
+        self.export('/quiz/export/pdf/?retry=1')
+        self.assertEqual(BackgroundJob.objects.filter(key=key).count(), 2)
+
+
+class StartTimedQuizTest(TestCase):
+    """questions_count is clamped to 1..MAX_TIMED_QUIZ_QUESTIONS and must be a number"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('timer')
+        Question.objects.bulk_create([
+            Question(
+                domain='grammar', topic='Articles', difficulty='easy', question_text=f'Question {i}',
+                options=['A) a', 'B) an', 'C) the', 'D) none'], correct_answer='A'
+            )
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def start(self, questions_count):
+        return self.client.post(
+            '/quiz/api/timed-quiz/start/', json.dumps({'questions_count': questions_count}),
+            content_type='application/json'
+        )
+
+    def test_negative_count_is_raised_to_one(self):
+        response = self.start(-5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['questions_count'], 1)
+
+    def test_non_integer_count_is_rejected(self):
+        for value in ('many', None, [3]):
+            self.assertEqual(self.start(value).status_code, 400)
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0)
+class SubmitTimedQuizTest(TestCase):
+    """Timed-quiz answers are graded on the server against the session's questions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('timer')
+        cls.questions = Question.objects.bulk_create([
+            Question(
+                domain='grammar', topic='Articles', difficulty='सजिलो', question_text=f'Question {i}',
+                options={'क': 'a', 'ख': 'an', 'ग': 'the', 'घ': 'none'}, correct_answer='ख'
+            )
+            for i in range(4)
+        ])
+        cls.outside = cls.questions.pop()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.session = TimedQuizSession.objects.create(
+            user=self.user, questions_count=3, question_ids=[q.id for q in self.questions]
+        )
+
+    def submit(self, answers, session=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/quiz/api/timed-quiz/submit/', json.dumps({
+                'session_id': (session or self.session).id, 'answers': answers,
+            }), content_type='application/json')
+
+    def test_grades_only_valid_answers_to_session_questions(self):
+        first, second, third = self.questions
+        response = self.submit([
+            {'question_id': first.id, 'answer': 'ख', 'time_taken': 12},
+            {'question_id': first.id, 'answer': 'क'},             # duplicate: the first answer counts
+            {'question_id': second.id, 'answer': 'ग', 'time_taken': 30},
+            {'question_id': third.id, 'answer': 'B'},             # not one of क-घ
+            {'question_id': self.outside.id, 'answer': 'ख'},      # not reserved for this session
+            {'question_id': 'abc', 'answer': 'ख'},
+            'junk',
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['score'], data['answered'], data['total']), (1, 2, 3))
+        self.assertEqual(data['results'], {
+            str(first.id): {'correct': True, 'correct_answer': 'ख'},
+            str(second.id): {'correct': False, 'correct_answer': 'ख'},
+        })
+        answers = UserAnswer.objects.filter(user=self.user).order_by('question_id')
+        self.assertEqual([(a.question_id, a.selected_answer, a.is_correct) for a in answers],
+                         [(first.id, 'ख', True), (second.id, 'ग', False)])
+        attempt = QuizAttempt.objects.get(user=self.user)
+        self.assertEqual(attempt.correct_answers, 1)
+        self.assertEqual(set(answers.values_list('quiz_attempt', flat=True)), {attempt.id})
+
+        self.user.profile.refresh_from_db()
+        self.assertEqual((self.user.profile.total_questions_attempted, self.user.profile.correct_answers), (2, 1))
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.status, self.session.score), ('completed', 1))
+
+    def test_metrics_are_updated_by_a_background_job(self):
+        self.submit([{'question_id': self.questions[0].id, 'answer': 'ख', 'time_taken': 20}])
+        self.assertFalse(PerformanceMetrics.objects.filter(user=self.user).exists())
+
+        job = BackgroundJob.objects.get(task='quiz.record_answer_stats')
+        self.assertEqual(job.payload, {'user_id': self.user.id, 'answers': [[self.questions[0].id, True, 20]]})
+        self.assertTrue(jobs.run_job(job))
+        metric = PerformanceMetrics.objects.get(user=self.user)
+        self.assertEqual((metric.questions_attempted, metric.questions_correct), (1, 1))
+
+    def test_resubmitting_is_rejected(self):
+        answer = [{'question_id': self.questions[0].id, 'answer': 'ख'}]
+        self.assertEqual(self.submit(answer).status_code, 200)
+
+        response = self.submit(answer)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UserAnswer.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(QuizAttempt.objects.filter(user=self.user).count(), 1)
+
+    def test_other_users_session_is_not_found(self):
+        other = TimedQuizSession.objects.create(
+            user=User.objects.create_user('someone'), questions_count=3, question_ids=[q.id for q in self.questions]
+        )
+        response = self.submit([{'question_id': self.questions[0].id, 'answer': 'ख'}], session=other)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(UserAnswer.objects.exists())
+
+    def test_answers_must_be_a_list(self):
+        self.assertEqual(self.submit({'question_id': self.questions[0].id}).status_code, 400)
+
+
+def make_daily_questions():
+    Question.objects.bulk_create([
+        Question(
+            domain='grammar', topic='Tenses', difficulty=difficulty, question_text=f'{difficulty} {i}',
+            options={'क': 'a', 'ख': 'b', 'ग': 'c', 'घ': 'd'}, correct_answer='क'
+        )
+        for difficulty in ('सजिलो', 'मध्यम', 'कठिन')
+        for i in range(4)
+    ])
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0, DAILY_CHALLENGE_LOCK_WAIT=10)
+class DailyChallengeConcurrencyTest(TransactionTestCase):
+    """The first requests of the day build the challenge once and all get the same one"""
+
+    REQUESTS = 50
+
+    def test_simultaneous_first_requests_build_once(self):
+        cache.clear()
+        make_daily_questions()
+        users = [User.objects.create_user(f'early{i}') for i in range(self.REQUESTS)]
+        clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        start = threading.Barrier(self.REQUESTS)
+        results = [None] * self.REQUESTS
+
+        def first_request(i):
+            try:
+                start.wait()
+                response = clients[i].get('/quiz/api/daily-challenge/')
+                results[i] = (response.status_code, response.json())
+            finally:
+                connection.close()
+
+        build = mock.patch.object(utils, 'get_or_create_daily_challenge', wraps=utils.get_or_create_daily_challenge)
+        with build as built:
+            threads = [threading.Thread(target=first_request, args=(i,)) for i in range(self.REQUESTS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(built.call_count, 1)
+        self.assertEqual(DailyChallenge.objects.count(), 1)
+        challenge = DailyChallenge.objects.get()
+        self.assertEqual(challenge.questions.count(), 10)
+        for status, data in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(data['challenge_id'], challenge.id)
+            self.assertFalse(data['stale'])
+            self.assertEqual(len(data['questions']), 10)
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0, DAILY_CHALLENGE_LOCK_WAIT=0)
+class DailyChallengeFallbackTest(TestCase):
+    """Yesterday's payload is only served for practice while today's is being built"""
+
+    def setUp(self):
+        cache.clear()
+        make_daily_questions()
+        self.user = User.objects.create_user('player')
+        self.client.force_login(self.user)
+        self.today = timezone.now().date()
+        self.yesterday = utils.prepare_daily_challenge(self.today - timedelta(days=1))
+        # Another worker holds today's build claim
+        DailyChallenge.objects.create(date=self.today, build_started_at=timezone.now())
+
+    def complete(self, **extra):
+        return self.client.post(
+            '/quiz/api/daily-challenge/complete/', json.dumps({'score': 8, 'total': 10, **extra}),
+            content_type='application/json'
+        )
+
+    def test_stale_payload_is_marked_and_not_completed(self):
+        DailyChallengeCompletion.objects.create(
+            user=self.user, challenge_id=self.yesterday['challenge_id'], score=5, total_questions=10
+        )
+        data = self.client.get('/quiz/api/daily-challenge/').json()
+        self.assertTrue(data['stale'])
+        self.assertEqual(data['challenge_id'], self.yesterday['challenge_id'])
+        self.assertFalse(data['completed'])
+
+    def test_completion_is_not_recorded_against_yesterday(self):
+        response = self.complete(challenge_id=self.yesterday['challenge_id'])
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(DailyChallengeCompletion.objects.exists())
+
+    def test_completion_of_an_old_challenge_is_rejected(self):
+        DailyChallenge.objects.filter(date=self.today).update(build_started_at=None)
+        response = self.complete(challenge_id=self.yesterday['challenge_id'])
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(DailyChallengeCompletion.objects.exists())
+
+    def test_nothing_to_fall_back_on(self):
+        DailyChallenge.objects.filter(date=self.yesterday['date']).delete()
+        cache.clear()
+        response = self.client.get('/quiz/api/daily-challenge/')
+        self.assertEqual(response.status_code, 503)
+
+
+def run_and_exit(code, **overrides):
+    """Run `code` in a fresh interpreter on the test database and let it exit normally"""
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'exit_settings.py'), 'w') as f:
+            f.write('from ai.settings import *\n')
+            f.write(f"DATABASES['default']['NAME'] = {str(connection.settings_dict['NAME'])!r}\n")
+            for name, value in overrides.items():
+                f.write(f'{name} = {value!r}\n')
+        env = {
+            **os.environ, 'DJANGO_SETTINGS_MODULE': 'exit_settings',
+            'PYTHONPATH': os.pathsep.join([directory, str(settings.BASE_DIR)]),
+        }
+        script = 'import django\ndjango.setup()\n' + textwrap.dedent(code)
+        subprocess.run([sys.executable, '-c', script], env=env, check=True, timeout=60, cwd=settings.BASE_DIR)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+class EventBufferTest(TransactionTestCase):
+    """Buffered rows reach the database by size, by interval and at exit, and a bad row cannot block them"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('buffered')
+        self.question = Question.objects.create(
+            domain='grammar', topic='Tenses', difficulty='easy', question_text='Q',
+            options=['A) a', 'B) b'], correct_answer='A'
+        )
+
+    def answer(self, **kwargs):
+        return UserAnswer(user=self.user, question=self.question, selected_answer='A', is_correct=True, **kwargs)
+
+    def test_flush_on_size(self):
+        buffer = EventBuffer(flush_interval=3600, max_size=3)
+        buffer.record(self.answer())
+        buffer.record(self.answer())
+        time.sleep(0.1)
+        self.assertEqual(UserAnswer.objects.count(), 0)
+
+        buffer.record(self.answer())
+        self.assertTrue(wait_for(lambda: UserAnswer.objects.count() == 3))
+        self.assertEqual(len(buffer), 0)
+
+    def test_flush_on_interval(self):
+        buffer = EventBuffer(flush_interval=0.2, max_size=1000)
+        started = time.monotonic()
+        buffer.record(self.answer())
+
+        self.assertTrue(wait_for(lambda: UserAnswer.objects.count() == 1))
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_flush_at_exit(self):
+        run_and_exit(f"""
+            from ai import events
+            from quiz.models import UserAnswer
+            events.record(UserAnswer(user_id={self.user.id}, question_id={self.question.id}, selected_answer='ख', is_correct=False))
+        """, EVENT_BUFFER_FLUSH_INTERVAL=3600)
+
+        self.assertTrue(UserAnswer.objects.filter(user=self.user, selected_answer='ख').exists())
+
+    def test_record_is_cheaper_than_insert(self):
+        """The point of the buffer: a request pays for an append, not an INSERT and commit"""
+        rows = 200
+        buffer = EventBuffer(flush_interval=3600, max_size=rows + 1)
+
+        started = time.perf_counter()
+        for _ in range(rows):
+            self.answer().save()
+        inserted = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(rows):
+            buffer.record(self.answer())
+        buffered = time.perf_counter() - started
+
+        self.assertLess(buffered * 10, inserted)
+        self.assertEqual(buffer.flush(), rows)
+        self.assertEqual(UserAnswer.objects.count(), rows * 2)
+
+    def test_poison_row_is_dropped_and_the_rest_written(self):
+        user, question = self.user, self.question
+        buffer = EventBuffer()
+        for question_id in (question.id, question.id + 1000, question.id):
+            buffer.record(UserAnswer(user=user, question_id=question_id, selected_answer='A', is_correct=True))
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(UserAnswer.objects.filter(question=question).count(), 2)
+
+        buffer.record(UserAnswer(user=user, question=question, selected_answer='B', is_correct=False))
+        self.assertEqual(buffer.flush(), 1)
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0)
+class JobQueueTest(TestCase):
+    """One unfinished job per key, and stale jobs are not retried forever"""
+
+    def test_racing_enqueues_create_one_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('quiz.check_achievements', {'user_id': 1}, key='achievements:1')
+        # The second request passed the exists() check before the first row was visible
+        with mock.patch('django.db.models.query.QuerySet.exists', return_value=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                jobs.enqueue('quiz.check_achievements', {'user_id': 1}, key='achievements:1')
+        self.assertEqual(BackgroundJob.objects.filter(key='achievements:1').count(), 1)
+
+    def test_stale_job_out_of_attempts_is_failed(self):
+        started = timezone.now() - timedelta(hours=1)
+        last = BackgroundJob.objects.create(task='quiz.check_achievements', status='running', attempts=3, max_attempts=3, started_at=started)
+        retry = BackgroundJob.objects.create(task='quiz.check_achievements', status='running', attempts=1, max_attempts=3, started_at=started)
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 1)
+        last.refresh_from_db()
+        retry.refresh_from_db()
+        self.assertEqual(last.status, 'failed')
+        self.assertIsNotNone(last.finished_at)
+        self.assertEqual(retry.status, 'pending')
+
+
+class BackgroundPriorityTest(TestCase):
+    """Jobs and warm-ups take 'background' scheduler slots, not 'interactive' ones"""
+
+    def test_job_llm_calls_run_as_background(self):
+        @jobs.task('tests.llm_probe')
+        def llm_probe():
+            with scheduler.slot():
+                pass
+
+        before = scheduler.stats()['classes']
+        job = BackgroundJob.objects.create(task='tests.llm_probe', status='running', attempts=1)
+        self.assertTrue(jobs.run_job(job))
+        after = scheduler.stats()['classes']
+        self.assertEqual(after['background']['completed'], before['background']['completed'] + 1)
+        self.assertEqual(after['interactive']['completed'], before['interactive']['completed'])
+
+    def test_warm_up_holds_a_background_slot(self):
+        running = []
+
+        def post(url, json, timeout):
+            running.append(scheduler.stats()['classes']['background']['running'])
+            return mock.Mock(status_code=200, raise_for_status=mock.Mock(), json=mock.Mock(return_value={}))
+
+        backend = mock.Mock(base_url='http://ollama.test', url=lambda path: f'http://ollama.test{path}')
+        with mock.patch.object(warmup.requests, 'post', side_effect=post):
+            outcome = warmup.manager.warm(backend, 'test-model')
+        self.assertTrue(outcome['ok'])
+        self.assertEqual(running, [1])
+
+
+class RateLimitTest(TestCase):
+    """Buckets live in the shared database cache and cannot be dodged by the client"""
+
+    def test_bucket_is_not_culled_by_other_clients(self):
+        bucket = ratelimit.TokenBucket('user:1', capacity=3, refill=0.001)
+        self.assertTrue(bucket.consume(3)[0])
+        self.assertFalse(bucket.consume(1)[0])
+
+        # More clients than the old file cache's 300 entries before culling
+        for i in range(400):
+            ratelimit.TokenBucket(f'ip:10.0.{i // 256}.{i % 256}', capacity=3, refill=0.001).consume(1)
+
+        self.assertFalse(bucket.consume(1)[0])
+        self.assertIsNotNone(ratelimit._cache().get(bucket.key))
+
+    def anonymous_request(self, forwarded_for, remote_addr='203.0.113.7'):
+        request = RequestFactory().post('/quiz/api/new-question/', HTTP_X_FORWARDED_FOR=forwarded_for, REMOTE_ADDR=remote_addr)
+        request.user = AnonymousUser()
+        return request
+
+    @override_settings(LLM_RATE_LIMIT_BUCKETS={'anon': {'capacity': 2, 'refill': 0.001}})
+    def test_spoofed_forwarded_for_shares_one_bucket(self):
+        outcomes = [ratelimit.charge(self.anonymous_request(f'10.9.0.{i}'), 'test')[0] for i in range(4)]
+
+        self.assertEqual([response is None for response in outcomes], [True, True, False, False])
+        self.assertEqual(outcomes[-1].status_code, 429)
+
+    @override_settings(LLM_RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_trusted_proxy_entry_is_used(self):
+        # Only the address appended by the trusted proxy counts, not what the client sent
+        request = self.anonymous_request('6.6.6.6, 198.51.100.20', remote_addr='10.0.0.1')
+        self.assertEqual(ratelimit.client_identity(request), ('anon', 'ip:198.51.100.20'))
+        request = self.anonymous_request('', remote_addr='10.0.0.1')
+        self.assertEqual(ratelimit.client_identity(request), ('anon', 'ip:10.0.0.1'))
+
+
+@mock.patch.object(BackendPool, '_ensure_checker')
+class BackendPoolTest(SimpleTestCase):
+    """Only connection errors, transport timeouts and 5xx count against a backend"""
+
+    def setUp(self):
+        self.pool = BackendPool(['http://ollama:11434'], eject_after=2)
+        self.backend = self.pool.backends[0]
+
+    def http_error(self, status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.exceptions.HTTPError(response=response)
+
+    def lease_raising(self, exc):
+        with self.assertRaises(type(exc)):
+            with self.pool.lease():
+                raise exc
+
+    def test_backend_errors_count(self, _):
+        for exc in (
+            requests.exceptions.ConnectionError(),
+            requests.exceptions.ReadTimeout(),
+            self.http_error(503),
+            OllamaTimeout('timed out'),
+            OllamaUnavailable('refused'),
+            OllamaUnavailable('server error', status=500),
+        ):
+            with self.subTest(exc=exc):
+                self.setUp()
+                self.lease_raising(exc)
+                self.assertEqual(self.backend.failures, 1)
+                self.assertEqual(self.backend.outstanding, 0)
+
+    def test_other_errors_do_not_count(self, _):
+        for exc in (
+            asyncio.CancelledError(),
+            GeneratorExit(),
+            self.http_error(404),
+            OllamaUnavailable('model not found', status=404),
+            ValueError('bad JSON'),
+        ):
+            with self.subTest(exc=exc):
+                self.setUp()
+                self.backend.consecutive_failures = 1
+                self.lease_raising(exc)
+                self.assertEqual(self.backend.failures, 0)
+                self.assertEqual(self.backend.consecutive_failures, 1)
+                self.assertIsNone(self.backend.ewma_ms)
+                self.assertEqual(self.backend.outstanding, 0)
+
+    def test_timeout_from_spent_budget_does_not_count(self, _):
+        with budget.request_budget(0):
+            self.lease_raising(requests.exceptions.Timeout('request time budget spent while streaming'))
+        self.assertEqual(self.backend.failures, 0)
+
+    def test_ejected_after_consecutive_failures(self, _):
+        for _ in range(2):
+            self.lease_raising(requests.exceptions.ConnectionError())
+        self.assertFalse(self.backend.healthy)
+
+
+class StubOllama:
+    """Local HTTP server answering /api/tags and /api/generate with a switchable status"""
+
+    def __init__(self):
+        stub = self
+        self.status = 200
+        self.delay = 0
+        self.paths = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self):
+                stub.paths.append(self.path)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                body = json.dumps({'models': []} if self.path == '/api/tags' else {'response': 'ok', 'done': True}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.respond()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class BackendHealthCheckTest(SimpleTestCase):
+    """Against real HTTP servers: failing backends are ejected and health checks bring them back"""
+
+    def setUp(self):
+        self.stubs = [StubOllama(), StubOllama()]
+        for stub in self.stubs:
+            self.addCleanup(stub.close)
+        self.pool = BackendPool([stub.url for stub in self.stubs], eject_after=2, health_interval=0.05, health_timeout=0.3)
+        self.first, self.second = self.pool.backends
+
+    def generate(self):
+        """One call through the pool; returns the backend that served it"""
+        with self.pool.lease() as backend:
+            response = requests.post(backend.url('/api/generate'), json={'model': 'llama3'}, timeout=2)
+            response.raise_for_status()
+            return backend.backend
+
+    def fail_first(self, times):
+        """Send `times` calls to the first backend, which answers them with its current status"""
+        for _ in range(times):
+            with self.assertRaises(requests.exceptions.HTTPError), mock.patch.object(self.pool, '_choose', return_value=self.first):
+                self.generate()
+
+    @mock.patch.object(BackendPool, '_ensure_checker')
+    def test_ejected_after_5xx_and_reinstated_by_health_check(self, _):
+        self.stubs[0].status = 500
+        self.fail_first(2)
+        self.assertFalse(self.first.healthy)
+        self.assertEqual(self.first.failures, 2)
+
+        # Traffic goes to the healthy backend only
+        self.assertEqual({self.generate() for _ in range(5)}, {self.second})
+
+        # Still failing its health check: stays out
+        self.assertFalse(self.pool.check(self.first))
+        self.assertFalse(self.first.healthy)
+
+        self.stubs[0].status = 200
+        self.assertEqual(self.pool.check_all(), {self.stubs[0].url: True, self.stubs[1].url: True})
+        self.assertTrue(self.first.healthy)
+        self.assertEqual(self.first.consecutive_failures, 0)
+        self.assertIsNone(self.first.ejected_at)
+        self.assertIn('/api/tags', self.stubs[0].paths)
+        self.assertEqual(self.generate(), self.first)
+
+    @mock.patch.object(BackendPool, '_ensure_checker')
+    def test_unreachable_and_slow_backends_fail_the_health_check(self, _):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            closed_port = sock.getsockname()[1]
+        unreachable = Backend(f'http://127.0.0.1:{closed_port}')
+        self.stubs[1].delay = 1
+
+        self.assertFalse(self.pool.check(unreachable))
+        started = time.monotonic()
+        self.assertFalse(self.pool.check(self.second))
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertFalse(unreachable.healthy)
+        self.assertFalse(self.second.healthy)
+        self.assertIsNotNone(self.second.last_check)
+
+    def test_background_checker_reinstates(self):
+        self.stubs[0].status = 500
+        self.fail_first(2)
+        self.assertFalse(self.first.healthy)
+
+        self.stubs[0].status = 200
+        # The lease above started the checker thread, which probes every health_interval
+        self.addCleanup(setattr, self.pool, 'health_interval', 3600)
+        self.assertTrue(self.pool._checker.is_alive())
+        self.assertTrue(wait_for(lambda: self.first.healthy, timeout=3))
+        self.assertIsNotNone(self.first.last_check)
+
+
+@mock.patch.object(BackendPool, '_ensure_checker')
+class ModelNotFoundTest(TestCase):
+    """A 404 from Ollama moves on to the next model without failing the backend"""
+
+    def setUp(self):
+        self.route = routing.Route('quiz-test', model='missing-model', fallbacks=['fallback-model'])
+        self.pool = BackendPool(['http://ollama:11434'])
+
+    def answer(self, status, text='Answer'):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps({'response': text} if status == 200 else {'error': 'model not found'}).encode()
+        return response
+
+    def generate(self, post):
+        with mock.patch.object(routing, 'resolve', return_value=self.route), \
+                mock.patch.object(ai_engine, 'pool', self.pool), \
+                mock.patch('time.sleep'), \
+                mock.patch.object(ai_engine.requests, 'post', side_effect=post) as posted:
+            result = ai_engine.ollama_generate('Explain the past tense', task='explain')
+        return result, [c.kwargs['json']['model'] for c in posted.call_args_list]
+
+    def test_falls_back_to_next_model(self, _):
+        result, models = self.generate(lambda url, json, timeout: self.answer(404 if json['model'] == 'missing-model' else 200))
+
+        self.assertEqual(result, 'Answer')
+        self.assertEqual(models, ['missing-model', 'fallback-model'])
+        self.assertEqual(self.pool.backends[0].failures, 0)
+
+    def test_gives_up_when_no_model_is_left(self, _):
+        result, models = self.generate(lambda url, json, timeout: self.answer(404))
+
+        self.assertIsNone(result)
+        self.assertEqual(models, ['missing-model', 'fallback-model'])
+        self.assertEqual(self.pool.backends[0].failures, 0)
+
+    def test_server_error_fails_backend(self, _):
+        result, models = self.generate(lambda url, json, timeout: self.answer(500))
+
+        self.assertIsNone(result)
+        self.assertEqual(self.pool.backends[0].failures, len(models))
+
+
+@mock.patch.object(BackendPool, '_ensure_checker')
+class QueueTimeTest(TestCase):
+    """The time a call waited for its scheduler slot reaches the histogram and the call log"""
+
+    def test_queue_ms_recorded(self, _):
+        route = routing.Route('queue-test', model='queue-model')
+        queue = LLMScheduler(max_concurrency=1)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"response": "Answer"}'
+
+        queue.acquire()
+        threading.Timer(0.2, queue.release).start()
+        with mock.patch.object(routing, 'resolve', return_value=route), \
+                mock.patch.object(ai_engine, 'scheduler', queue), \
+                mock.patch.object(ai_engine, 'pool', BackendPool(['http://ollama:11434'])), \
+                mock.patch.object(ai_engine.requests, 'post', return_value=response), \
+                mock.patch.object(instrumentation.instrumentation, 'sample_rate', 1.0), \
+                mock.patch('ai.events.record') as logged:
+            self.assertEqual(ai_engine.ollama_generate('Explain the past tense', task='queue-test'), 'Answer')
+
+        log = logged.call_args.args[0]
+        self.assertGreaterEqual(log.queue_ms, 150)
+        self.assertLess(log.elapsed_ms, log.queue_ms)
+        histogram = metrics.registry.histograms('llm_queue_seconds')[(('model', 'queue-model'), ('task', 'queue-test'))]
+        self.assertEqual(histogram.count, 1)
+
+
+class AdmissionTest(TestCase):
+    """A saturated LLM queue sheds load: bank questions, 503s and a failing readiness probe"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.get('/quiz/quiz')
+        self.rejected = scheduler.stats()['classes']['interactive']['rejected']
+
+    def saturated(self):
+        return mock.patch.object(scheduler, 'queue_depth', return_value=admission.max_queue_depth())
+
+    def test_serves_bank_question_when_saturated(self):
+        question = Question.objects.create(
+            domain='grammar', topic='Articles', difficulty='easy', question_text='Pick the article: ___ apple',
+            options=['A) a', 'B) an', 'C) the', 'D) none'], correct_answer='B'
+        )
+        with self.saturated(), mock.patch('quiz.views.generate_single_question') as generate:
+            response = self.client.get('/quiz/api/new/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['degraded'])
+        self.assertEqual(response.json()['question_id'], question.id)
+        generate.assert_not_called()
+        self.assertEqual(scheduler.stats()['classes']['interactive']['rejected'], self.rejected + 1)
+
+    @override_settings(LLM_OVERLOAD_RETRY_AFTER=7)
+    def test_503_when_bank_is_empty(self):
+        with self.saturated():
+            response = self.client.get('/quiz/api/new/')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.json()['retry_after'], 7)
+
+    def test_ready(self):
+        with mock.patch.object(admission.pool, 'stats', return_value=[{'healthy': True}]):
+            response = self.client.get('/api/ready/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['ready'])
+
+            with self.saturated(), mock.patch.object(scheduler, 'stats', return_value={
+                'queued': 4, 'running': 2, 'max_concurrency': 2, 'classes': {'interactive': {'queued': 4}},
+            }):
+                response = self.client.get('/api/ready/')
+            self.assertEqual(response.status_code, 503)
+            self.assertFalse(response.json()['ready'])
+
+    def test_not_ready_without_healthy_backend(self):
+        with mock.patch.object(admission.pool, 'stats', return_value=[{'healthy': False}]):
+            response = self.client.get('/api/ready/')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['healthy_backends'], 0)
+
+    @override_settings(LLM_REQUEST_BUDGET=20, LLM_REQUEST_BUDGETS={'assistant_improve': 95})
+    def test_budget_per_endpoint(self):
+        self.assertEqual(admission.request_budget_seconds('assistant_improve'), 95)
+        self.assertEqual(admission.request_budget_seconds('quiz_new_question'), 20)
+        self.assertEqual(admission.request_budget_seconds(), 20)
+
+
+class StreamingQuestionParserTest(SimpleTestCase):
+    """The streaming parser stops generation once the MCQ is in, or once it cannot be"""
+
+    MCQ = (
+        "प्रश्न: नेपालको राजधानी कुन हो?\n"
+        "क) पोखरा\n"
+        "ख) काठमाडौं\n"
+        "ग) विराटनगर\n"
+        "घ) बुटवल\n"
+        "सही जवाफ: ख\n"
+        "व्याख्या: काठमाडौं नेपालको राजधानी हो।\n"
+    )
+
+    def feed_all(self, chunks):
+        """Feed chunks until the parser asks to stop; returns (parser, chunks consumed)"""
+        parser = StreamingQuestionParser()
+        for consumed, chunk in enumerate(chunks, 1):
+            if parser.feed(chunk):
+                return parser, consumed
+        return parser, len(chunks)
+
+    def test_complete_in_one_chunk(self):
+        parser, consumed = self.feed_all([self.MCQ])
+
+        self.assertEqual(consumed, 1)
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.question, 'नेपालको राजधानी कुन हो?')
+        self.assertEqual(parser.options, {'क': 'पोखरा', 'ख': 'काठमाडौं', 'ग': 'विराटनगर', 'घ': 'बुटवल'})
+        self.assertEqual(parser.answer, 'ख')
+        self.assertIsNone(parser.malformed)
+
+    def test_stops_right_after_the_answer_letter(self):
+        # One character per chunk: done needs the character after the letter, no earlier
+        answer_at = self.MCQ.index('सही जवाफ: ख') + len('सही जवाफ: ख')
+        parser, consumed = self.feed_all(list(self.MCQ))
+
+        self.assertTrue(parser.complete)
+        self.assertEqual(consumed, answer_at + 1)
+        self.assertEqual(parser.text, self.MCQ[:consumed])
+
+    def test_split_across_chunks(self):
+        chunks = ["प्रश्न: नेपालको राज", "धानी कुन हो?\nक) पोख", "रा\nख) काठमाडौं\nग", ") विराटनगर\nघ) बुटवल\nसही ज", "वाफ: ", "ख", "\n", "व्याख्या"]
+        parser, consumed = self.feed_all(chunks)
+
+        self.assertTrue(parser.complete)
+        self.assertEqual(consumed, 7)
+        self.assertEqual(parser.options['क'], 'पोखरा')
+        self.assertEqual(parser.answer, 'ख')
+
+    def test_letter_starting_a_word_is_not_an_answer(self):
+        parser = StreamingQuestionParser()
+        parser.feed("प्रश्न: कुन देश?\nक) नेपाल\nख) भारत\nग) चीन\nघ) कोरिया\nउत्तर को")
+        self.assertIsNone(parser.answer)
+        self.assertFalse(parser.done)
+
+        self.assertTrue(parser.feed("रिया होइन।\nसही जवाफ: क\n"))
+        self.assertEqual(parser.answer, 'क')
+
+    def test_question_without_label(self):
+        parser, _ = self.feed_all(["यो वाक्य पढ्नुहोस्।\nकुन शब्द सही छ?\nक) एक\nख) दुई\nग) तीन\nघ) चार\nAnswer: ग "])
+
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.question, 'कुन शब्द सही छ?')
+
+    def test_truncated_output_keeps_reading(self):
+        parser, _ = self.feed_all(["प्रश्न: नेपालको राजधानी कुन हो?\nक) पोखरा\nख) काठमाडौं\nग) विराट"])
+
+        self.assertFalse(parser.done)
+        self.assertFalse(parser.complete)
+        self.assertIsNone(parser.malformed)
+        self.assertEqual(len(parser.options), 2)
+
+    def test_gives_up_waiting_for_the_answer(self):
+        parser = StreamingQuestionParser()
+        self.assertFalse(parser.feed("प्रश्न: के?\nक) १\nख) २\nग) ३\nघ) ४\nयो प्रश्न सजिलो छ।\n"))
+        self.assertTrue(parser.feed("अरू कुरा\n"))
+        self.assertFalse(parser.complete)
+        self.assertIsNone(parser.malformed)
+
+    def test_malformed(self):
+        cases = {
+            "options before a question": "क) पोखरा\nख) काठमाडौं\n",
+            "option ख repeated": "प्रश्न: के?\nक) एक\nख) दुई\nख) तीन\n",
+            "option क too long": "प्रश्न: के?\nक) " + "अ" * (MAX_OPTION_CHARS + 1) + "\n",
+            "no options after the question": "".join(f"पङ्क्ति {i}\n" for i in range(11)),
+            "line too long": "प्रश्न: " + "अ" * MAX_QUESTION_CHARS,
+        }
+        for reason, output in cases.items():
+            with self.subTest(reason):
+                parser, _ = self.feed_all([output])
+                self.assertTrue(parser.done)
+                self.assertFalse(parser.complete)
+                self.assertEqual(parser.malformed, reason)
+
+
+@override_settings(QUESTION_CACHE_FLUSH_SIZE=1000, QUESTION_CACHE_FLUSH_INTERVAL=3600)
+class QuestionCacheTest(TestCase):
+    """Reads fill every tier on the way back; edits and deletes clear them"""
+
+    def setUp(self):
+        question_cache._lru.clear()
+        question_cache._pending_hits.clear()
+        question_cache._last_flush = time.monotonic()
+        self.questions = Question.objects.bulk_create([
+            Question(
+                domain='grammar', topic='Articles', difficulty='easy', question_text=f'Question {i}',
+                options=['A) a', 'B) an', 'C) the', 'D) none'], correct_answer='A'
+            )
+            for i in range(3)
+        ])
+        self.question = self.questions[0]
+
+    def stats_delta(self, before):
+        after = question_cache.get_stats()
+        return {k: after[k] - before[k] for k in ('lru_hits', 'db_hits', 'misses', 'not_found')}
+
+    def test_fill_through(self):
+        before = question_cache.get_stats()
+        self.assertEqual(question_cache.get_question(self.question.id)['question_text'], 'Question 0')
+        self.assertTrue(QuestionCache.objects.filter(question=self.question).exists())
+
+        # Served by the LRU: no queries
+        with self.assertNumQueries(0):
+            question_cache.get_question(self.question.id)
+
+        # Served by the QuestionCache table once the LRU has lost it
+        question_cache._lru.clear()
+        Question.objects.filter(id=self.question.id).update(question_text='changed without signals')
+        self.assertEqual(question_cache.get_question(self.question.id)['question_text'], 'Question 0')
+
+        self.assertEqual(self.stats_delta(before), {'lru_hits': 1, 'db_hits': 1, 'misses': 1, 'not_found': 0})
+
+    def test_batch_mixes_tiers(self):
+        first, second, third = self.questions
+        question_cache.get_question(first.id)
+        question_cache.get_question(second.id)
+        question_cache._lru.delete(second.id)
+
+        found = question_cache.get_questions([first.id, second.id, third.id, 999999])
+        self.assertEqual(sorted(found), sorted([first.id, second.id, third.id]))
+
+    def test_save_invalidates(self):
+        question_cache.get_question(self.question.id)
+        self.question.question_text = 'Edited'
+        self.question.save()
+
+        self.assertIsNone(question_cache._lru.get(self.question.id))
+        self.assertFalse(QuestionCache.objects.filter(question=self.question).exists())
+        self.assertEqual(question_cache.get_question(self.question.id)['question_text'], 'Edited')
+
+    def test_delete_invalidates(self):
+        question_cache.get_question(self.question.id)
+        question_id = self.question.id
+        self.question.delete()
+
+        self.assertIsNone(question_cache.get_question(question_id))
+
+    def test_flush_hits_groups_updates(self):
+        first, second, third = self.questions
+        for qid in (first.id, first.id, second.id, second.id, third.id):
+            question_cache.get_question(qid)
+
+        # One UPDATE per distinct increment (2 and 1), then prune's DELETE and overflow SELECT
+        with self.assertNumQueries(4):
+            self.assertEqual(question_cache.flush_hits(), 3)
+        hits = dict(QuestionCache.objects.values_list('question_id', 'hit_count'))
+        self.assertEqual(hits, {first.id: 2, second.id: 2, third.id: 1})
+        self.assertEqual(question_cache.get_stats()['pending_hits'], 0)
+
+    @override_settings(QUESTION_CACHE_FLUSH_SIZE=3)
+    def test_flush_on_size(self):
+        for _ in range(3):
+            question_cache.get_question(self.question.id)
+        self.assertEqual(QuestionCache.objects.get(question=self.question).hit_count, 3)
+
+    def test_failed_flush_keeps_unwritten_counts_only(self):
+        first, second = self.questions[:2]
+        for qid in (first.id, first.id, second.id):
+            question_cache.get_question(qid)
+
+        update = QuerySet.update
+        calls = []
+
+        def flaky_update(queryset, **kwargs):
+            calls.append(kwargs['hit_count'])
+            if len(calls) == 2:
+                raise RuntimeError('database is locked')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', flaky_update):
+            self.assertEqual(question_cache.flush_hits(), 0)
+        question_cache.flush_hits()
+
+        hits = dict(QuestionCache.objects.values_list('question_id', 'hit_count'))
+        self.assertEqual(hits, {first.id: 2, second.id: 1})
+
+    @override_settings(QUESTION_CACHE_MAX_ROWS=2, QUESTION_CACHE_DB_TTL=3600)
+    def test_prune(self):
+        question_cache.get_questions([q.id for q in self.questions])
+        first, second, third = self.questions
+        QuestionCache.objects.filter(question=first).update(last_accessed=timezone.now() - timedelta(hours=2))
+        QuestionCache.objects.filter(question=second).update(last_accessed=timezone.now() - timedelta(minutes=5))
+        question_cache.prune()
+        self.assertEqual(set(QuestionCache.objects.values_list('question_id', flat=True)), {second.id, third.id})
+
+        with override_settings(QUESTION_CACHE_MAX_ROWS=1):
+            question_cache.prune()
+        self.assertEqual(list(QuestionCache.objects.values_list('question_id', flat=True)), [third.id])
+
+
+class WriteBehindCountersTest(TestCase):
+    """Buffered increments are written once each: batched, and retried whole after a failure"""
+
+    def setUp(self):
+        self.questions = Question.objects.bulk_create([
+            Question(
+                domain='grammar', topic='Tenses', difficulty='easy', question_text=f'Q{i}',
+                options=['A) a', 'B) b'], correct_answer='A'
+            )
+            for i in range(3)
+        ])
+        self.ids = [q.id for q in self.questions]
+        self.counters = counters.WriteBehindCounters(flush_interval=3600, flush_threshold=10000)
+        patcher = mock.patch.object(counters, 'counters', self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def times_used(self):
+        return list(Question.objects.filter(id__in=self.ids).order_by('id').values_list('times_used', flat=True))
+
+    def test_incr_many_is_one_update_per_amount(self):
+        counters.incr_many(Question, self.ids, 'times_used')
+        counters.incr(Question, self.ids[1], 'times_used', 2)
+        counters.incr(Question, None, 'times_used')
+        self.assertEqual(len(self.counters.pending()), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counters.flush(), 3)
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)  # +1 for the first and last question, +3 for the second
+        self.assertEqual(self.times_used(), [1, 3, 1])
+        self.assertEqual(counters.flush(), 0)
+
+    def test_failed_flush_is_retried_without_double_counting(self):
+        counters.incr_many(Question, self.ids, 'times_used')
+        counters.incr(Question, self.ids[0], 'times_used', 4)
+        update = QuerySet.update
+        calls = []
+
+        def flaky_update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 2:
+                raise RuntimeError('database is locked')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', flaky_update):
+            self.assertEqual(counters.flush(), 0)
+        # The first group's UPDATE was rolled back with the rest of the batch
+        self.assertEqual(self.times_used(), [0, 0, 0])
+        counters.incr(Question, self.ids[2], 'times_used')
+
+        self.assertEqual(counters.flush(), 3)
+        self.assertEqual(self.times_used(), [5, 1, 2])
+
+
+class WriteBehindCountersThreadTest(TransactionTestCase):
+    """Increments made while a flush runs, or just before exit, are neither lost nor counted twice"""
+
+    def setUp(self):
+        self.question = Question.objects.create(
+            domain='grammar', topic='Tenses', difficulty='easy', question_text='Q',
+            options=['A) a', 'B) b'], correct_answer='A'
+        )
+
+    def test_flush_at_exit(self):
+        run_and_exit(f"""
+            from ai import counters
+            from quiz.models import Question
+            counters.incr_many(Question, [{self.question.id}], 'times_used', 2)
+        """, COUNTER_FLUSH_INTERVAL=3600)
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.times_used, 2)
+
+    def test_concurrent_increments(self):
+        question = self.question
+        service = counters.WriteBehindCounters(flush_interval=0.01, flush_threshold=5)
+        threads = [
+            threading.Thread(target=lambda: [service.incr(Question, question.id, 'times_used') for _ in range(250)])
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        service.flush()
+
+        question.refresh_from_db()
+        self.assertEqual(question.times_used, 2000)
+
+
+class MetricsEndpointTest(TestCase):
+    """/metrics is for staff sessions and, when METRICS_TOKEN is set, the scraper's bearer token"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(prometheus.exporter, 'directory', Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_and_non_staff_are_rejected(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user('member'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_staff_can_scrape(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], prometheus.CONTENT_TYPE)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Basic s3cret').status_code, 403)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_token_is_not_accepted_when_unset(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer None').status_code, 403)
+
+
+class ProcessFileExporterTest(SimpleTestCase):
+    """Scrapes sum the counters and histogram buckets written by every worker"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def worker(self, started_at):
+        registry = metrics.MetricsRegistry()
+        registry.histogram('llm_call_seconds', (1, 5))
+        exporter = prometheus.ProcessFileExporter(registry, self.directory)
+        exporter._started_at = started_at  # a different file per simulated worker
+        return registry, exporter
+
+    def test_merge(self):
+        first, first_exporter = self.worker(1)
+        second, second_exporter = self.worker(2)
+        first.inc('http_requests_total', {'view': 'home'}, 3)
+        second.inc('http_requests_total', {'view': 'home'}, 4)
+        second.inc('http_requests_total', {'view': 'quiz'})
+        for value in (0.5, 3):
+            first.observe('llm_call_seconds', value, {'task': 'grammar'})
+        for value in (0.2, 9):
+            second.observe('llm_call_seconds', value, {'task': 'grammar'})
+        second_exporter.write()
+
+        lines = first_exporter.render().splitlines()
+
+        self.assertEqual(len(list(self.directory.glob('*.json'))), 2)
+        self.assertIn('http_requests_total{view="home"} 7', lines)
+        self.assertIn('http_requests_total{view="quiz"} 1', lines)
+        self.assertEqual(lines.count('# TYPE http_requests_total counter'), 1)
+        self.assertIn('llm_call_seconds_bucket{task="grammar",le="1"} 2', lines)
+        self.assertIn('llm_call_seconds_bucket{task="grammar",le="5"} 3', lines)
+        self.assertIn('llm_call_seconds_bucket{task="grammar",le="+Inf"} 4', lines)
+        self.assertIn('llm_call_seconds_sum{task="grammar"} 12.7', lines)
+        self.assertIn('llm_call_seconds_count{task="grammar"} 4', lines)
+
+    def test_files_of_long_gone_workers_are_dropped(self):
+        gone, gone_exporter = self.worker(1)
+        gone.inc('http_requests_total', {'view': 'home'}, 5)
+        gone_exporter.write()
+        os.utime(gone_exporter.path, (time.time() - 7200, time.time() - 7200))
+        _, exporter = self.worker(2)
+        exporter.max_age = 3600
+
+        self.assertNotIn('http_requests_total', exporter.render())
+        self.assertFalse(gone_exporter.path.exists())
+
+
+@override_settings(PROFILING_ENABLED=True)
+class RequestProfilerTest(TestCase):
+    """?_profile=1 profiles one request for staff, and the result shows up in the admin"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('profiler')
+        cls.learner = User.objects.create_user('learner')
+
+    def profile(self, user, url='/quiz/profile/?_profile=1', **extra):
+        self.client.force_login(user)
+        return self.client.get(url, **extra)
+
+    def test_staff_request_is_profiled(self):
+        response = self.profile(self.staff)
+
+        self.assertEqual(response.status_code, 200)
+        row = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile-Id'], str(row.pk))
+        self.assertEqual((row.method, row.path, row.view_name), ('GET', '/quiz/profile/?_profile=1', 'quiz:profile'))
+        self.assertEqual((row.user, row.status_code), (self.staff, 200))
+        self.assertGreater(row.query_count, 0)
+        self.assertEqual(row.query_count, len(row.queries))
+        self.assertIn('user_profile', row.summary)
+        self.assertTrue(marshal.loads(bytes(row.stats)))
+
+    def test_header_also_triggers(self):
+        response = self.profile(self.staff, url='/quiz/profile/', HTTP_X_PROFILE='1')
+
+        self.assertIn('X-Profile-Id', response)
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    def test_unflagged_request_is_not_profiled(self):
+        response = self.profile(self.staff, url='/quiz/profile/')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_flag_from_non_staff_is_ignored(self):
+        response = self.profile(self.learner)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        self.profile(self.staff)
+
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILE_KEEP=2)
+    def test_oldest_profiles_are_pruned(self):
+        ids = [int(self.profile(self.staff)['X-Profile-Id']) for _ in range(3)]
+
+        self.assertEqual(sorted(RequestProfile.objects.values_list('pk', flat=True)), ids[1:])
+
+    def test_listed_in_admin_with_downloads(self):
+        pk = self.profile(self.staff)['X-Profile-Id']
+
+        changelist = self.client.get('/admin/quiz/requestprofile/')
+        self.assertContains(changelist, '/quiz/profile/?_profile=1')
+        self.assertContains(changelist, f'/admin/quiz/requestprofile/{pk}/profile/')
+        detail = self.client.get(f'/admin/quiz/requestprofile/{pk}/change/')
+        self.assertContains(detail, 'Hottest functions')
+        download = self.client.get(f'/admin/quiz/requestprofile/{pk}/profile/')
+        self.assertEqual(download['Content-Type'], 'application/octet-stream')
+        self.assertTrue(marshal.loads(download.content))
+        queries = self.client.get(f'/admin/quiz/requestprofile/{pk}/queries/')
+        self.assertEqual(len(queries.json()), RequestProfile.objects.get().query_count)
+
+    def test_admin_is_staff_only(self):
+        pk = self.profile(self.staff)['X-Profile-Id']
+        self.client.force_login(self.learner)
+
+        response = self.client.get(f'/admin/quiz/requestprofile/{pk}/profile/')
+
+        self.assertEqual(response.status_code, 302)
+
+
+class TracingTest(SimpleTestCase):
+    """Spans nest under the current one and finished traces are written as OTLP/JSON"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'traces.jsonl'
+        self.tracer = tracing.Tracer(tracing.FileSpanExporter(self.path, service_name='quiz-test'), sample_rate=1.0)
+        patcher = mock.patch.object(tracing, 'tracer', self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exported(self):
+        return [json.loads(line) for line in self.path.read_text(encoding='utf-8').splitlines()]
+
+    def spans(self):
+        [trace] = self.exported()
+        return {span['name']: span for span in trace['resourceSpans'][0]['scopeSpans'][0]['spans']}
+
+    def test_spans_nest_under_their_parent(self):
+        @tracing.traced()
+        def parse():
+            with tracing.span('validate', options=4):
+                pass
+
+        with tracing.trace('api_new_question', domain='grammar'):
+            with tracing.span('attempt', attempt=1) as attempt:
+                parse()
+                attempt.set('outcome', 'accepted')
+            parse()
+
+        spans = self.spans()
+        root = spans['api_new_question']
+        self.assertNotIn('parentSpanId', root)
+        self.assertEqual(root['kind'], tracing.SPAN_KIND_SERVER)
+        self.assertEqual(spans['attempt']['parentSpanId'], root['spanId'])
+        self.assertEqual(spans['attempt']['kind'], tracing.SPAN_KIND_INTERNAL)
+        # parse() ran twice, once under the attempt and once under the root
+        [trace] = self.exported()
+        all_spans = trace['resourceSpans'][0]['scopeSpans'][0]['spans']
+        parents = sorted(s['parentSpanId'] for s in all_spans if s['name'] == 'parse')
+        self.assertEqual(parents, sorted([spans['attempt']['spanId'], root['spanId']]))
+        self.assertEqual(len({s['traceId'] for s in all_spans}), 1)
+        self.assertEqual(len({s['spanId'] for s in all_spans}), len(all_spans))
+        for span in all_spans:
+            self.assertGreaterEqual(int(span['startTimeUnixNano']), int(root['startTimeUnixNano']))
+            self.assertLessEqual(int(span['endTimeUnixNano']), int(root['endTimeUnixNano']))
+
+    def test_otlp_json_shape(self):
+        with tracing.trace('api_new_question', domain='grammar') as root:
+            root.set('cached', False)
+            root.set('attempts', 2)
+            root.set('score', 0.5)
+
+        [trace] = self.exported()
+        self.assertEqual(list(trace), ['resourceSpans'])
+        resource = trace['resourceSpans'][0]
+        self.assertEqual(resource['resource']['attributes'], [{'key': 'service.name', 'value': {'stringValue': 'quiz-test'}}])
+        scope = resource['scopeSpans'][0]
+        self.assertEqual(scope['scope'], {'name': 'ai.tracing'})
+        [span] = scope['spans']
+        self.assertRegex(span['traceId'], r'^[0-9a-f]{32}$')
+        self.assertRegex(span['spanId'], r'^[0-9a-f]{16}$')
+        self.assertIsInstance(span['startTimeUnixNano'], str)
+        self.assertLessEqual(int(span['startTimeUnixNano']), int(span['endTimeUnixNano']))
+        self.assertEqual(span['attributes'], [
+            {'key': 'domain', 'value': {'stringValue': 'grammar'}},
+            {'key': 'cached', 'value': {'boolValue': False}},
+            {'key': 'attempts', 'value': {'intValue': '2'}},
+            {'key': 'score', 'value': {'doubleValue': 0.5}},
+        ])
+        self.assertEqual(span['status'], {'code': tracing.STATUS_OK})
+
+    def test_error_marks_the_span_and_still_exports(self):
+        with self.assertRaises(ValueError):
+            with tracing.trace('api_new_question'):
+                with tracing.span('parse'):
+                    raise ValueError('bad json')
+
+        spans = self.spans()
+        self.assertEqual(spans['parse']['status'], {'code': tracing.STATUS_ERROR, 'message': 'ValueError: bad json'})
+        self.assertEqual(spans['api_new_question']['status']['code'], tracing.STATUS_ERROR)
+
+    def test_unsampled_and_outside_a_trace_are_noops(self):
+        self.tracer.sample_rate = 0
+        with tracing.trace('api_new_question') as root, tracing.span('parse') as child:
+            self.assertIs(root, tracing.NOOP_SPAN)
+            self.assertIs(child, tracing.NOOP_SPAN)
+            self.assertIs(tracing.current_span(), tracing.NOOP_SPAN)
+        with tracing.span('parse') as orphan:
+            self.assertIs(orphan, tracing.NOOP_SPAN)
+
+        self.assertFalse(self.path.exists())
+
+    def test_nested_root_is_a_child_span(self):
+        with tracing.trace('outer'), tracing.trace('inner'):
+            pass
+
+        spans = self.spans()
+        self.assertEqual(spans['inner']['parentSpanId'], spans['outer']['spanId'])
+
+    def test_async_spans_nest_across_threads(self):
+        @tracing.traced()
+        def blocking_stage():
+            with tracing.span('query'):
+                pass
+
+        @tracing.traced('api_new_question', root=True)
+        async def view():
+            await asyncio.gather(sync_to_async(blocking_stage)(), sync_to_async(blocking_stage)())
+
+        asyncio.run(view())
+
+        [trace] = self.exported()
+        spans = trace['resourceSpans'][0]['scopeSpans'][0]['spans']
+        by_id = {span['spanId']: span for span in spans}
+        stages = [s for s in spans if s['name'] == 'blocking_stage']
+        self.assertEqual(len(stages), 2)
+        for stage in stages:
+            self.assertEqual(by_id[stage['parentSpanId']]['name'], 'api_new_question')
+        for query in (s for s in spans if s['name'] == 'query'):
+            self.assertEqual(by_id[query['parentSpanId']]['name'], 'blocking_stage')
+
+    def test_trace_report(self):
+        for outcome in ('rejected', 'accepted'):
+            with tracing.trace('api_new_question'):
+                with tracing.span('llm_generate', model='llama3') as generate:
+                    time.sleep(0.02 if outcome == 'accepted' else 0.001)
+                    generate.set('outcome', outcome)
+                with tracing.span('parse_question_response'):
+                    pass
+        with tracing.trace('api_check_answer'):
+            pass
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"resourceSpans": [{"scopeSp')  # a line cut short by a crash
+
+        out = io.StringIO()
+        call_command('trace_report', file=str(self.path), name='api_new_question', slowest=1, stdout=out)
+        report = out.getvalue()
+
+        self.assertIn(f"1 slowest of 2 traced requests from {self.path}", report)
+        self.assertIn('llm_generate model=llama3 outcome=accepted', report)
+        self.assertNotIn('outcome=rejected', report)
+        self.assertNotIn('api_check_answer', report)
+        # The stage tree is indented under the request...
+        lines = report.splitlines()
+        generate = next(line for line in lines if 'llm_generate' in line and 'ms' in line)
+        self.assertIn('  llm_generate', generate)
+        # ...and followed by the per-stage table
+        self.assertIn('Stages over these requests', report)
+        header = next(i for i, line in enumerate(lines) if line.startswith('stage'))
+        stage_rows = {line.split()[0]: line.split() for line in lines[header + 1:]}
+        self.assertEqual(set(stage_rows), {'llm_generate', 'parse_question_response'})
+        self.assertEqual(stage_rows['llm_generate'][1], '1.0')
+
+    def test_trace_report_without_a_file(self):
+        with self.assertRaises(CommandError):
+            call_command('trace_report', file=str(self.path), stdout=io.StringIO())
+
+
+class WarmupTest(TestCase):
+    """Warm-ups load each routed model at the context size its routes send, and heartbeats keep idle ones loaded"""
+
+    def setUp(self):
+        self.router = routing.ModelRouter({
+            'question': {'model': 'llama3'},
+            'explanation': {'model': 'small', 'options': {'num_ctx': 4096}},
+        }, keep_alive='30m')
+        self.backends = [Backend('http://ollama-a:11434'), Backend('http://ollama-b:11434')]
+        self.manager = warmup.WarmupManager(
+            self.router, SimpleNamespace(backends=self.backends), LLMScheduler(), heartbeat_interval=60
+        )
+        self.sent = []
+
+    def post(self, url, json, timeout):
+        self.sent.append((url, json))
+        if 'unreachable' in url:
+            raise requests.exceptions.ConnectionError('refused')
+        return mock.Mock(status_code=200, raise_for_status=mock.Mock(), json=mock.Mock(return_value={'load_duration': 2_500_000_000}))
+
+    def warm(self, method, *args):
+        with mock.patch.object(warmup.requests, 'post', side_effect=self.post):
+            return method(*args)
+
+    def test_warm_all_loads_every_model_on_every_healthy_backend(self):
+        self.backends.append(Backend('http://ollama-c:11434'))
+        self.backends[2].healthy = False
+
+        outcomes = self.warm(self.manager.warm_all)
+
+        self.assertEqual(set(outcomes), {(b.base_url, m) for b in self.backends[:2] for m in ('llama3', 'small')})
+        self.assertTrue(all(outcome['ok'] and outcome['load_ms'] == 2500.0 for outcome in outcomes.values()))
+        self.assertEqual(len(self.sent), 4)
+        url, payload = self.sent[0]
+        self.assertEqual(url, 'http://ollama-a:11434/api/generate')
+        self.assertEqual(payload, {'model': 'llama3', 'prompt': '', 'stream': False, 'options': {'num_ctx': 2048}, 'keep_alive': '30m'})
+        self.assertEqual(self.manager.stats()['warmups'], 1)
+
+    def test_warm_up_uses_the_routes_context_size(self):
+        self.warm(self.manager.warm_all)
+
+        sizes = {payload['model']: payload['options']['num_ctx'] for _, payload in self.sent}
+        # Sized from the prompt for 'question', pinned by the 'explanation' route
+        self.assertEqual(sizes, {'llama3': 2048, 'small': 4096})
+        # Warming does not raise the context real calls get
+        self.assertEqual(self.router.model_ctx, {})
+        self.assertEqual(self.router.resolve('question').payload('short prompt')['options']['num_ctx'], 2048)
+
+    def test_warm_up_follows_the_size_calls_have_grown_to(self):
+        route = self.router.resolve('question')
+        route.payload('x' * 20000)
+
+        outcome = self.warm(self.manager.warm, self.backends[0], 'llama3')
+
+        self.assertEqual(outcome['num_ctx'], 8192)
+        self.assertEqual(self.sent[0][1]['options']['num_ctx'], 8192)
+        self.assertEqual(route.payload('short prompt')['options']['num_ctx'], 8192)
+
+    def test_failed_warm_up_is_recorded(self):
+        backend = Backend('http://unreachable:11434')
+
+        outcome = self.warm(self.manager.warm, backend, 'llama3')
+
+        self.assertFalse(outcome['ok'])
+        self.assertIn('refused', outcome['error'])
+        [result] = self.manager.stats()['results']
+        self.assertEqual((result['backend'], result['model'], result['ok']), ('http://unreachable:11434', 'llama3', False))
+
+    def test_heartbeat_pings_only_idle_models(self):
+        self.warm(self.manager.warm_all)
+        self.sent.clear()
+
+        self.assertEqual(self.warm(self.manager.heartbeat), [])
+        self.assertEqual(self.sent, [])
+
+        # An hour later 'small' has been used, 'llama3' has not
+        later = time.monotonic() + 3600
+        self.router.last_call['small'] = later
+        with mock.patch.object(warmup.time, 'monotonic', return_value=later):
+            self.assertEqual(self.warm(self.manager.heartbeat), ['llama3'])
+            self.assertEqual([payload['model'] for _, payload in self.sent], ['llama3', 'llama3'])
+            # Just warmed, so the next heartbeat leaves it alone
+            self.assertEqual(self.warm(self.manager.heartbeat), [])
+        self.assertEqual(self.manager.stats()['heartbeats'], 1)
+
+    def test_run_warms_then_heartbeats_until_stopped(self):
+        stop = threading.Event()
+        self.manager.heartbeat_interval = 0.04
+        heartbeat = mock.Mock(side_effect=lambda: stop.set() if heartbeat.call_count >= 2 else None)
+
+        with mock.patch.object(self.manager, 'heartbeat', heartbeat):
+            self.warm(self.manager.run, stop)
+
+        self.assertEqual(self.manager.warmups, 1)
+        self.assertEqual(len(self.sent), 4)
+        self.assertEqual(heartbeat.call_count, 2)
+
+
+class RoutePayloadTest(SimpleTestCase):
+    """Route.payload() sizes num_ctx from the prompt and the output budget"""
+
+    def setUp(self):
+        self.router = routing.ModelRouter({'question': {'model': 'llama3'}, 'explanation': {'model': 'llama3'},
+                                           'grammar': {'model': 'small'}})
+
+    def num_ctx(self, task, prompt, **options):
+        return self.router.resolve(task).payload(prompt, options)['options']['num_ctx']
+
+    def test_sized_to_the_next_context_size(self):
+        self.assertEqual(self.num_ctx('grammar', 'Fix: i has a apple', num_predict=70), 2048)
+        # ~2400 prompt tokens of Devanagari, or a small prompt with a long answer
+        self.assertEqual(self.num_ctx('question', 'क' * 2400, num_predict=384), 4096)
+        self.assertEqual(self.router.model_ctx, {'llama3': 4096, 'small': 2048})
+
+    def test_answer_budget_counts(self):
+        self.assertEqual(self.num_ctx('grammar', 'short', num_predict=2000), 2048)
+        self.assertEqual(self.num_ctx('grammar', 'short', num_predict=2100), 4096)
+
+    def test_capped_at_the_largest_size(self):
+        self.assertEqual(self.num_ctx('grammar', 'क' * 20000), 8192)
+
+    def test_context_only_grows_per_model(self):
+        self.assertEqual(self.num_ctx('question', 'क' * 5000), 8192)
+
+        # Another route on the same model keeps the loaded size; other models are unaffected
+        self.assertEqual(self.num_ctx('explanation', 'short', num_predict=192), 8192)
+        self.assertEqual(self.num_ctx('grammar', 'short', num_predict=192), 2048)
+
+    def test_measured_token_ratio_replaces_the_guess(self):
+        route = self.router.resolve('question')
+        self.assertEqual(route.estimate_tokens('a' * 1000), 301)
+        self.assertEqual(route.estimate_tokens('क' * 1000), 1001)
+
+        route.observe_prompt(1000, 500)
+
+        self.assertEqual(route.estimate_tokens('क' * 1000), 501)
+        self.assertEqual(self.num_ctx('question', 'क' * 3000), 2048)
+
+    def test_pinned_num_ctx_is_kept(self):
+        router = routing.ModelRouter({'summary': {'model': 'llama3', 'options': {'num_ctx': 8192, 'num_predict': 100}}})
+
+        payload = router.resolve('summary').payload('short', {'num_predict': 256, 'temperature': 0.7})
+
+        self.assertEqual(payload['options'], {'num_ctx': 8192, 'num_predict': 100, 'temperature': 0.7})
+        self.assertEqual(self.num_ctx('grammar', 'short', num_ctx=4096), 4096)
+        # Pinned sizes do not raise what sized calls use
+        self.assertEqual(router.model_ctx, {})
+        self.assertEqual(self.router.model_ctx, {})
+
+    def test_task_output_budgets(self):
+        route = self.router.resolve('question')
+        with mock.patch.object(routing, 'resolve', return_value=route):
+            question = ai_engine.build_generate_payload('प्रश्न', 'कठिन')
+            explanation = ai_engine.build_generate_payload('व्याख्या', task='explanation')
+            summary = writer_engine.build_payload('word ' * 1000, 'summary')
+            grammar = writer_engine.build_payload('i has a apple', 'grammar')
+            long_rewrite = writer_engine.build_payload('word ' * 5000, 'rewrite')
+
+        self.assertEqual(question['options']['num_predict'], 384)
+        self.assertIn('\nव्याख्या', question['options']['stop'])
+        self.assertEqual(explanation['options']['num_predict'], 192)
+        self.assertEqual(summary['options']['num_predict'], writer_engine.SUMMARY_MAX_TOKENS)
+        self.assertEqual(grammar['options']['num_predict'], int(route.estimate_tokens('i has a apple') * 1.5) + 64)
+        self.assertEqual(grammar['options']['stop'], writer_engine.TEXT_STOP)
+        self.assertEqual(long_rewrite['options']['num_predict'], writer_engine.MAX_OUTPUT_TOKENS)
+
+
+class PromptPrefixTest(TestCase):
+    """Question calls send the fixed instructions as `system` and keep the model loaded with keep_alive"""
+
+    def setUp(self):
+        self.router = routing.ModelRouter({'question': {'model': 'llama3'}, 'explanation': {'model': 'llama3'}},
+                                          keep_alive='30m')
+        patcher = mock.patch.object(routing, 'resolve', side_effect=self.router.resolve)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_question_payload_carries_the_system_prefix(self):
+        payload = ai_engine.build_generate_payload('विषय क्षेत्र: इतिहास', 'सजिलो')
+
+        self.assertEqual(payload['system'], QUESTION_SYSTEM_PROMPT)
+        self.assertEqual(payload['prompt'], 'विषय क्षेत्र: इतिहास')
+        self.assertEqual(payload['keep_alive'], '30m')
+
+    def test_explanation_has_no_system_prefix(self):
+        payload = ai_engine.build_generate_payload('व्याख्या गर्नुहोस्', task='explanation')
+
+        self.assertNotIn('system', payload)
+        self.assertEqual(payload['keep_alive'], '30m')
+
+    def test_only_the_suffix_varies_between_questions(self):
+        session = {'used_questions': []}
+        first = ai_engine.build_enhanced_prompt('इतिहास', 'राणा शासन', 'एउटा प्रश्न बनाउनुहोस्', 'सजिलो', session)
+        second = ai_engine.build_enhanced_prompt('भूगोल', 'नदीनाला', 'एउटा प्रश्न बनाउनुहोस्', 'कठिन', session)
+
+        payloads = [ai_engine.build_generate_payload(first, 'सजिलो'), ai_engine.build_generate_payload(second, 'कठिन')]
+        self.assertEqual(payloads[0]['system'], payloads[1]['system'])
+        self.assertNotEqual(payloads[0]['prompt'], payloads[1]['prompt'])
+        # The fixed instructions are not repeated in the per-question part
+        self.assertNotIn(QUESTION_SYSTEM_PROMPT[:200], first)
+        self.assertTrue(first.startswith('विषय क्षेत्र: इतिहास'))
+
+    def test_keep_alive(self):
+        route = self.router.resolve('question')
+        self.assertEqual(route.payload('x', keep_alive='5m')['keep_alive'], '5m')
+        self.assertNotIn('keep_alive', routing.ModelRouter({}).resolve('question').payload('x'))
+
+    def test_system_prefix_counts_towards_num_ctx(self):
+        route = self.router.resolve('question')
+
+        self.assertEqual(route.payload('short', system='क' * 3000)['options']['num_ctx'], 4096)
+
+    def test_prompt_evaluation_per_label(self):
+        route = self.router.resolve('question')
+        payload = route.payload('x' * 100, system='y' * 900)
+        for label, response in (('इतिहास', {'prompt_eval_count': 300, 'prompt_eval_duration': 90_000_000}),
+                                ('इतिहास', {'prompt_eval_count': 20, 'prompt_eval_duration': 10_000_000}),
+                                ('भूगोल', {'first_token_duration': 40_000_000, 'done_reason': 'stopped_early'})):
+            with self.router.observe(route, payload, label=label) as call:
+                call.record(response)
+
+        labels = self.router.stats()['question']['models']['llama3']['labels']
+        self.assertEqual(labels['इतिहास'], {
+            'calls': 2, 'avg_prompt_eval_tokens': 160.0, 'avg_prompt_eval_ms': 50.0, 'avg_first_token_ms': None,
+        })
+        self.assertEqual(labels['भूगोल'], {
+            'calls': 1, 'avg_prompt_eval_tokens': None, 'avg_prompt_eval_ms': None, 'avg_first_token_ms': 40.0,
+        })
+        # The token ratio is measured over prompt and system prefix together (300 / 1000)
+        self.assertAlmostEqual(route.token_ratio, 0.3, places=3)
+
+
+class PromptBudgetTest(SimpleTestCase):
+    """The avoidance list is made of question keywords, newest first, within the token budget"""
+
+    HISTORY = [
+        'नेपालको संविधान कहिले जारी भएको हो?',
+        'सगरमाथा राष्ट्रिय निकुञ्ज कुन जिल्लामा पर्छ?',
+        'राणा शासनको अन्त्य कहिले भयो?',
+        'संविधानको प्रस्तावना कसले लेख्यो?',
+    ]
+
+    def setUp(self):
+        patcher = mock.patch.object(prompt_budget, '_stats', Counter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def keywords(self, context):
+        self.assertTrue(context.startswith(prompt_budget.AVOIDANCE_HEADER))
+        return context[len(prompt_budget.AVOIDANCE_HEADER):].split(', ')
+
+    def test_question_keywords(self):
+        self.assertEqual(prompt_budget.question_keywords(self.HISTORY[0]), ['संविधान', 'जारी'])
+        self.assertEqual(prompt_budget.question_keywords(self.HISTORY[1]), ['राष्ट्रिय', 'सगरमाथा', 'निकुञ्ज'])
+        # Postpositions come off, question words and verbs go
+        self.assertEqual(prompt_budget.question_keywords(self.HISTORY[2]), ['अन्त्य', 'राणा', 'शासन'])
+        self.assertEqual(prompt_budget.question_keywords(self.HISTORY[1], limit=1), ['राष्ट्रिय'])
+
+    def test_newest_first_and_shared_keywords_once(self):
+        context = prompt_budget.avoidance_context(self.HISTORY, 1000, len)
+
+        keywords = self.keywords(context)
+        self.assertEqual(keywords[:2], prompt_budget.question_keywords(self.HISTORY[3])[:2])
+        self.assertEqual(keywords.count('संविधान'), 1)
+        self.assertEqual(keywords[-1], 'जारी')
+
+    def test_trimmed_to_the_allowance(self):
+        everything = self.keywords(prompt_budget.avoidance_context(self.HISTORY, 1000, len))
+        allowance = len(prompt_budget.AVOIDANCE_HEADER + ', '.join(everything[:4])) + 2
+
+        context = prompt_budget.avoidance_context(self.HISTORY, allowance, len)
+
+        # The oldest keywords are the ones dropped
+        self.assertEqual(self.keywords(context), everything[:4])
+        self.assertLessEqual(len(context), allowance)
+        self.assertEqual(prompt_budget.stats()['keywords_dropped'], len(everything) - 4)
+
+    def test_no_room_no_list(self):
+        self.assertEqual(prompt_budget.avoidance_context(self.HISTORY, 10, len), '')
+        self.assertEqual(prompt_budget.avoidance_context([], 1000, len), '')
+
+    @override_settings(QUESTION_AVOID_RECENT=1)
+    def test_only_recent_questions(self):
+        context = prompt_budget.avoidance_context(self.HISTORY, 1000, len)
+
+        self.assertEqual(self.keywords(context), prompt_budget.question_keywords(self.HISTORY[3]))
+
+    def test_stats_compare_with_the_raw_list(self):
+        prompt_budget.avoidance_context(self.HISTORY, 1000, len)
+        prompt_budget.record_validation('accepted', 0.4)
+        prompt_budget.record_validation('accepted', 0.2)
+        prompt_budget.record_validation('similar')
+        prompt_budget.record_validation('duplicate')
+
+        stats = prompt_budget.stats()
+        raw = len(prompt_budget.raw_avoidance_context(self.HISTORY))
+        self.assertEqual(stats['prompts'], 1)
+        self.assertEqual(stats['avg_raw_avoidance_tokens'], raw)
+        self.assertEqual(stats['tokens_saved_per_prompt'], raw - stats['avg_avoidance_tokens'])
+        self.assertGreater(stats['tokens_saved_per_prompt'], 0)
+        self.assertEqual(stats['repeat_rate'], 0.5)
+        self.assertEqual(stats['avg_max_similarity'], 0.3)
+
+    def test_question_prompt_stays_within_budget(self):
+        route = routing.Route('question')
+        session = {'used_questions': self.HISTORY * 3}
+
+        def prompt(budget):
+            with override_settings(QUESTION_PROMPT_TOKEN_BUDGET=budget), \
+                    mock.patch.object(routing, 'resolve', return_value=route):
+                return ai_engine.build_enhanced_prompt('इतिहास', 'राणा शासन', 'एउटा प्रश्न बनाउनुहोस्', 'सजिलो', session)
+
+        full = prompt(5000)
+        self.assertIn(prompt_budget.AVOIDANCE_HEADER, full)
+        tight = route.estimate_tokens(full) - 20
+        trimmed = prompt(tight)
+        self.assertLessEqual(route.estimate_tokens(trimmed), tight)
+        self.assertIn(prompt_budget.AVOIDANCE_HEADER, trimmed)
+        self.assertLess(len(trimmed), len(full))
+
+
+@override_settings(TASKS_IN_PROCESS_WORKERS=0)
+class ReadPathQueryTest(TestCase):
+    """The daily challenge is served from its prebuilt payload, and page reads do not grow with the history"""
+
+    @classmethod
+    def setUpTestData(cls):
+        make_daily_questions()
+        cls.user = User.objects.create_user('reader')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.today = timezone.now().date()
+
+    def queries(self, url):
+        """SQL the view itself ran (session, auth and savepoint queries left out)"""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query['sql'] for query in captured.captured_queries
+            if not any(part in query['sql'] for part in ('"django_session"', '"auth_user"', 'SAVEPOINT'))
+        ]
+
+    def tables(self, queries):
+        return [re.search(r'FROM "(\w+)"', sql).group(1) for sql in queries]
+
+    def answer(self, count):
+        questions = list(Question.objects.all())
+        UserAnswer.objects.bulk_create([
+            UserAnswer(user=self.user, question=questions[i % len(questions)], selected_answer='क', is_correct=i % 2 == 0)
+            for i in range(count)
+        ])
+        QuizAttempt.objects.bulk_create([QuizAttempt(user=self.user) for _ in range(count // 5)])
+
+    def test_daily_challenge_from_cache(self):
+        utils.prepare_daily_challenge(self.today)
+
+        queries = self.queries('/quiz/api/daily-challenge/')
+
+        # Only the per-user bits: completed and streak
+        self.assertEqual(self.tables(queries), ['quiz_dailychallengecompletion', 'quiz_userprofile'])
+
+    def test_daily_challenge_from_the_stored_payload(self):
+        challenge = utils.prepare_daily_challenge(self.today)
+        cache.clear()
+
+        queries = self.queries('/quiz/api/daily-challenge/')
+
+        # One read of the stored payload, no questions
+        self.assertEqual(self.tables(queries), ['quiz_dailychallenge', 'quiz_dailychallengecompletion', 'quiz_userprofile'])
+        self.assertIn('SELECT "quiz_dailychallenge"."payload"', queries[0])
+        # The row refilled the cache for the next request
+        self.assertEqual(cache.get(DailyChallenge.payload_cache_key(self.today))['challenge_id'], challenge['challenge_id'])
+        self.assertNotIn('quiz_dailychallenge', self.tables(self.queries('/quiz/api/daily-challenge/')))
+
+    def test_editing_questions_drops_the_stored_payload(self):
+        utils.prepare_daily_challenge(self.today)
+        challenge = DailyChallenge.objects.get(date=self.today)
+
+        challenge.questions.remove(challenge.questions.first())
+
+        challenge.refresh_from_db()
+        self.assertIsNone(challenge.payload)
+        self.assertIsNone(cache.get(DailyChallenge.payload_cache_key(self.today)))
+
+    def test_profile_and_dashboard_queries_do_not_grow_with_history(self):
+        for url in ('/quiz/profile/', '/quiz/dashboard/'):
+            self.answer(5)
+            few = len(self.queries(url))
+            self.answer(200)
+            many = len(self.queries(url))
+            self.assertEqual(few, many, url)
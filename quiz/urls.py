@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import views_advanced
+from . import views_async
 from . import views_enhanced
 
+# Coroutine views for ASGI deployments, thread-per-request views otherwise
+llm_views = views_async if settings.ASYNC_LLM_VIEWS else views
+
 app_name = "quiz"  
 
 urlpatterns = [
@@ -10,8 +15,9 @@ urlpatterns = [
     path('quiz', views.home, name='home'),
     
     # Original API Endpoints
-    path('api/new/', views.api_new_question, name='api_new'),     
-    path('api/check/', views.api_check_answer, name='api_check'),
+    path('api/new/', llm_views.api_new_question, name='api_new'),     
+    path('api/check/', llm_views.api_check_answer, name='api_check'),
+    path('api/explanation/<int:question_id>/', views.api_explanation, name='api_explanation'),
     path('api/reset/', views.api_reset_quiz, name='api_reset'),
     path('api/stats/', views.api_quiz_stats, name='api_stats'),
     
@@ -62,6 +68,19 @@ urlpatterns = [
     path('api/preferences/', views_enhanced.api_get_preferences, name='get_preferences'),
     path('api/preferences/update/', views_enhanced.api_update_preferences, name='update_preferences'),
     
+    # Question Cache
+    path('api/question-cache/stats/', views_enhanced.api_question_cache_stats, name='question_cache_stats'),
+    
+    # Background Jobs
+    path('api/jobs/stats/', views_enhanced.api_job_stats, name='job_stats'),
+    
+    # LLM Scheduler & Backends
+    path('api/llm/scheduler/stats/', views_enhanced.api_llm_scheduler_stats, name='llm_scheduler_stats'),
+    path('api/llm/backends/', views_enhanced.api_llm_backends, name='llm_backends'),
+    path('api/llm/routes/', views_enhanced.api_llm_routes, name='llm_routes'),
+    path('api/llm/question-prompts/', views_enhanced.api_question_prompt_stats, name='question_prompt_stats'),
+    path('api/llm/calls/', views_enhanced.api_llm_calls, name='llm_calls'),
+    
     # Dashboard
     path('dashboard/', views_enhanced.dashboard_page, name='dashboard'),
 ]
\ No newline at end of file
@@ -1,13 +1,28 @@
 # quiz/utils.py - Helper functions for advanced features
-from django.db.models import Q, Count, Avg
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Count, Avg, F
 from django.utils import timezone
 from datetime import datetime, timedelta
 import random
+import time
+from ai import counters, events, tracing
+from . import jobs
 from .models import (
     Question, DailyChallenge, UserProfile, UserAnswer,
-    BookmarkedQuestion, QuizAttempt, Achievement, UserAchievement
+    BookmarkedQuestion, QuizAttempt, Achievement, UserAchievement,
+    PerformanceMetrics
 )
 
+VALID_ANSWER_LETTERS = ('क', 'ख', 'ग', 'घ')
+
+# Prebuilt daily payloads are immutable for their date; keep them a little over a day
+DAILY_CHALLENGE_CACHE_TIMEOUT = 60 * 60 * 26
+# A build claim older than this is considered abandoned (crashed worker)
+DAILY_CHALLENGE_BUILD_TTL = 30
+DAILY_CHALLENGE_POLL_INTERVAL = 0.1
+
 
 def get_or_create_daily_challenge(date=None):
     """Get or create daily challenge for a specific date"""
@@ -43,6 +58,106 @@ def get_or_create_daily_challenge(date=None):
     return challenge
 
 
+def serialize_daily_challenge(challenge):
+    """Build the user-independent JSON payload for a daily challenge"""
+    questions = challenge.questions.order_by('id').values(
+        'id', 'question_text', 'options', 'correct_answer', 'domain', 'topic', 'difficulty'
+    )
+    return {
+        'challenge_id': challenge.id,
+        'date': challenge.date.isoformat(),
+        'questions': [
+            {
+                'id': q['id'],
+                'question': q['question_text'],
+                'options': q['options'],
+                'correct_answer': q['correct_answer'],
+                'domain': q['domain'],
+                'topic': q['topic'],
+                'difficulty': q['difficulty']
+            }
+            for q in questions
+        ]
+    }
+
+
+def prepare_daily_challenge(date):
+    """Assemble a day's challenge and store its serialized payload in the DB and cache"""
+    challenge = get_or_create_daily_challenge(date)
+    payload = serialize_daily_challenge(challenge)
+    
+    if payload['questions']:
+        DailyChallenge.objects.filter(pk=challenge.pk).update(payload=payload)
+        cache.set(DailyChallenge.payload_cache_key(date), payload, DAILY_CHALLENGE_CACHE_TIMEOUT)
+    return payload
+
+
+def _load_daily_challenge_payload(date):
+    """Look up an already built payload in the cache, then the DB; None if there is none"""
+    cache_key = DailyChallenge.payload_cache_key(date)
+    payload = cache.get(cache_key)
+    if payload is not None:
+        return payload
+    
+    payload = DailyChallenge.objects.filter(date=date).values_list('payload', flat=True).first()
+    if payload:
+        cache.set(cache_key, payload, DAILY_CHALLENGE_CACHE_TIMEOUT)
+        return payload
+    return None
+
+
+def _claim_daily_challenge_build(date):
+    """Atomically take the build claim for a date; only one worker gets True"""
+    challenge, _ = DailyChallenge.objects.get_or_create(date=date)
+    now = timezone.now()
+    stale = now - timedelta(seconds=DAILY_CHALLENGE_BUILD_TTL)
+    
+    # Single conditional UPDATE acts as a compare-and-set across processes
+    claimed = DailyChallenge.objects.filter(
+        pk=challenge.pk,
+        payload__isnull=True
+    ).filter(
+        Q(build_started_at__isnull=True) | Q(build_started_at__lt=stale)
+    ).update(build_started_at=now)
+    return claimed == 1
+
+
+def get_daily_challenge_payload(date=None, fallback=True):
+    """Return the prebuilt daily payload, building it single-flight when missing.
+    
+    Cache first, then the DB. If neither has it, one worker claims the build
+    while the others wait up to DAILY_CHALLENGE_LOCK_WAIT seconds for its
+    result. After that they get the previous day's payload marked 'stale'
+    (only with `fallback`), or None when there is nothing finished to serve.
+    """
+    if date is None:
+        date = timezone.now().date()
+    
+    payload = _load_daily_challenge_payload(date)
+    if payload is not None:
+        return payload
+    
+    if _claim_daily_challenge_build(date):
+        try:
+            return prepare_daily_challenge(date)
+        finally:
+            DailyChallenge.objects.filter(date=date).update(build_started_at=None)
+    
+    deadline = time.monotonic() + getattr(settings, 'DAILY_CHALLENGE_LOCK_WAIT', 3)
+    while time.monotonic() < deadline:
+        time.sleep(DAILY_CHALLENGE_POLL_INTERVAL)
+        payload = _load_daily_challenge_payload(date)
+        if payload is not None:
+            return payload
+    
+    if fallback:
+        # Yesterday's questions can be played, but never completed as today's challenge
+        payload = _load_daily_challenge_payload(date - timedelta(days=1))
+        if payload is not None:
+            return {**payload, 'stale': True}
+    return None
+
+
 def check_and_update_streak(user):
     """Check and update user's streak"""
     profile = user.profile
@@ -66,7 +181,12 @@ def check_and_update_streak(user):
     profile.save()
     
     # Check for streak achievements
-    check_achievements(user)
+    enqueue_achievement_check(user)
+
+
+def enqueue_achievement_check(user):
+    """Run check_achievements after the response; one pending check per user is enough"""
+    jobs.enqueue('quiz.check_achievements', {'user_id': user.id}, key=f'achievements:{user.id}')
 
 
 def check_achievements(user):
@@ -104,6 +224,7 @@ def check_achievements(user):
     return unlocked
 
 
+@tracing.traced()
 def save_question_to_db(question_data, difficulty):
     """Save AI-generated question to database"""
     question = Question.objects.create(
@@ -120,15 +241,20 @@ def save_question_to_db(question_data, difficulty):
     return question
 
 
+def mark_questions_used(question_ids):
+    """Count a serving of each question (write-behind, no UPDATE on the request path)"""
+    counters.incr_many(Question, question_ids, 'times_used')
+
+
 def save_user_answer(user, question, selected_answer, is_correct, quiz_attempt=None):
-    """Save user's answer to database"""
-    answer = UserAnswer.objects.create(
+    """Save user's answer to database (the INSERT itself is write-behind)"""
+    answer = events.record(UserAnswer(
         user=user,
         question=question,
         quiz_attempt=quiz_attempt,
         selected_answer=selected_answer,
         is_correct=is_correct
-    )
+    ))
     
     # Update user profile
     profile = user.profile
@@ -138,11 +264,115 @@ def save_user_answer(user, question, selected_answer, is_correct, quiz_attempt=N
     profile.save()
     
     # Check for achievements
-    check_achievements(user)
+    enqueue_achievement_check(user)
     
     return answer
 
 
+def grade_submitted_answers(submitted, allowed_ids=None):
+    """Validate submitted answers against stored correct answers.
+    
+    Accepts a list of {"question_id", "answer", "time_taken"} dicts and returns
+    (question, selected_answer, is_correct, time_taken) tuples, skipping unknown
+    questions, duplicates, ids outside ``allowed_ids`` and answers that are not
+    one of क/ख/ग/घ.
+    """
+    allowed = set(allowed_ids) if allowed_ids is not None else None
+    wanted = {}
+    for item in submitted:
+        try:
+            question_id = int(item.get('question_id'))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if allowed is not None and question_id not in allowed:
+            continue
+        selected = str(item.get('answer', '')).strip()
+        if question_id in wanted or selected not in VALID_ANSWER_LETTERS:
+            continue
+        time_taken = item.get('time_taken')
+        wanted[question_id] = (selected, int(time_taken) if isinstance(time_taken, (int, float)) else None)
+    
+    questions = Question.objects.only(
+        'id', 'correct_answer', 'domain', 'difficulty'
+    ).in_bulk(list(wanted))
+    
+    graded = []
+    for question_id, (selected, time_taken) in wanted.items():
+        question = questions.get(question_id)
+        if question is None:
+            continue
+        graded.append((question, selected, selected == question.correct_answer, time_taken))
+    return graded
+
+
+def save_user_answers_bulk(user, graded, quiz_attempt=None):
+    """Persist a whole batch of graded answers and update the profile counters.
+    
+    Runs as one transaction: a single bulk INSERT for the answers and one UPDATE for
+    the profile counters. PerformanceMetrics and achievements are updated by a
+    background job queued for after the commit.
+    """
+    if not graded:
+        return []
+    
+    correct = sum(1 for _, _, is_correct, _ in graded if is_correct)
+    
+    with transaction.atomic():
+        answers = UserAnswer.objects.bulk_create([
+            UserAnswer(
+                user=user,
+                question=question,
+                quiz_attempt=quiz_attempt,
+                selected_answer=selected,
+                is_correct=is_correct,
+                time_taken=time_taken
+            )
+            for question, selected, is_correct, time_taken in graded
+        ])
+        
+        UserProfile.objects.filter(user=user).update(
+            total_questions_attempted=F('total_questions_attempted') + len(graded),
+            correct_answers=F('correct_answers') + correct
+        )
+        user.profile.refresh_from_db()
+        
+        jobs.enqueue('quiz.record_answer_stats', {
+            'user_id': user.id,
+            'answers': [[question.id, is_correct, time_taken] for question, _, is_correct, time_taken in graded],
+        })
+    
+    return answers
+
+
+def update_performance_metrics(user, graded):
+    """Fold a batch of graded answers into today's PerformanceMetrics row"""
+    today = timezone.now().date()
+    metric, created = PerformanceMetrics.objects.select_for_update().get_or_create(user=user, date=today)
+    
+    timed = [t for _, _, _, t in graded if t is not None]
+    if timed:
+        previous = metric.questions_attempted
+        metric.average_time_per_question = (
+            (metric.average_time_per_question * previous + sum(timed)) / (previous + len(timed))
+        )
+        metric.study_time_minutes += sum(timed) // 60
+    
+    for question, _, is_correct, _ in graded:
+        metric.questions_attempted += 1
+        domain = metric.domains_covered.setdefault(question.domain, {'total': 0, 'correct': 0})
+        difficulty = metric.difficulty_breakdown.setdefault(question.difficulty, {'total': 0, 'correct': 0})
+        domain['total'] += 1
+        difficulty['total'] += 1
+        if is_correct:
+            metric.questions_correct += 1
+            domain['correct'] += 1
+            difficulty['correct'] += 1
+    
+    metric.streak_count = user.profile.streak_days
+    metric.save()
+    return metric
+
+
 def search_questions(query, domain=None, difficulty=None, user=None):
     """Search questions with filters"""
     questions = Question.objects.filter(is_approved=True)
@@ -15,7 +15,12 @@ from datetime import datetime
 # Import models
 from .models import Question, UserAnswer, QuizAttempt, BookmarkedQuestion
 # Import utilities and constants
-from .utils import save_question_to_db, save_user_answer, check_achievements
+from .utils import save_question_to_db, save_user_answer, check_achievements, mark_questions_used
+from . import jobs, question_cache
+from ai import tracing
+from ai.llm import budget
+from ai.llm.admission import llm_admission
+from ai.llm.ratelimit import llm_rate_limit
 from .constants import QUESTION_DOMAINS, DIFFICULTY_LEVELS
 from .ai_engine import generate_single_question, validate_question_quality, generate_question_explanation
 
@@ -42,8 +47,31 @@ def home(request):
             
     return render(request, 'home.html')
 
+def serve_bank_question(request):
+    """Degraded response while the LLM is saturated: an approved question from the bank"""
+    used = request.session.get('used_questions', [])
+    qid = Question.objects.filter(is_approved=True).exclude(
+        question_text__in=used
+    ).order_by('?').values_list('id', flat=True).first()
+    question = question_cache.get_question(qid) if qid else None
+    if question is None:
+        return None
+    
+    question_data = {
+        'question': question['question_text'],
+        'options': question['options'],
+        'correct_letter': question['correct_answer'],
+        'domain': question['domain'],
+        'topic': question['topic'],
+    }
+    mark_questions_used([qid])
+    return return_question(question_data, qid, question['domain'], question['topic'], question['difficulty'], request, degraded=True)
+
 @csrf_exempt
 @require_http_methods(["GET"])
+@llm_admission(fallback=serve_bank_question, name='quiz_new_question')
+@llm_rate_limit('quiz_new_question')
+@tracing.traced('api_new_question', root=True)
 def api_new_question(request):
     """Generate a new unique question"""
     try:
@@ -55,10 +83,14 @@ def api_new_question(request):
         
         # Generation loop with limited attempts
         for attempt in range(8):
-            question_data = generate_single_question(domain, topic, difficulty, request.session, attempt)
-            
-            if question_data and validate_question_quality(question_data, request.session):
-                return save_and_return_question(question_data, domain, topic, difficulty, request)
+            if budget.exhausted():
+                logger.warning("Question generation stopped: request time budget spent")
+                break
+            with tracing.span('attempt', attempt=attempt):
+                question_data = generate_single_question(domain, topic, difficulty, request.session, attempt)
+                
+                if question_data and validate_question_quality(question_data, request.session):
+                    return save_and_return_question(question_data, domain, topic, difficulty, request)
             
             time.sleep(0.2) # Small backoff
         
@@ -69,6 +101,7 @@ def api_new_question(request):
         logger.error(f"Failed to generate question: {e}", exc_info=True)
         return get_emergency_fallback(request)
 
+@tracing.traced()
 def get_strategic_topic(session):
     """Select domain and topic with optimal diversity to prevent repetition"""
     context = session.get('question_context', {})
@@ -117,10 +150,18 @@ def save_and_return_question(question_data, domain, topic, difficulty, request):
     try:
         db_q = save_question_to_db(question_data, difficulty)
         qid = db_q.id
+        mark_questions_used([qid])
+        if not db_q.explanation:
+            # Start generating the explanation while the user is still answering
+            enqueue_explanation(qid)
     except Exception as e:
         logger.error(f"DB save error: {e}")
         qid = None
     
+    return return_question(question_data, qid, domain, topic, difficulty, request)
+
+def return_question(question_data, qid, domain, topic, difficulty, request, degraded=False):
+    """Record the question in the session and send it to the client"""
     # Update Session
     session = request.session
     session['used_questions'] = (session.get('used_questions', []) + [question_data['question']])[-50:]
@@ -147,11 +188,13 @@ def save_and_return_question(question_data, domain, topic, difficulty, request):
         "topic": topic,
         "difficulty": difficulty,
         "question_id": qid,
+        "degraded": degraded,
         "stats": {"total": ctx['total_questions'], "stats": ctx['domain_stats']}
     })
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@llm_rate_limit('quiz_check_answer')
 def api_check_answer(request):
     """Verify user selection and provide rich feedback"""
     try:
@@ -163,35 +206,68 @@ def api_check_answer(request):
         if not current: return JsonResponse({"error": "No active question"}, status=400)
         
         is_correct = choice == current.get('correct_letter')
-        explanation = generate_question_explanation(current)
+        qid = request.session.get('current_question_id')
+        if qid:
+            # Served from the stored explanation; if it is not ready yet the client polls for it
+            explanation, explanation_pending = stored_explanation(qid)
+        else:
+            explanation, explanation_pending = generate_question_explanation(current), False
         
-        # Update stats
-        ctx = request.session.get('question_context', {})
-        if is_correct: ctx['correct_answers'] = ctx.get('correct_answers', 0) + 1
-        ctx['total_answered'] = ctx.get('total_answered', 0) + 1
-        request.session['question_context'] = ctx
-        
-        # Bookmark status
-        bookmarked = False
-        if request.user.is_authenticated and request.session.get('current_question_id'):
-            bookmarked = BookmarkedQuestion.objects.filter(
-                user=request.user, question_id=request.session['current_question_id']
-            ).exists()
-
-        return JsonResponse({
-            "correct": is_correct,
-            "correct_answer": current.get('correct_letter'),
-            "explanation": explanation,
-            "is_bookmarked": bookmarked,
-            "stats": {
-                "correct": ctx.get('correct_answers', 0),
-                "total": ctx.get('total_answered', 0)
-            }
-        })
+        return check_answer_response(request, current, is_correct, qid, explanation, explanation_pending)
     except Exception as e:
         logger.error(f"Check answer error: {e}")
         return JsonResponse({"error": "Processing error"}, status=500)
 
+def stored_explanation(question_id):
+    """(explanation, pending) for a stored question, queueing generation when it has none"""
+    explanation = Question.objects.filter(id=question_id).values_list('explanation', flat=True).first()
+    if explanation:
+        return explanation, False
+    enqueue_explanation(question_id)
+    return None, True
+
+def check_answer_response(request, current, is_correct, qid, explanation, explanation_pending):
+    """Update session stats and build the answer feedback response"""
+    # Update stats
+    ctx = request.session.get('question_context', {})
+    if is_correct: ctx['correct_answers'] = ctx.get('correct_answers', 0) + 1
+    ctx['total_answered'] = ctx.get('total_answered', 0) + 1
+    request.session['question_context'] = ctx
+    
+    # Bookmark status
+    bookmarked = False
+    if request.user.is_authenticated and qid:
+        bookmarked = BookmarkedQuestion.objects.filter(user=request.user, question_id=qid).exists()
+
+    return JsonResponse({
+        "correct": is_correct,
+        "correct_answer": current.get('correct_letter'),
+        "explanation": explanation or None,
+        "explanation_pending": explanation_pending,
+        "question_id": qid,
+        "is_bookmarked": bookmarked,
+        "stats": {
+            "correct": ctx.get('correct_answers', 0),
+            "total": ctx.get('total_answered', 0)
+        }
+    })
+
+def enqueue_explanation(question_id):
+    """Queue LLM explanation generation for a stored question (deduplicated per question)"""
+    jobs.enqueue('quiz.generate_explanation', {'question_id': question_id}, key=f'explanation:{question_id}')
+
+@require_http_methods(["GET"])
+def api_explanation(request, question_id):
+    """Poll for an explanation that is being generated in the background"""
+    explanation = Question.objects.filter(id=question_id).values_list('explanation', flat=True).first()
+    if explanation is None:
+        return JsonResponse({"error": "Question not found"}, status=404)
+    return JsonResponse({
+        "question_id": question_id,
+        "explanation": explanation or None,
+        "pending": not explanation
+    })
+
 def get_intelligent_fallback(domain, topic, request):
     """High-reliability fallback questions for when AI is unavailable"""
     fallbacks = {
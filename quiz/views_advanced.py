@@ -1,6 +1,8 @@
 # quiz/views_advanced.py - Advanced feature endpoints
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import (
+    JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, HttpResponseNotModified
+)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
@@ -9,19 +11,25 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 import json
 import csv
+import importlib.util
 import logging
+import zlib
 
 from .models import (
     Question, BookmarkedQuestion, DailyChallenge, DailyChallengeCompletion,
     QuizAttempt, UserAnswer, Achievement, UserAchievement
 )
 from .utils import (
-    get_or_create_daily_challenge, check_and_update_streak,
+    get_daily_challenge_payload, check_and_update_streak, mark_questions_used,
     save_user_answer, search_questions, get_user_statistics
 )
+from .reports import request_report
 
 logger = logging.getLogger(__name__)
 
+# Rows fetched per database round trip while streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
 
 # ... existing code ...
 
@@ -99,31 +107,29 @@ def api_leaderboard(request, period='weekly'):
 def api_daily_challenge(request):
     """Get today's daily challenge"""
     try:
-        challenge = get_or_create_daily_challenge()
-        questions_data = []
-        
-        for question in challenge.questions.all():
-            questions_data.append({
-                'id': question.id,
-                'question': question.question_text,
-                'options': question.options,
-                'correct_answer': question.correct_answer,
-                'domain': question.domain,
-                'topic': question.topic,
-                'difficulty': question.difficulty
-            })
-        
-        # Check if user already completed today's challenge
-        completed = DailyChallengeCompletion.objects.filter(
+        payload = get_daily_challenge_payload()
+        if payload is None:
+            response = JsonResponse({'error': "Today's challenge is still being prepared"}, status=503)
+            response['Retry-After'] = '5'
+            return response
+        
+        # A stale payload is yesterday's, served while today's is being built
+        stale = payload.get('stale', False)
+        mark_questions_used([q['id'] for q in payload['questions']])
+        
+        # Only the per-user bits are computed per request
+        completed = not stale and DailyChallengeCompletion.objects.filter(
             user=request.user,
-            challenge=challenge
+            challenge_id=payload['challenge_id']
         ).exists()
         
         return JsonResponse({
             'success': True,
-            'date': challenge.date.isoformat(),
-            'questions': questions_data,
-            'total_questions': len(questions_data),
+            'challenge_id': payload['challenge_id'],
+            'date': payload['date'],
+            'stale': stale,
+            'questions': payload['questions'],
+            'total_questions': len(payload['questions']),
             'completed': completed,
             'streak': request.user.profile.streak_days
         })
@@ -149,12 +155,17 @@ def api_complete_daily_challenge(request):
         score = data.get('score', 0)
         total = data.get('total', 10)
         
-        challenge = get_or_create_daily_challenge()
+        # Always today's challenge: yesterday's fallback payload cannot be completed
+        payload = get_daily_challenge_payload(fallback=False)
+        if payload is None:
+            return JsonResponse({'error': "Today's challenge is not ready yet"}, status=503)
+        if data.get('challenge_id', payload['challenge_id']) != payload['challenge_id']:
+            return JsonResponse({'error': "This is not today's challenge"}, status=409)
         
         # Create or update completion
         completion, created = DailyChallengeCompletion.objects.get_or_create(
             user=request.user,
-            challenge=challenge,
+            challenge_id=payload['challenge_id'],
             defaults={'score': score, 'total_questions': total}
         )
         
@@ -376,130 +387,132 @@ def api_user_stats(request):
 
 # ==================== EXPORT ====================
 
+class _Echo:
+    """File-like object whose write() hands the encoded line straight back"""
+    def write(self, value):
+        return value
+
+
+def _parse_export_date(value):
+    """Parse an optional YYYY-MM-DD query value, raising ValueError on bad input"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _stream_csv_rows(rows, username=''):
+    """Yield CSV lines for the export one row at a time"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['Date', 'Question', 'Domain', 'Topic', 'Difficulty', 'Your Answer', 'Correct Answer', 'Result'])
+    
+    # The query runs while the response is being sent, after the 200 went out.
+    # A failure can only be logged and re-raised: the server then drops the
+    # connection, so the client sees a broken download rather than a short CSV.
+    try:
+        for answered_at, question_text, domain, topic, difficulty, selected, correct, is_correct in rows:
+            yield writer.writerow([
+                answered_at.strftime('%Y-%m-%d %H:%M'),
+                question_text[:100],
+                domain,
+                topic,
+                difficulty,
+                selected,
+                correct,
+                'सही' if is_correct else 'गलत'
+            ])
+    except Exception as e:
+        logger.error(f"CSV export for {username} failed mid-stream: {e}", exc_info=True)
+        raise
+
+
+def _gzip_stream(lines):
+    """Compress a stream of text lines into gzip chunks without buffering the whole file"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
 @login_required
 def export_csv(request):
-    """Export user's quiz history as CSV"""
+    """Export user's quiz history as a streamed CSV (optionally date-filtered and gzipped)"""
     try:
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="quiz_history_{request.user.username}.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Date', 'Question', 'Domain', 'Topic', 'Difficulty', 'Your Answer', 'Correct Answer', 'Result'])
-        
-        answers = UserAnswer.objects.filter(user=request.user).select_related('question').order_by('-answered_at')
-        
-        for answer in answers:
-            writer.writerow([
-                answer.answered_at.strftime('%Y-%m-%d %H:%M'),
-                answer.question.question_text[:100],
-                answer.question.domain,
-                answer.question.topic,
-                answer.question.difficulty,
-                answer.selected_answer,
-                answer.question.correct_answer,
-                'सही' if answer.is_correct else 'गलत'
-            ])
-        
-        return response
+        start = _parse_export_date(request.GET.get('start'))
+        end = _parse_export_date(request.GET.get('end'))
+    except ValueError:
+        return HttpResponse('Invalid date. Use YYYY-MM-DD for start and end.', status=400)
     
-    except Exception as e:
-        logger.error(f"Error in export_csv: {e}")
-        return HttpResponse(f'Error: {str(e)}', status=500)
+    answers = UserAnswer.objects.filter(user=request.user)
+    if start:
+        answers = answers.filter(answered_at__date__gte=start)
+    if end:
+        answers = answers.filter(answered_at__date__lte=end)
+    
+    # Project only the exported columns and walk the cursor in chunks so
+    # memory stays flat no matter how long the history is. Nothing is queried
+    # until the response streams (see _stream_csv_rows for errors there).
+    rows = answers.order_by('-answered_at').values_list(
+        'answered_at', 'question__question_text', 'question__domain',
+        'question__topic', 'question__difficulty', 'selected_answer',
+        'question__correct_answer', 'is_correct'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    
+    lines = _stream_csv_rows(rows, request.user.username)
+    filename = f"quiz_history_{request.user.username}.csv"
+    
+    if request.GET.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        response = StreamingHttpResponse(_gzip_stream(lines), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(lines, content_type='text/csv')
+    
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 @login_required
 def export_pdf(request):
-    """Export user statistics as PDF"""
+    """Serve the user's PDF report, building it in the background when the data changed"""
     try:
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.units import inch
-        from io import BytesIO
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#6b46c1'),
-            spaceAfter=30,
-            alignment=1  # Center
+        if importlib.util.find_spec('reportlab') is None:
+            return HttpResponse('PDF export requires reportlab library. Install with: pip install reportlab', status=500)
+        
+        path, version, state = request_report(request.user, retry=request.GET.get('retry') == '1')
+        etag = f'"{version}"'
+        
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
+        if state == 'failed':
+            return HttpResponse(
+                'Your report could not be generated. <a href="?retry=1">Try again</a> or come back later.',
+                status=500
+            )
+        
+        if state == 'building':
+            # Report is being rendered off the request path; let the browser poll
+            response = HttpResponse(
+                '<html><head><meta http-equiv="refresh" content="3"></head>'
+                '<body>रिपोर्ट तयार हुँदैछ... Your report is being prepared, this page will refresh.</body></html>',
+                status=202
+            )
+            response['Retry-After'] = '3'
+            return response
+        
+        response = FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=f'quiz_report_{request.user.username}.pdf',
+            content_type='application/pdf'
         )
-        elements.append(Paragraph(f'Quiz Report - {request.user.username}', title_style))
-        elements.append(Spacer(1, 0.3*inch))
-        
-        # Get statistics
-        stats = get_user_statistics(request.user)
-        profile = stats['profile']
-        
-        # Summary table
-        summary_data = [
-            ['Metric', 'Value'],
-            ['Total Questions Attempted', str(profile.total_questions_attempted)],
-            ['Correct Answers', str(profile.correct_answers)],
-            ['Accuracy', f'{profile.accuracy}%'],
-            ['Current Streak', f'{profile.streak_days} days'],
-            ['Total Bookmarks', str(stats['total_bookmarks'])],
-        ]
-        
-        summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6b46c1')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(summary_table)
-        elements.append(Spacer(1, 0.5*inch))
-        
-        # Domain-wise performance
-        elements.append(Paragraph('Domain-wise Performance', styles['Heading2']))
-        elements.append(Spacer(1, 0.2*inch))
-        
-        domain_data = [['Domain', 'Total', 'Correct', 'Accuracy']]
-        for domain_stat in stats['domain_stats']:
-            domain = domain_stat['question__domain']
-            total = domain_stat['total']
-            correct = domain_stat['correct']
-            accuracy = round((correct / total * 100), 2) if total > 0 else 0
-            domain_data.append([domain, str(total), str(correct), f'{accuracy}%'])
-        
-        if len(domain_data) > 1:
-            domain_table = Table(domain_data, colWidths=[2*inch, 1.5*inch, 1.5*inch, 1.5*inch])
-            domain_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#a78bfa')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(domain_table)
-        
-        # Build PDF
-        doc.build(elements)
-        buffer.seek(0)
-        
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="quiz_report_{request.user.username}.pdf"'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
     
-    except ImportError:
-        return HttpResponse('PDF export requires reportlab library. Install with: pip install reportlab', status=500)
     except Exception as e:
         logger.error(f"Error in export_pdf: {e}")
         return HttpResponse(f'Error: {str(e)}', status=500)
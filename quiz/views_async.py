@@ -0,0 +1,97 @@
+# quiz/views_async.py - Async versions of the LLM-bound quiz endpoints (for ASGI deployments)
+#
+# Same behaviour and responses as the views in quiz/views.py. Waiting for a
+# scheduler slot and for Ollama is done with coroutines, so under an ASGI server a
+# request that is waiting on the model costs no worker thread. Session and ORM work
+# (short, synchronous) runs through sync_to_async. Routed instead of the sync
+# views when ASYNC_LLM_VIEWS is enabled.
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from ai import tracing
+from ai.llm import budget
+from ai.llm.admission import llm_admission
+from ai.llm.ratelimit import llm_rate_limit
+from .ai_engine import agenerate_single_question, agenerate_question_explanation, validate_question_quality
+from .views import (
+    get_strategic_topic, get_adaptive_difficulty, save_and_return_question,
+    get_intelligent_fallback, get_emergency_fallback, serve_bank_question,
+    stored_explanation, check_answer_response
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _load_session(request):
+    """Read the session in a thread; afterwards it is served from memory without DB access"""
+    return dict(request.session.items())
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@llm_admission(fallback=serve_bank_question, name='quiz_new_question')
+@llm_rate_limit('quiz_new_question')
+@tracing.traced('api_new_question', root=True)
+async def api_new_question(request):
+    """Generate a new unique question"""
+    try:
+        await sync_to_async(_load_session)(request)
+        domain, topic = get_strategic_topic(request.session)
+        difficulty = get_adaptive_difficulty(request.session)
+        
+        logger.info(f"Question request - Domain: {domain}, Topic: {topic}, Difficulty: {difficulty}")
+        
+        # Generation loop with limited attempts
+        for attempt in range(8):
+            if budget.exhausted():
+                logger.warning("Question generation stopped: request time budget spent")
+                break
+            with tracing.span('attempt', attempt=attempt):
+                question_data = await agenerate_single_question(domain, topic, difficulty, request.session, attempt)
+                
+                if question_data and validate_question_quality(question_data, request.session):
+                    return await sync_to_async(save_and_return_question)(question_data, domain, topic, difficulty, request)
+            
+            await asyncio.sleep(0.2) # Small backoff
+        
+        # Fallback if AI fails
+        return await sync_to_async(get_intelligent_fallback)(domain, topic, request)
+        
+    except Exception as e:
+        logger.error(f"Failed to generate question: {e}", exc_info=True)
+        return await sync_to_async(get_emergency_fallback)(request)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@llm_rate_limit('quiz_check_answer')
+async def api_check_answer(request):
+    """Verify user selection and provide rich feedback"""
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+        choice = data.get("choice", "").strip()
+        if not choice: return JsonResponse({"error": "Missing choice"}, status=400)
+        
+        await sync_to_async(_load_session)(request)
+        current = request.session.get('current_question', {})
+        if not current: return JsonResponse({"error": "No active question"}, status=400)
+        
+        is_correct = choice == current.get('correct_letter')
+        qid = request.session.get('current_question_id')
+        if qid:
+            explanation, explanation_pending = await sync_to_async(stored_explanation)(qid)
+        else:
+            explanation, explanation_pending = await agenerate_question_explanation(current), False
+        
+        return await sync_to_async(check_answer_response)(
+            request, current, is_correct, qid, explanation, explanation_pending
+        )
+    except Exception as e:
+        logger.error(f"Check answer error: {e}")
+        return JsonResponse({"error": "Processing error"}, status=500)
@@ -4,7 +4,9 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Avg, Count, Q, F
 from datetime import datetime, timedelta
 import json
@@ -15,9 +17,16 @@ from .models import (
     TimedQuizSession, UserPreferences, PerformanceMetrics,
     QuestionCache, Leaderboard, UserProfile
 )
+from .utils import grade_submitted_answers, save_user_answers_bulk, mark_questions_used
+from . import jobs, prompt_budget, question_cache
+from ai import metrics
+from ai.llm import instrumentation, pool, routing, scheduler, warmup
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on questions reserved for one timed session
+MAX_TIMED_QUIZ_QUESTIONS = 100
+
 
 # ==================== QUESTION RATING ====================
 
@@ -118,7 +127,11 @@ def api_start_timed_quiz(request):
     try:
         data = json.loads(request.body)
         duration_minutes = data.get('duration', 30)
-        questions_count = data.get('questions_count', 20)
+        try:
+            questions_count = int(data.get('questions_count', 20))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'questions_count must be a whole number'}, status=400)
+        questions_count = max(1, min(questions_count, MAX_TIMED_QUIZ_QUESTIONS))
         
         # Check if user has an active session
         active_session = TimedQuizSession.objects.filter(
@@ -132,18 +145,44 @@ def api_start_timed_quiz(request):
                 'session_id': active_session.id
             }, status=400)
         
+        # Reserve the whole question set from the bank in one sampled query,
+        # then fill in the question bodies from the read-through cache
+        question_ids = list(
+            Question.objects.filter(is_approved=True)
+            .order_by('?')
+            .values_list('id', flat=True)[:questions_count]
+        )
+        cached = question_cache.get_questions(question_ids)
+        questions = [cached[qid] for qid in question_ids if qid in cached]
+        
+        if not questions:
+            return JsonResponse({'error': 'No questions available for a timed quiz yet'}, status=503)
+        
         # Create new session
         session = TimedQuizSession.objects.create(
             user=request.user,
             duration_minutes=duration_minutes,
-            questions_count=questions_count
+            questions_count=len(questions),
+            question_ids=[q['id'] for q in questions]
         )
+        mark_questions_used(session.question_ids)
         
         return JsonResponse({
             'success': True,
             'session_id': session.id,
             'duration_minutes': duration_minutes,
-            'questions_count': questions_count,
+            'questions_count': len(questions),
+            'questions': [
+                {
+                    'question_id': q['id'],
+                    'question': q['question_text'],
+                    'options': q['options'],
+                    'domain': q['domain'],
+                    'topic': q['topic'],
+                    'difficulty': q['difficulty']
+                }
+                for q in questions
+            ],
             'started_at': session.started_at.isoformat()
         })
         
@@ -156,29 +195,52 @@ def api_start_timed_quiz(request):
 @require_http_methods(["POST"])
 @login_required
 def api_submit_timed_quiz(request):
-    """Submit a timed quiz session"""
+    """Submit all answers of a timed quiz session in one payload and grade them server-side"""
     try:
         data = json.loads(request.body)
         session_id = data.get('session_id')
-        score = data.get('score', 0)
-        
-        session = TimedQuizSession.objects.get(id=session_id, user=request.user)
-        
-        if session.status == 'completed':
-            return JsonResponse({'error': 'Session already completed'}, status=400)
+        submitted = data.get('answers', [])
         
-        # Calculate time taken
-        time_taken = (timezone.now() - session.started_at).total_seconds()
+        if not isinstance(submitted, list):
+            return JsonResponse({'error': 'answers must be a list'}, status=400)
         
-        session.status = 'completed'
-        session.completed_at = timezone.now()
-        session.score = score
-        session.time_taken_seconds = int(time_taken)
-        session.save()
+        with transaction.atomic():
+            session = TimedQuizSession.objects.select_for_update().get(id=session_id, user=request.user)
+            
+            if session.status == 'completed':
+                return JsonResponse({'error': 'Session already completed'}, status=400)
+            
+            # Only answers to the questions reserved for this session count
+            graded = grade_submitted_answers(submitted, allowed_ids=session.question_ids)
+            
+            # Calculate time taken
+            now = timezone.now()
+            time_taken = (now - session.started_at).total_seconds()
+            score = sum(1 for _, _, is_correct, _ in graded if is_correct)
+            
+            attempt = QuizAttempt.objects.create(
+                user=request.user,
+                completed_at=now,
+                total_questions=session.questions_count,
+                correct_answers=score
+            )
+            save_user_answers_bulk(request.user, graded, quiz_attempt=attempt)
+            
+            session.status = 'completed'
+            session.completed_at = now
+            session.score = score
+            session.time_taken_seconds = int(time_taken)
+            session.save()
         
         return JsonResponse({
             'success': True,
             'score': score,
+            'answered': len(graded),
+            'total': session.questions_count,
+            'results': {
+                str(question.id): {'correct': is_correct, 'correct_answer': question.correct_answer}
+                for question, _, is_correct, _ in graded
+            },
             'time_taken_seconds': int(time_taken),
             'time_taken_formatted': f"{int(time_taken // 60)}m {int(time_taken % 60)}s"
         })
@@ -524,6 +586,85 @@ def api_update_preferences(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+# ==================== QUESTION CACHE ====================
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_question_cache_stats(request):
+    """Hit/miss ratios of the read-through question cache in this worker"""
+    return JsonResponse({
+        'success': True,
+        'stats': question_cache.get_stats(),
+        'rows': QuestionCache.objects.count()
+    })
+
+
+# ==================== BACKGROUND JOBS ====================
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_job_stats(request):
+    """Queue depth and job latency per background queue"""
+    return JsonResponse({
+        'success': True,
+        'queues': jobs.queue_stats()
+    })
+
+
+# ==================== LLM SCHEDULER ====================
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_llm_scheduler_stats(request):
+    """Queue depth, concurrency and queue time per LLM priority class in this worker"""
+    return JsonResponse({
+        'success': True,
+        'scheduler': scheduler.stats()
+    })
+
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_llm_backends(request):
+    """Health, load, latency and model warm-up of each Ollama backend as seen by this worker"""
+    return JsonResponse({
+        'success': True,
+        'backends': pool.stats(),
+        'warmup': warmup.stats()
+    })
+
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_llm_routes(request):
+    """Model, fallbacks, latency and token counts of each LLM route in this worker"""
+    return JsonResponse({
+        'success': True,
+        'routes': routing.stats()
+    })
+
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_question_prompt_stats(request):
+    """Prompt tokens saved by the keyword avoidance list vs. question diversity"""
+    return JsonResponse({
+        'success': True,
+        'stats': prompt_budget.stats()
+    })
+
+
+@require_http_methods(["GET"])
+@staff_member_required
+def api_llm_calls(request):
+    """Tokens/sec per task and model, call outcomes and cost per served question in this worker"""
+    return JsonResponse({
+        'success': True,
+        'summary': instrumentation.summary(),
+        'histograms': [h for h in metrics.snapshot()['histograms'] if h['name'].startswith('llm_')]
+    })
+
+
 # ==================== DASHBOARD ====================
 
 @login_required
@@ -166,12 +166,11 @@ function checkAnswer(choice, element) {
                 });
             }
 
-            // Always show explanation
+            // Always show explanation (generated in the background if not ready yet)
             if (res.explanation) {
-                const explEl = document.getElementById("explanation");
-                const explTextEl = document.getElementById("explanationText");
-                explTextEl.textContent = res.explanation;
-                explEl.style.display = "block";
+                showExplanation(res.explanation);
+            } else if (res.explanation_pending && res.question_id) {
+                pollExplanation(res.question_id, 0);
             }
 
             updateStats();
@@ -187,6 +186,32 @@ function checkAnswer(choice, element) {
         });
 }
 
+function showExplanation(text) {
+    const explEl = document.getElementById("explanation");
+    const explTextEl = document.getElementById("explanationText");
+    explTextEl.textContent = text;
+    explEl.style.display = "block";
+}
+
+function pollExplanation(questionId, attempt) {
+    // Give up after ~30s; stop if the user already moved on to another question
+    if (attempt >= 20 || questionId !== currentQuestionId) return;
+
+    setTimeout(() => {
+        fetch(`/quiz/api/explanation/${questionId}/`)
+            .then((r) => r.json())
+            .then((res) => {
+                if (questionId !== currentQuestionId) return;
+                if (res.explanation) {
+                    showExplanation(res.explanation);
+                } else if (res.pending) {
+                    pollExplanation(questionId, attempt + 1);
+                }
+            })
+            .catch((err) => console.error(err));
+    }, 1500);
+}
+
 function toggleBookmark() {
     if (!currentQuestionId) return;
     
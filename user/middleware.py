@@ -4,17 +4,13 @@ from django.conf import settings
 from django.core.cache import cache
 from django.http import HttpResponseForbidden
 from django.urls import resolve
+from django.utils.deprecation import MiddlewareMixin
 
 logger = logging.getLogger(__name__)
 
-class LoginAttemptMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        response = self.get_response(request)
-        return response
-
+class LoginAttemptMiddleware(MiddlewareMixin):
+    # MiddlewareMixin makes this usable in both sync and async stacks, so under ASGI
+    # async views are not forced onto a thread by this middleware
     def process_view(self, request, view_func, view_args, view_kwargs):
         # Only process login attempts
         if resolve(request.path_info).url_name == 'login' and request.method == 'POST':